@@ -1,30 +1,424 @@
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
 import duckdb
-from typing import Generator
+from typing import Generator, Iterator, List, Optional
+
+from backend.utils.metrics import InstrumentedConnection
+
+# === CHEMINS ===
+DATA_DIR = Path("data")
+PROCESSED_DIR = DATA_DIR / "processed"
+DB_PATH = DATA_DIR / "lablens.duckdb"
+# Chaque ingestion construit une version complète dans versions/<id>/ ; `current` est un lien
+# symbolique vers la version publiée, remplacé atomiquement. Les chemins ci-dessous passent par lui.
+VERSIONS_DIR = PROCESSED_DIR / "versions"
+CURRENT_DIR = PROCESSED_DIR / "current"
+KEEP_VERSIONS = int(os.getenv("DATASET_KEEP_VERSIONS", "3"))
+RESULTS_PATH = CURRENT_DIR / "results.parquet"
+PANELS_PATH = CURRENT_DIR / "panels.parquet"
+REPEATS_PATH = CURRENT_DIR / "repeats.parquet"
+PAIRS_PATH = CURRENT_DIR / "pairs.parquet"
+SERVICE_PAIRS_PATH = CURRENT_DIR / "service_pairs.parquet"
+TEST_STATS_PATH = CURRENT_DIR / "test_stats.parquet"
+PROFILE_PATH = CURRENT_DIR / "profile.json"
+# Ajouts incrémentaux de results : un fichier par lot et par mois, listés dans le manifeste
+RESULTS_APPEND_DIR = CURRENT_DIR / "results_appends"
+APPEND_MANIFEST_PATH = RESULTS_APPEND_DIR / "manifest.json"
+
+# Tables persistantes -> fichier Parquet source
+TABLE_SOURCES = {
+    "results": RESULTS_PATH,
+    "panels": PANELS_PATH,
+    "repeats": REPEATS_PATH,
+    "pairs": PAIRS_PATH,
+    "service_pairs": SERVICE_PAIRS_PATH,
+    "test_stats": TEST_STATS_PATH,
+}
+
+# Ajouts incrémentaux de chaque table, à côté de son Parquet principal : <table>_appends/manifest.json
+# liste les fichiers dans l'ordre d'ajout (results : un par lot et par mois ; tables dérivées : un delta par lot)
+APPEND_DIRS = {name: CURRENT_DIR / f"{path.stem}_appends" for name, path in TABLE_SOURCES.items()}
+
+# Fusion des deltas des tables dérivées avec leur Parquet principal (voir source_select) :
+# - clés remplacées : les lignes du fichier le plus récent remplacent celles de même clé
+DELTA_REPLACE_KEYS = {
+    "panels": ["numorden"],
+    "repeats": ["numorden"],
+    "test_stats": ["test_key"],
+}
+# - comptes additionnés par clé (deltas signés) ; les clés tombées à zéro disparaissent
+DELTA_SUM_KEYS = {
+    "pairs": (["service", "year_month", "test1", "test2"], "co_occurrences"),
+    "service_pairs": (["service1", "service2"], "freq"),
+}
+
+# Index créés après chargement (mêmes colonnes que scripts/03_index_and_panels.py)
+TABLE_INDEXES = {
+    "results": ["numorden", "nombre", "nombre2", "Date", "sexo"],
+    "panels": ["numorden"],
+    "repeats": ["numorden"],
+    "test_stats": ["test_key"],
+}
+
+POOL_SIZE = 8
+
+_db: duckdb.DuckDBPyConnection | None = None
+_db_lock = threading.Lock()
+_write_lock = threading.Lock()
+_pool: "queue.LifoQueue[InstrumentedConnection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+_loaded_tables: set[str] = set()
+_version_cache: tuple = (None, "empty")
+_sandbox: tuple = (None, None)
+
+
+def _get_db() -> duckdb.DuckDBPyConnection:
+    """
+    Connexion principale sur data/lablens.duckdb, ouverte une seule fois par process.
+    Un seul process peut ouvrir le fichier en écriture : lancer uvicorn avec un seul worker.
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+                _db = duckdb.connect(DB_PATH.as_posix())
+    return _db
+
 
 def get_con() -> Generator[duckdb.DuckDBPyConnection, None, None]:
     """
-    Crée une connexion DuckDB en mémoire pour exécuter les requêtes.
-    Les données sont lues depuis les fichiers Parquet, donc pas besoin de fichier .duckdb persistant.
+    Fournit un curseur de lecture sur la base persistante.
+    Les curseurs sont réutilisés via un pool : pas de connexion ni de relecture Parquet par requête.
+    Ils sont instrumentés (durées et lignes par requête SQL, voir backend/utils/metrics.py).
+    """
+    try:
+        cur = _pool.get_nowait()
+    except queue.Empty:
+        cur = InstrumentedConnection(_get_db().cursor())
+    try:
+        yield cur
+    finally:
+        cur.disable_profiling()
+        try:
+            _pool.put_nowait(cur)
+        except queue.Full:
+            cur.close()
+
+
+@contextmanager
+def write_connection() -> Iterator[duckdb.DuckDBPyConnection]:
+    """
+    Curseur d'écriture (ingestion). Les écritures sont sérialisées ; les lecteurs
+    continuent de voir l'ancienne version des tables jusqu'au commit (MVCC DuckDB).
     """
-    con = duckdb.connect(":memory:")
+    with _write_lock:
+        cur = InstrumentedConnection(_get_db().cursor())
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+
+@contextmanager
+def try_write_connection() -> Iterator[Optional[duckdb.DuckDBPyConnection]]:
+    """Comme write_connection, sans attendre : None si une écriture (ingestion, ajout) est en cours."""
+    if not _write_lock.acquire(blocking=False):
+        yield None
+        return
     try:
-        yield con
+        cur = InstrumentedConnection(_get_db().cursor())
+        try:
+            yield cur
+        finally:
+            cur.close()
     finally:
-        con.close()
+        _write_lock.release()
+
+
+def sandbox_cursor(names: List[str]) -> duckdb.DuckDBPyConnection:
+    """
+    Curseur sur une base en mémoire distincte, qui ne contient que des vues sur les Parquet
+    de la version publiée pour les tables `names` : les autres tables (cohortes, lablens_meta...)
+    n'y existent pas et rien n'est modifiable dans la base persistante.
+    Recréée à la publication d'une nouvelle version ; les filtres sont poussés dans les Parquet.
+    """
+    global _sandbox
+    key = (current_dir(), tuple(names))
+    with _db_lock:
+        if _sandbox[0] != key:
+            con = duckdb.connect()
+            for name in names:
+                if in_version(TABLE_SOURCES[name], key[0]).exists():
+                    con.execute(f"CREATE VIEW {name} AS {source_select(name, key[0])}")
+            # L'ancienne base est libérée avec ses derniers curseurs
+            _sandbox = (key, con)
+        return _sandbox[1].cursor()
+
+
+def has_table(name: str) -> bool:
+    return name in _loaded_tables
+
+
+def current_dir() -> Path:
+    """
+    Dossier de la version publiée, résolu : un lecteur qui garde ce chemin continue
+    de lire la même version même si une nouvelle est publiée entre-temps.
+    """
+    return CURRENT_DIR.resolve() if CURRENT_DIR.is_symlink() else CURRENT_DIR
+
+
+def in_version(path: Path, root: Optional[Path] = None) -> Path:
+    """Chemin `path` (sous CURRENT_DIR) transposé dans la version `root` (par défaut la version publiée)."""
+    return (root or current_dir()) / path.relative_to(CURRENT_DIR)
+
+
+def new_version_dir() -> Path:
+    """Dossier vide pour construire une nouvelle version ; invisible tant qu'elle n'est pas publiée."""
+    root = VERSIONS_DIR / datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    root.mkdir(parents=True)
+    return root
+
+
+def fork_version(base: Optional[Path] = None) -> Path:
+    """
+    Nouvelle version partant de `base` (par défaut la version publiée), pour un ajout incrémental :
+    le Parquet de chaque table et ses ajouts sont liés en dur (aucune copie), les manifestes aussi
+    (ils seront remplacés, jamais modifiés sur place). Seul le profil est réécrit.
+    """
+    current, root = base or current_dir(), new_version_dir()
+    sources = []
+    for name, path in TABLE_SOURCES.items():
+        sources += [in_version(path, current), _manifest_path(name, current), *append_files(current, name)]
+    for src in sources:
+        if not src.exists():
+            continue
+        dst = root / src.relative_to(current)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    return root
+
+
+def publish_version(root: Path):
+    """Bascule atomique du lien `current` vers `root`, puis purge des anciennes versions."""
+    tmp_link = PROCESSED_DIR / "current.tmp"
+    if tmp_link.is_symlink() or tmp_link.exists():
+        tmp_link.unlink()
+    os.symlink(os.path.relpath(root, PROCESSED_DIR), tmp_link, target_is_directory=True)
+    os.replace(tmp_link, CURRENT_DIR)
+    print(f"✅ Version {root.name} publiée.")
+    prune_versions()
+
+
+def list_versions() -> List[Path]:
+    """Versions conservées, de la plus ancienne à la plus récente."""
+    if not VERSIONS_DIR.exists():
+        return []
+    return sorted(p for p in VERSIONS_DIR.iterdir() if p.is_dir())
+
+
+def prune_versions(keep: int = KEEP_VERSIONS):
+    """
+    Garde les `keep` versions les plus récentes et la version publiée.
+    Les requêtes en cours sur une version supprimée terminent sur leurs fichiers déjà ouverts.
+    """
+    current = current_dir()
+    versions = list_versions()
+    for root in versions[: max(0, len(versions) - keep)]:
+        if root.resolve() != current:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def migrate_to_versioned_layout():
+    """
+    Ancien layout (fichiers directement dans data/processed) : déplacés dans une première version.
+    Chaque fichier présent est migré, même sans results.parquet (ex: panels / repeats seuls).
+    """
+    legacy = [PROCESSED_DIR / p.relative_to(CURRENT_DIR) for p in [*TABLE_SOURCES.values(), PROFILE_PATH, *APPEND_DIRS.values()]]
+    if CURRENT_DIR.is_symlink() or not any(path.exists() for path in legacy):
+        return
+    root = new_version_dir()
+    for path in legacy:
+        if path.exists():
+            # rename : mtime conservé, les tables déjà chargées ne sont pas rechargées
+            os.replace(path, root / path.name)
+    publish_version(root)
+
+
+def _manifest_path(name: str, root: Optional[Path] = None) -> Path:
+    return in_version(APPEND_DIRS[name], root) / "manifest.json"
+
+
+def append_files(root: Optional[Path] = None, name: str = "results") -> List[Path]:
+    """Fichiers ajoutés à la table `name` depuis son dernier export complet, dans l'ordre d'ajout."""
+    manifest_path = _manifest_path(name, root)
+    if not manifest_path.exists():
+        return []
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    return [manifest_path.parent / f for f in manifest["files"]]
+
+
+def write_append_manifest(files: List[Path], root: Optional[Path] = None, name: str = "results"):
+    """Réécrit le manifeste de la table dans la version `root` de façon atomique : c'est lui qui y rend un lot visible."""
+    manifest_path = _manifest_path(name, root)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps({"files": [f.relative_to(manifest_path.parent).as_posix() for f in files]}, indent=2), encoding="utf-8")
+    os.replace(tmp_path, manifest_path)
+
+
+def clear_appends(name: str, root: Optional[Path] = None):
+    """Oublie les ajouts de la table (son Parquet principal vient d'être réécrit en entier)."""
+    shutil.rmtree(in_version(APPEND_DIRS[name], root), ignore_errors=True)
+
+
+def source_files(name: str, root: Optional[Path] = None) -> List[Path]:
+    """Fichiers Parquet composant une table : le fichier principal, puis ses ajouts."""
+    root = root or current_dir()
+    path = in_version(TABLE_SOURCES[name], root)
+    if not path.exists():
+        return []
+    return [path] + append_files(root, name)
+
+
+def source_select(name: str, root: Optional[Path] = None) -> str:
+    """
+    Requête reconstituant la table depuis ses fichiers : simple concaténation pour results,
+    fusion des deltas pour les tables dérivées (DELTA_REPLACE_KEYS, DELTA_SUM_KEYS).
+    """
+    files = source_files(name, root)
+    if len(files) == 1 or name not in DELTA_REPLACE_KEYS and name not in DELTA_SUM_KEYS:
+        return "SELECT * FROM read_parquet([{}])".format(", ".join(f"'{f.as_posix()}'" for f in files))
+
+    parts = " UNION ALL BY NAME ".join(f"SELECT *, {i} AS _part FROM read_parquet('{f.as_posix()}')" for i, f in enumerate(files))
+    if name in DELTA_REPLACE_KEYS:
+        keys = ", ".join(DELTA_REPLACE_KEYS[name])
+        return f"""
+            SELECT * EXCLUDE (_part) FROM ({parts})
+            QUALIFY _part = max(_part) OVER (PARTITION BY {keys})
+            ORDER BY {keys}
+        """
+    keys, value = DELTA_SUM_KEYS[name]
+    keys = ", ".join(keys)
+    return f"""
+        SELECT {keys}, CAST(SUM({value}) AS BIGINT) AS {value} FROM ({parts})
+        GROUP BY {keys}
+        HAVING SUM({value}) > 0
+        ORDER BY {keys}
+    """
+
+
+def dataset_version(root: Optional[Path] = None) -> str:
+    """
+    Empreinte du jeu de données (version publiée par défaut) : mtime + taille + hash de la fin de
+    results.parquet (le footer Parquet contient les statistiques de chaque row group), plus le
+    manifeste des ajouts. Recalculée uniquement quand un de ces fichiers change ; coût de deux stat() sinon.
+    """
+    global _version_cache
+    results_path = in_version(RESULTS_PATH, root)
+    manifest_path = in_version(APPEND_MANIFEST_PATH, root)
+    if not results_path.exists():
+        return "empty"
+    st = results_path.stat()
+    manifest = manifest_path.stat() if manifest_path.exists() else None
+    key = (st.st_ino, st.st_mtime_ns, st.st_size, manifest and (manifest.st_ino, manifest.st_mtime_ns, manifest.st_size))
+    if _version_cache[0] == key:
+        return _version_cache[1]
+
+    h = hashlib.blake2b(f"{st.st_mtime_ns}:{st.st_size}".encode(), digest_size=8)
+    with open(results_path, "rb") as f:
+        f.seek(max(0, st.st_size - 65536))
+        h.update(f.read())
+    if manifest is not None:
+        h.update(manifest_path.read_bytes())
+    _version_cache = (key, h.hexdigest())
+    return _version_cache[1]
+
+
+def _source_mtime(name: str, root: Optional[Path] = None) -> int:
+    paths = [in_version(TABLE_SOURCES[name], root)]
+    manifest_path = _manifest_path(name, root)
+    if manifest_path.exists():
+        paths.append(manifest_path)
+    return max(p.stat().st_mtime_ns for p in paths)
+
+
+def _ensure_meta(con: duckdb.DuckDBPyConnection):
+    con.execute("CREATE TABLE IF NOT EXISTS lablens_meta (name VARCHAR PRIMARY KEY, source_mtime BIGINT)")
+
+
+def load_tables(con: duckdb.DuckDBPyConnection, names=None, force: bool = False, root: Optional[Path] = None):
+    """
+    Charge les fichiers Parquet (de la version `root`, par défaut la version publiée) dans les
+    tables persistantes et recrée les index.
+    Une table n'est rechargée que si son Parquet a changé depuis le dernier chargement.
+    """
+    root = root or current_dir()
+    _ensure_meta(con)
+    loaded = dict(con.execute("SELECT name, source_mtime FROM lablens_meta").fetchall())
+    existing = {r[0] for r in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+
+    for name in names or TABLE_SOURCES:
+        path = in_version(TABLE_SOURCES[name], root)
+        if not path.exists():
+            if name in existing:
+                _loaded_tables.add(name)
+            continue
+
+        if force or name not in existing or loaded.get(name) != _source_mtime(name, root):
+            con.execute(f"CREATE OR REPLACE TABLE {name} AS {source_select(name, root)}")
+            register_table(con, name, root)
+            print(f"✅ Table {name} chargée.")
+        _loaded_tables.add(name)
+
+
+def register_table(con: duckdb.DuckDBPyConnection, name: str, root: Optional[Path] = None):
+    """
+    Déclare une table construite directement dans la base (ex: tables dérivées)
+    et synchronisée avec son Parquet dans la version `root` : évite de la recharger
+    au prochain démarrage une fois cette version publiée.
+    """
+    _create_indexes(con, name)
+    if name in TABLE_SOURCES and in_version(TABLE_SOURCES[name], root).exists():
+        con.execute("INSERT OR REPLACE INTO lablens_meta VALUES (?, ?)", [name, _source_mtime(name, root)])
+    _loaded_tables.add(name)
+
+
+def _create_indexes(con: duckdb.DuckDBPyConnection, name: str):
+    existing = [c[1] for c in con.execute(f"PRAGMA table_info({name})").fetchall()]
+    for col in TABLE_INDEXES.get(name, []):
+        if col in existing:
+            try:
+                con.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_{col} ON {name} ({col})")
+            except Exception as e:
+                print(f"⚠️ Index {name}.{col} ignoré : {e}")
+
 
 def init_db():
     """
     Fonction appelée au démarrage de l'application (via main.py).
-    S'assure que les dossiers de données existent.
+    S'assure que les dossiers de données existent et charge les tables persistantes.
     """
     required_paths = [
         Path("data/raw"),
         Path("data/cleaned"),
         Path("data/processed")
     ]
-    
+
     for p in required_paths:
         p.mkdir(parents=True, exist_ok=True)
-        
-    print("✅ Base de données (dossiers) initialisée.")
\ No newline at end of file
+    migrate_to_versioned_layout()
+
+    with write_connection() as con:
+        load_tables(con)
+
+    print("✅ Base de données initialisée.")
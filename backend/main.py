@@ -1,7 +1,11 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from backend.routers import loader, stats, panels, repeats, coordering, export
+from backend.routers import loader, stats, panels, repeats, coordering, export, cohorts
 from backend.database import init_db
+from backend.services.migrations import migrate_dataset
+from backend.utils.cache import response_cache
+from backend.utils.metrics import MetricsMiddleware, get_profile, render_metrics
 from backend.routers import llm
 
 
@@ -19,12 +23,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],      # Autorise toutes les méthodes (GET, POST...)
     allow_headers=["*"],      # Autorise tous les headers
+    expose_headers=["X-DuckDB-Profile-Id"],
 )
+# Latences par endpoint et en-tête opt-in X-DuckDB-Profile (voir backend/utils/metrics.py)
+app.add_middleware(MetricsMiddleware)
 
 # Initialisation de la DB au démarrage
 @app.on_event("startup")
 def on_startup():
     init_db()
+    migrate_dataset()
 
 # Inclusion des routers
 app.include_router(loader.router)
@@ -33,8 +41,26 @@ app.include_router(panels.router)
 app.include_router(repeats.router)
 app.include_router(coordering.router)
 app.include_router(export.router)
+app.include_router(cohorts.router)
 app.include_router(llm.router)
 
 @app.get("/")
 def read_root():
-    return {"message": "LabLens Backend is running 🚀"}
\ No newline at end of file
+    return {"message": "LabLens Backend is running 🚀"}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return response_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Métriques au format texte Prometheus (HTTP, SQL, LLM)."""
+    return render_metrics()
+
+@app.get("/metrics/profiles/{profile_id}")
+def metrics_profile(profile_id: str):
+    """Profil DuckDB d'une requête envoyée avec l'en-tête X-DuckDB-Profile: 1."""
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profil inconnu : {profile_id}")
+    return profile
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException
+import duckdb
+from backend.database import get_con, has_table, write_connection
+from backend.schemas import CohortFilter
+from backend.services.cohorts import CohortNotFound, delete_cohort, ensure_current, list_cohorts, save_cohort
+from backend.utils.cache import response_cache
+
+router = APIRouter(prefix="/cohorts", tags=["cohorts"])
+
+@router.get("")
+def get_cohorts(con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    return list_cohorts(con)
+
+@router.post("/{name}")
+def create_cohort(name: str, filters: CohortFilter):
+    """
+    Enregistre (ou remplace) une cohorte : le filtre est évalué une fois, ses row_id et patients
+    sont stockés. Les endpoints d'analyse acceptent ensuite ?cohort=<name>.
+    """
+    if not has_table("results"):
+        raise HTTPException(status_code=400, detail="Données manquantes.")
+    try:
+        with write_connection() as con:
+            meta = save_cohort(con, name, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        # Une cohorte remplacée change le résultat des réponses en cache qui la référencent
+        response_cache.clear()
+    return meta
+
+@router.get("/{name}")
+def get_cohort_detail(name: str):
+    try:
+        return ensure_current(name)
+    except CohortNotFound:
+        raise HTTPException(status_code=404, detail=f"Cohorte inconnue : {name}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/{name}")
+def remove_cohort(name: str):
+    try:
+        with write_connection() as con:
+            delete_cohort(con, name)
+    except CohortNotFound:
+        raise HTTPException(status_code=404, detail=f"Cohorte inconnue : {name}")
+    finally:
+        response_cache.clear()
+    return {"deleted": name}
@@ -1,90 +1,126 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import datetime
+from typing import Callable, Optional
 import duckdb
-from backend.database import get_con
-from pathlib import Path
+from backend.database import get_con, has_table
+from backend.services.cohorts import CohortNotFound, scoped_table
+from backend.services.derived import PANEL_TESTS_FROM_RESULTS, pairs_select, service_pairs_select
+from backend.utils.cache import cached
+from backend.utils.filter_dsl import parse_date
 
 router = APIRouter(prefix="/coordering", tags=["coordering"])
 
-# Chemin vers le fichier généré par le loader
-PARQUET_PATH = Path("data/processed/results.parquet")
-
-def ensure_parquet_exists():
-    if not PARQUET_PATH.exists():
+def ensure_data_loaded(table: str):
+    if not has_table(table):
         raise HTTPException(status_code=400, detail="Aucune donnée analysée. Veuillez uploader un fichier d'abord.")
-    return f"'{PARQUET_PATH.as_posix()}'"
+    return table
+
+def _cohort_cte(name: str, select: Callable[[str], str], cohort: Optional[str]) -> str:
+    """
+    Sans cohorte : aucune CTE, la table matérialisée `name` est lue.
+    Avec cohorte : CTE `name` calculée sur les lignes de la cohorte (masque la table).
+    """
+    if not cohort:
+        return ""
+    try:
+        source = scoped_table("results", cohort)
+    except CohortNotFound:
+        raise HTTPException(status_code=404, detail=f"Cohorte inconnue : {cohort}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return f"{name} AS MATERIALIZED ({select(source)}),"
+
+def _month_key(value: Optional[str]) -> Optional[str]:
+    """Borne de période -> clé 'YYYY-MM' (accepte 'YYYY-MM' ou une date complète)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        if len(value) == 7:
+            # Mois validé (rejette '2023-13')
+            return datetime.strptime(value, "%Y-%m").strftime("%Y-%m")
+        return parse_date(value).strftime("%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Date invalide : {value}")
 
 @router.get("/top-pairs")
-def get_top_coordered(limit: int = 50, con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    source = ensure_parquet_exists()
-    
+@cached
+def get_top_coordered(
+    limit: int = Query(50, ge=1),
+    service: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    cohort: Optional[str] = None,
+    con: duckdb.DuckDBPyConnection = Depends(get_con),
+):
+    """
+    Top-k des paires de tests co-prescrites, lu dans la table matérialisée `pairs`.
+    Filtres optionnels : service (nombre2) et période [start, end] à la granularité du mois.
+    Avec ?cohort=, les paires sont recalculées sur les lignes de la cohorte.
+    """
+    ensure_data_loaded("pairs")
+    cohort_cte = _cohort_cte("pairs", lambda src: pairs_select(src, PANEL_TESTS_FROM_RESULTS), cohort)
+
+    where = ["service IS NULL"] if not service else ["service = ?"]
+    params: list = [] if not service else [service]
+    start_key, end_key = _month_key(start), _month_key(end)
+    if start_key:
+        where.append("year_month >= ?")
+        params.append(start_key)
+    if end_key:
+        where.append("year_month <= ?")
+        params.append(end_key)
+
     try:
-        # On requête directement le fichier Parquet
-        query = f"""
+        df = con.execute(f"""
+            {"WITH " + cohort_cte.rstrip(",") if cohort_cte else ""}
             SELECT
-                r1.nombre AS test1,
-                r2.nombre AS test2,
-                COUNT(*) AS co_occurrences
-            FROM read_parquet({source}) r1
-            JOIN read_parquet({source}) r2 
-                ON r1.numorden = r2.numorden 
-                AND r1.Date = r2.Date
-            WHERE r1.nombre < r2.nombre
+                test1,
+                test2,
+                CAST(SUM(co_occurrences) AS BIGINT) AS co_occurrences
+            FROM pairs
+            WHERE {" AND ".join(where)}
             GROUP BY test1, test2
-            ORDER BY co_occurrences DESC
-            LIMIT {limit}
-        """
-        df = con.execute(query).fetchdf()
+            ORDER BY co_occurrences DESC, test1, test2
+            LIMIT ?
+        """, params + [limit]).fetchdf()
         return df.to_dict(orient="records")
     except Exception as e:
-        print(f"Error in top-pairs: {e}")
-        return []
+        print(f"❌ Erreur top-pairs : {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/matrix-by-service")
-def get_matrix_by_service(limit: int = 15, con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    source = ensure_parquet_exists()
+@cached
+def get_matrix_by_service(limit: int = Query(15, ge=1), cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    """
+    Matrice de co-occurrence entre les `limit` services les plus actifs,
+    découpée dans la table précalculée `service_pairs` (sans relire `results`).
+    Avec ?cohort=, la matrice est recalculée sur les lignes de la cohorte.
+    """
+    ensure_data_loaded("service_pairs")
+    cohort_cte = _cohort_cte("service_pairs", service_pairs_select, cohort)
 
     try:
-        # Étape 1 : Récupérer les services les plus fréquents
-        top_services_df = con.execute(f"""
-            SELECT nombre2 AS service
-            FROM read_parquet({source})
-            WHERE nombre2 IS NOT NULL 
-              AND TRIM(nombre2) != ''
-              AND LOWER(nombre2) NOT LIKE '%unknown%'
-            GROUP BY nombre2
-            ORDER BY COUNT(*) DESC
-            LIMIT {limit}
-        """).fetchdf()
-
-        top_services = top_services_df['service'].tolist()
-
-        if not top_services:
-            return []
-
-        # Étape 2 : Matrice de co-occurrence
-        # On échappe les apostrophes pour éviter les erreurs SQL
-        services_str = "', '".join([s.replace("'", "''") for s in top_services])
-        
-        # J'ai SUPPRIMÉ le commentaire "// évite doublons" qui faisait planter ton code
-        query = f"""
-            SELECT 
-                r1.nombre2 AS service1,
-                r2.nombre2 AS service2,
-                COUNT(*) AS freq
-            FROM read_parquet({source}) r1
-            JOIN read_parquet({source}) r2 
-                ON r1.numorden = r2.numorden 
-                AND r1.Date = r2.Date
-            WHERE r1.nombre2 IN ('{services_str}')
-              AND r2.nombre2 IN ('{services_str}')
-              AND r1.nombre2 < r2.nombre2
-            GROUP BY service1, service2
+        # Top services = diagonale de la matrice (patient-jours par service)
+        df = con.execute(f"""
+            WITH {cohort_cte} top_services AS (
+                SELECT service1 AS service
+                FROM service_pairs
+                WHERE service1 = service2
+                  AND TRIM(service1) != ''
+                  AND LOWER(service1) NOT LIKE '%unknown%'
+                ORDER BY freq DESC, service1
+                LIMIT ?
+            )
+            SELECT service1, service2, freq
+            FROM service_pairs
+            WHERE service1 < service2
+              AND service1 IN (SELECT service FROM top_services)
+              AND service2 IN (SELECT service FROM top_services)
             ORDER BY freq DESC
-        """
-        
-        df = con.execute(query).fetchdf()
+        """, [limit]).fetchdf()
         return df.to_dict(orient="records")
         
     except Exception as e:
         print(f"❌ Erreur matrix-by-service : {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
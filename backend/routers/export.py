@@ -1,49 +1,186 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import StreamingResponse
-import duckdb
-import pandas as pd
 from pathlib import Path
-import io
+from typing import Iterable, Iterator, List, Optional
+import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.dataset as ds
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from backend.database import PANELS_PATH, REPEATS_PATH, RESULTS_PATH, PAIRS_PATH, SERVICE_PAIRS_PATH, source_files, source_select
+from backend.schemas import CohortFilter
+from backend.utils.filter_dsl import CompiledFilter, compile_filter
+from backend.utils.metrics import InstrumentedConnection
 
 router = APIRouter(prefix="/export", tags=["export"])
 
-# Chemins vers les fichiers générés
-DATA_DIR = Path("data/processed")
-PANELS_PATH = DATA_DIR / "panels.parquet"
-REPEATS_PATH = DATA_DIR / "repeats.parquet"
-RESULTS_PATH = DATA_DIR / "results.parquet"
+# Jeux de données exportables -> (Parquet source, nom du fichier téléchargé sans extension)
+DATASETS = {
+    "panels": (PANELS_PATH, "panels_export"),
+    "repeats": (REPEATS_PATH, "repeats_export"),
+    "results": (RESULTS_PATH, "full_results_export"),
+    "pairs": (PAIRS_PATH, "pairs_export"),
+    "service_pairs": (SERVICE_PAIRS_PATH, "service_pairs_export"),
+}
+
+# Format -> (media type, extension)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+BATCH_ROWS = 64_000
+
+
+class _ChunkSink:
+    """Fichier en écriture minimal : accumule les octets écrits par les writers Arrow jusqu'au prochain drain()."""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _csv_ready(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Le writer CSV ne gère pas les listes (ex: tests_list) : on les aplatit en texte séparé par des virgules."""
+    columns = []
+    for col in batch.columns:
+        if pa.types.is_list(col.type) or pa.types.is_large_list(col.type):
+            col = pc.binary_join(col.cast(pa.list_(pa.string())), ",")
+        columns.append(col)
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
 
-def stream_csv(path: Path, filename: str):
-    """Fonction utilitaire pour streamer un CSV à partir d'un Parquet"""
-    if not path.exists():
+def _open_writer(fmt: str, sink: _ChunkSink, schema: pa.Schema):
+    if fmt == "csv":
+        return pcsv.CSVWriter(sink, schema)
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, schema, compression="snappy")
+    return ipc.new_stream(sink, schema)
+
+
+def _iter_batches(
+    paths: List[Path], columns: Optional[List[str]], compiled: Optional[CompiledFilter], merge: Optional[str] = None,
+) -> Iterable[pa.RecordBatch]:
+    """
+    Record batches des fichiers Parquet de la table (results : fichier principal + ajouts), filtrés si besoin. Le filtre est appliqué à la lecture :
+    pyarrow.dataset élague les row groups par leurs statistiques ; les filtres sans
+    équivalent Arrow passent par DuckDB, qui pousse aussi les prédicats dans le Parquet.
+    Table dérivée avec deltas : `merge` (voir database.source_select) est exécutée par DuckDB.
+    """
+    if merge is not None:
+        con = InstrumentedConnection(duckdb.connect(":memory:"))
+        try:
+            select = ", ".join(f'"{c}"' for c in columns) if columns else "*"
+            where = compiled.sql if compiled is not None else "TRUE"
+            params = compiled.params if compiled is not None else []
+            yield from con.execute(f"SELECT {select} FROM ({merge}) WHERE {where}", params).fetch_record_batch(BATCH_ROWS)
+        finally:
+            con.close()
+    elif compiled is None:
+        for path in paths:
+            yield from pq.ParquetFile(path).iter_batches(batch_size=BATCH_ROWS, columns=columns)
+    elif compiled.arrow is not None:
+        yield from ds.dataset([p.as_posix() for p in paths], format="parquet").to_batches(columns=columns, filter=compiled.arrow, batch_size=BATCH_ROWS)
+    else:
+        con = InstrumentedConnection(duckdb.connect(":memory:"))
+        try:
+            select = ", ".join(f'"{c}"' for c in columns) if columns else "*"
+            files = ", ".join(f"'{p.as_posix()}'" for p in paths)
+            reader = con.execute(
+                f"SELECT {select} FROM read_parquet([{files}]) WHERE {compiled.sql}", compiled.params
+            ).fetch_record_batch(BATCH_ROWS)
+            yield from reader
+        finally:
+            con.close()
+
+
+def _iter_export(
+    paths: List[Path], fmt: str, columns: Optional[List[str]], compiled: Optional[CompiledFilter] = None, merge: Optional[str] = None,
+) -> Iterator[bytes]:
+    """
+    Lit le Parquet par record batches et les ré-encode au fil de l'eau :
+    la mémoire reste bornée par BATCH_ROWS et le premier octet part immédiatement.
+    """
+    sink = _ChunkSink()
+    writer = None
+    for batch in _iter_batches(paths, columns, compiled, merge):
+        if fmt == "csv":
+            batch = _csv_ready(batch)
+        if writer is None:
+            writer = _open_writer(fmt, sink, batch.schema)
+        writer.write_batch(batch)
+        yield sink.drain()
+
+    if writer is None:
+        # Fichier vide : on écrit au moins l'en-tête / le schéma
+        schema = pq.read_schema(paths[0])
+        if columns:
+            schema = pa.schema([schema.field(c) for c in columns])
+        if fmt == "csv":
+            schema = _csv_ready(pa.RecordBatch.from_pylist([], schema=schema)).schema
+        writer = _open_writer(fmt, sink, schema)
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(dataset: str, fmt: str = "csv", columns: Optional[str] = None, filters: Optional[CohortFilter] = None):
+    """Fonction utilitaire pour streamer un export (CSV, Parquet ou Arrow IPC) à partir d'un Parquet"""
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"Jeu de données inconnu : {dataset}")
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format non supporté : {fmt} (csv, parquet, arrow)")
+
+    _, basename = DATASETS[dataset]
+    filename = f"{basename}.{FORMATS[fmt][1]}"
+    paths = source_files(dataset)
+    if not paths:
         raise HTTPException(status_code=404, detail=f"Fichier de données non trouvé : {filename}")
 
-    try:
-        # On lit le parquet avec DuckDB puis convertit en Pandas pour l'export CSV facile
-        # Note : Pour des fichiers géants (>1Go), on ferait du streaming pur, 
-        # mais ici Pandas est suffisant et rapide.
-        con = duckdb.connect(":memory:")
-        df = con.execute(f"SELECT * FROM read_parquet('{path.as_posix()}')").fetchdf()
-        
-        # Buffer en mémoire pour le CSV
-        stream = io.StringIO()
-        df.to_csv(stream, index=False)
-        response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
-        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-        return response
-        
-    except Exception as e:
-        print(f"Erreur export CSV : {e}")
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la génération du CSV : {str(e)}")
-
-@router.get("/panels/csv")
-def export_panels_csv():
-    return stream_csv(PANELS_PATH, "panels_export.csv")
-
-@router.get("/repeats/csv")
-def export_repeats_csv():
-    return stream_csv(REPEATS_PATH, "repeats_export.csv")
-
-@router.get("/results/csv")
-def export_results_csv():
-    return stream_csv(RESULTS_PATH, "full_results_export.csv")
\ No newline at end of file
+    schema = pq.read_schema(paths[0])
+
+    # Projection de colonnes (?columns=a,b,c)
+    selected = None
+    if columns:
+        selected = [c.strip() for c in columns.split(",") if c.strip()]
+        available = schema.names
+        unknown = [c for c in selected if c not in available]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Colonnes inconnues : {unknown}")
+
+    compiled = None
+    if filters is not None and filters.conditions:
+        try:
+            compiled = compile_filter(filters, schema)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Deltas d'une table dérivée : fusionnés à la lecture ; results et ses ajouts se lisent tels quels
+    merge = source_select(dataset) if dataset != "results" and len(paths) > 1 else None
+    response = StreamingResponse(_iter_export(paths, fmt, selected, compiled, merge), media_type=FORMATS[fmt][0])
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+@router.get("/{dataset}/{fmt}")
+def export_dataset(dataset: str, fmt: str, columns: Optional[str] = Query(None, description="Colonnes à exporter, séparées par des virgules")):
+    return stream_export(dataset, fmt, columns)
+
+@router.post("/{dataset}/{fmt}")
+def export_filtered_dataset(dataset: str, fmt: str, filters: CohortFilter, columns: Optional[str] = Query(None, description="Colonnes à exporter, séparées par des virgules")):
+    """Export d'une cohorte : le filtre est poussé dans la lecture du Parquet."""
+    return stream_export(dataset, fmt, columns, filters)
@@ -1,36 +1,134 @@
-from fastapi import APIRouter, HTTPException
-from pathlib import Path
+import asyncio
+import json
+import threading
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+import duckdb
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+from backend.database import RESULTS_PATH, dataset_version, get_con, has_table, source_files
 from backend.schemas import LLMQueryRequest, LLMQueryResponse
-from backend.services.llm_service import process_natural_language_query
+from backend.services.ingestion import ROW_ID_COL
+from backend.services.llm_service import answer_pandas_query, answer_sql_query, explain_answer, stream_llm_explanation
+from backend.utils.cache import prompt_cache
 
 router = APIRouter(prefix="/llm", tags=["llm"])
 
-# Path to your processed data (Parquet is faster/lighter than CSV)
-RESULTS_PATH = Path("data/processed/results.parquet")
-# Fallback if you are using the cleaned CSV
-CLEANED_CSV_PATH = Path("data/cleaned/cleaned_bloodwork.csv")
+# Colonnes à faible cardinalité : lues directement en dictionnaire -> dtype category
+CATEGORY_COLS = ["nombre", "nombre2", "sexo", "year_month", "textores_text"]
+# textores brut non chargé : ses deux versions typées (textores_num, textores_text) le remplacent
+FRAME_EXCLUDED_COLS = {ROW_ID_COL, "textores"}
 
-def load_dataframe():
-    if RESULTS_PATH.exists():
-        return pd.read_parquet(RESULTS_PATH)
-    elif CLEANED_CSV_PATH.exists():
-        return pd.read_csv(CLEANED_CSV_PATH)
-    else:
-        raise FileNotFoundError("No data file found in data/processed/ or data/cleaned/")
+_frame_lock = threading.Lock()
+_frame_cache = {"version": None, "df": None}
 
-@router.post("/query", response_model=LLMQueryResponse)
-def query_llm(request: LLMQueryRequest):
+def _read_compact_frame() -> pd.DataFrame:
+    """Lit results (fichier principal + ajouts) avec des types compacts (category, petits entiers, datetime64)."""
+    # Chemins résolus une fois : toute la lecture se fait sur la même version publiée
+    files = source_files("results")
+    schema_names = pq.read_schema(files[0]).names
+    columns = [c for c in schema_names if c not in FRAME_EXCLUDED_COLS]
+    dictionary = [c for c in CATEGORY_COLS if c in schema_names]
+    tables = [pq.read_table(path, columns=columns, read_dictionary=dictionary) for path in files]
+    # Dictionnaires différents d'un fichier à l'autre : unify_dictionaries avant la conversion
+    table = pa.concat_tables(tables).unify_dictionaries() if len(tables) > 1 else tables[0]
+    df = table.to_pandas(date_as_object=False)
+    if "edad" in df.columns:
+        df["edad"] = pd.to_numeric(df["edad"], downcast="integer")
+    return df
+
+def load_dataframe() -> pd.DataFrame:
+    """
+    DataFrame partagé par toutes les requêtes /llm : chargé une seule fois,
+    rechargé uniquement quand l'empreinte du jeu de données change.
+    """
+    if not RESULTS_PATH.exists():
+        raise FileNotFoundError("No data file found in data/processed/")
+
+    version = dataset_version()
+    with _frame_lock:
+        if _frame_cache["version"] != version:
+            _frame_cache["df"] = None  # libère l'ancien frame avant de charger le nouveau
+            df = _read_compact_frame()
+            _frame_cache.update(version=version, df=df)
+            print(f"✅ DataFrame LLM chargé : {len(df):,} lignes, {df.memory_usage(deep=True).sum() / 1e6:.1f} Mo")
+        return _frame_cache["df"]
+
+@router.get("/frame")
+def frame_info():
+    """Empreinte mémoire du DataFrame en cache."""
     try:
         df = load_dataframe()
-        
-        # Call the service layer
-        response_data = process_natural_language_query(request.prompt, df)
-        
-        return LLMQueryResponse(**response_data)
-        
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
+
+    memory = df.memory_usage(deep=True)
+    return {
+        "dataset_version": _frame_cache["version"],
+        "rows": len(df),
+        "memory_bytes": int(memory.sum()),
+        "memory_by_column": {col: int(memory[col]) for col in df.columns},
+        "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
+    }
+
+@router.get("/cache/stats")
+def prompt_cache_stats():
+    return prompt_cache.stats()
+
+async def _answer(request: LLMQueryRequest, con: duckdb.DuckDBPyConnection) -> dict:
+    """Génère et exécute la requête ; l'explication reste à produire si elle vaut None."""
+    if request.mode == "sql":
+        # Mode SQL : DuckDB répond directement, aucun DataFrame n'est chargé
+        if not has_table("results"):
+            raise HTTPException(status_code=404, detail="No data file found in data/processed/")
+        return await answer_sql_query(request.prompt, con)
+
+    try:
+        # Copie superficielle : le code généré ne peut pas altérer la structure du frame partagé
+        df = (await asyncio.to_thread(load_dataframe)).copy(deep=False)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return await answer_pandas_query(request.prompt, df)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@router.post("/query", response_model=LLMQueryResponse)
+async def query_llm(request: LLMQueryRequest, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    try:
+        answer = await _answer(request, con)
+        return LLMQueryResponse(**await explain_answer(request.prompt, answer))
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/query/stream")
+async def query_llm_stream(request: LLMQueryRequest, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    """
+    Server-Sent Events : `result` (résultat calculé) est envoyé dès qu'il est disponible,
+    puis l'explication arrive en événements `token`, et `done` clôt le flux.
+    """
+    try:
+        answer = await _answer(request, con)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        yield _sse("result", {"result": answer["result"], "query_executed": answer["query_executed"]})
+        if answer["explanation"] is not None:
+            yield _sse("token", {"text": answer["explanation"]})
+        else:
+            try:
+                async for token in stream_llm_explanation(request.prompt, answer["query_executed"], answer["result"]):
+                    yield _sse("token", {"text": token})
+            except Exception as e:
+                yield _sse("error", {"detail": str(e)})
+        yield _sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,13 +1,23 @@
+import base64
+import json
+import os
 import shutil
-import subprocess
+from datetime import datetime
 from pathlib import Path
+from typing import List, Literal, Optional
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query
-from backend.database import get_con
+from backend.database import get_con, write_connection, load_tables, has_table, dataset_version
+from backend.database import append_files, current_dir, fork_version, in_version, list_versions, new_version_dir, publish_version, source_files
+from backend.database import RESULTS_PATH as PARQUET_PATH, RESULTS_APPEND_DIR
 from backend import schemas
-from backend.utils.filter_dsl import build_where_clause
-import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
+from backend.services.derived import append_to_derived_tables, generate_derived_tables
+from backend.services.cleaning import check_columns
+from backend.services.ingestion import ROW_ID_COL, append_csv, ingest_csv, next_row_id, rebase_append
+from backend.services.jobs import Job, jobs
+from backend.services.migrations import migrate_results_columns
+from backend.services.profile import read_profile
+from backend.utils.cache import response_cache
+from backend.utils.filter_dsl import compile_filter, parquet_schema
 import duckdb
 
 router = APIRouter(prefix="/loader", tags=["loader"])
@@ -15,131 +25,266 @@ router = APIRouter(prefix="/loader", tags=["loader"])
 # === CHEMINS ===
 DATA_DIR = Path("data")
 RAW_PATH = DATA_DIR / "raw" / "original_synthetic_bloodwork.csv"
-CLEAN_PATH = DATA_DIR / "cleaned" / "cleaned_bloodwork.csv"
-PARQUET_PATH = DATA_DIR / "processed" / "results.parquet"
-PANELS_PATH = DATA_DIR / "processed" / "panels.parquet"
-REPEATS_PATH = DATA_DIR / "processed" / "repeats.parquet"
-CLEAN_SCRIPT = Path("scripts/02_clean_data.py")
+RAW_UPLOAD_DIR = DATA_DIR / "raw" / "uploads"
+RAW_APPEND_DIR = DATA_DIR / "raw" / "appends"
 
 # Création structure
 for p in [DATA_DIR / "raw", DATA_DIR / "cleaned", DATA_DIR / "processed"]:
     p.mkdir(parents=True, exist_ok=True)
 
-def _generate_derived_tables(con):
-    """
-    Génère les fichiers Parquet dérivés (Panels et Repeats).
-    Version Robuste : Gère plusieurs formats de dates.
-    """
-    print("🔄 Génération des tables dérivées...")
-    
-    # Expression magique : essaie DD/MM/YYYY, sinon YYYY-MM-DD, sinon DD-MM-YYYY
-    # C'est vital pour que DuckDB ne renvoie pas NULL si le format change
-    date_parser = "COALESCE(try_strptime(Date, '%d/%m/%Y'), try_strptime(Date, '%Y-%m-%d'), try_strptime(Date, '%d-%m-%Y'))"
-
-    try:
-        # 1. PANELS
-        con.execute(f"""
-            COPY (
-                SELECT 
-                    numorden, 
-                    Date, 
-                    COUNT(*) as n_tests, 
-                    list(nombre) as tests_list
-                FROM results
-                GROUP BY numorden, Date
-            ) TO '{PANELS_PATH.as_posix()}' (FORMAT 'parquet');
-        """)
-        print("✅ Panels générés.")
-
-        # 2. REPEATS
-        # On parse la date proprement, puis on la reformate uniformément en DD/MM/YYYY pour l'affichage
-        con.execute(f"""
-            COPY (
-                SELECT 
-                    numorden, 
-                    nombre, 
-                    COUNT(*) as repeat_count,
-                    MIN({date_parser}) as first_date_obj,
-                    MAX({date_parser}) as last_date_obj,
-                    date_diff('day', MIN({date_parser}), MAX({date_parser})) as days_span,
-                    strftime(MIN({date_parser}), '%d/%m/%Y') as first_date,
-                    strftime(MAX({date_parser}), '%d/%m/%Y') as last_date
-                FROM results
-                GROUP BY numorden, nombre
-                HAVING count(*) > 1
-            ) TO '{REPEATS_PATH.as_posix()}' (FORMAT 'parquet');
-        """)
-        print("✅ Répétitions générées.")
-        
-    except Exception as e:
-        print(f"⚠️ Erreur dérivation : {e}")
-        raise e
-
-def _load_parquet_to_duckdb(con):
-    if not PARQUET_PATH.exists(): return
-    con.execute(f"CREATE OR REPLACE TABLE results AS SELECT * FROM read_parquet('{PARQUET_PATH.as_posix()}')")
-    
-    # Indexation légère
-    cols = ["numorden", "nombre", "nombre2", "Date", "sexo"]
-    existing = [c[1] for c in con.execute("PRAGMA table_info(results)").fetchall()]
-    for col in cols:
-        if col in existing:
-            try: 
-                con.execute(f"CREATE INDEX IF NOT EXISTS idx_{col} ON results ({col})")
-            except: pass
-
-@router.post("/upload_file", response_model=schemas.UploadResponse)
-async def upload_file(file: UploadFile = File(...), con=Depends(get_con)):
+def _save_upload(file: UploadFile, dst_dir: Path) -> Path:
+    """Écrit le CSV uploadé sur disque (nom unique : plusieurs jobs peuvent être en file) et vérifie l'en-tête."""
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="CSV requis.")
-
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    raw_path = dst_dir / f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}_{Path(file.filename).name}"
     try:
-        with open(RAW_PATH, "wb") as buffer:
+        with open(raw_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
     finally:
         file.file.close()
 
-    # Nettoyage
-    if CLEAN_SCRIPT.exists():
-        subprocess.run(["python", str(CLEAN_SCRIPT)], capture_output=True, check=False)
-    else:
-        shutil.copy(RAW_PATH, CLEAN_PATH)
+    try:
+        check_columns(raw_path)
+    except ValueError as e:
+        raw_path.unlink(missing_ok=True)
+        raise HTTPException(400, f"Fichier invalide : {str(e)}")
+    return raw_path
 
-    if not CLEAN_PATH.exists():
-        raise HTTPException(500, "Echec nettoyage.")
+def _run_upload(raw_path: Path, job: Job) -> int:
+    # Nouvelle version construite à part : les lecteurs restent sur la version publiée
+    root = new_version_dir()
+    try:
+        # Nettoyage en streaming -> Parquet typé (un seul passage sur le CSV)
+        ingested = ingest_csv(raw_path, in_version(PARQUET_PATH, root), progress=job.progress)
+        job.quality = ingested.quality.to_dict()
+
+        # Génération, dans une transaction : les requêtes en cours finissent sur les anciennes tables
+        with write_connection() as con:
+            job.progress("loading", ingested.rows_read)
+            con.execute("BEGIN TRANSACTION")
+            try:
+                load_tables(con, ["results"], force=True, root=root)
+                job.progress("derived", ingested.rows_read)
+                generate_derived_tables(con, root) # C'est ici que la magie opère
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            publish_version(root)
+    except Exception:
+        shutil.rmtree(root, ignore_errors=True)
+        raise
+    finally:
+        # Nouveau jeu de données : les réponses en cache sont périmées
+        response_cache.clear()
 
-    # Conversion & Génération
+    os.replace(raw_path, RAW_PATH)
+    return ingested.rows_written
+
+def _run_append(raw_path: Path, job: Job) -> int:
+    if not has_table("results"):
+        raise ValueError("Aucune donnée chargée. Uploadez d'abord un fichier complet.")
+    root = None
     try:
-        df = pd.read_csv(CLEAN_PATH)
-        # Conversion des colonnes objets en string pour éviter les soucis PyArrow
-        for col in df.select_dtypes(['object']).columns:
-            df[col] = df[col].astype(str)
-            
-        table = pa.Table.from_pandas(df)
-        pq.write_table(table, PARQUET_PATH)
-        
-        _load_parquet_to_duckdb(con)
-        _generate_derived_tables(con) # C'est ici que la magie opère
-        
-    except Exception as e:
-        raise HTTPException(500, f"Erreur traitement : {str(e)}")
+        # Nettoyage hors verrou d'écriture (cohortes et lecteurs non bloqués), dans une nouvelle
+        # version liée en dur à la version publiée, complétée par le lot
+        base = current_dir()
+        root = fork_version(base)
+        first_row_id = next_row_id(source_files("results", root))
+        ingested, files = append_csv(raw_path, in_version(RESULTS_APPEND_DIR, root), first_row_id, progress=job.progress)
+        job.quality = ingested.quality.to_dict()
+        if not files:
+            shutil.rmtree(root, ignore_errors=True)
+            return ingested.rows_written
 
-    return {
-        "rows": len(df),
-        "message": "Succès",
-        "filename": file.filename,
-        "clean_csv_path": str(CLEAN_PATH)
-    }
+        with write_connection() as con:
+            if current_dir() != base:
+                # Une autre ingestion a publié pendant le nettoyage : lot recopié sur la nouvelle version
+                job.progress("rebasing", ingested.rows_read)
+                stale, root = root, fork_version()
+                try:
+                    files = rebase_append(files, in_version(RESULTS_APPEND_DIR, stale), in_version(RESULTS_APPEND_DIR, root),
+                                          next_row_id(source_files("results", root)))
+                finally:
+                    shutil.rmtree(stale, ignore_errors=True)
+            job.progress("derived", ingested.rows_read)
+            append_to_derived_tables(con, files, root)
+            publish_version(root)
+    except Exception:
+        if root is not None:
+            shutil.rmtree(root, ignore_errors=True)
+        raise
+    finally:
+        response_cache.clear()
+    return ingested.rows_written
+
+def _run_activate(root: Path, job: Job) -> None:
+    # Retour à une version conservée : tables rechargées depuis ses Parquet, puis publication
+    try:
+        with write_connection() as con:
+            job.progress("loading", 0)
+            # Version antérieure au typage de textores : mise au format avant rechargement
+            migrate_results_columns(root)
+            con.execute("BEGIN TRANSACTION")
+            try:
+                load_tables(con, force=True, root=root)
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            publish_version(root)
+    finally:
+        response_cache.clear()
+
+@router.post("/upload_file", response_model=schemas.JobStatus, status_code=202)
+def upload_file(file: UploadFile = File(...)):
+    """
+    Dépose le CSV et lance l'ingestion complète en arrière-plan.
+    Suivre l'avancement avec GET /loader/jobs/{id}.
+    """
+    raw_path = _save_upload(file, RAW_UPLOAD_DIR)
+    job = jobs.submit("upload", file.filename, lambda job: _run_upload(raw_path, job))
+    return job.to_dict()
+
+@router.post("/append_file", response_model=schemas.JobStatus, status_code=202)
+def append_file(file: UploadFile = File(...)):
+    """
+    Ajout incrémental (ex: delta quotidien) en arrière-plan : le lot est nettoyé, écrit en nouvelles
+    partitions mensuelles, et seules les lignes dérivées des patients concernés sont recalculées.
+    """
+    if not has_table("results"):
+        raise HTTPException(status_code=400, detail="Aucune donnée chargée. Uploadez d'abord un fichier complet.")
+    raw_path = _save_upload(file, RAW_APPEND_DIR)
+    job = jobs.submit("append", file.filename, lambda job: _run_append(raw_path, job))
+    return job.to_dict()
+
+@router.get("/jobs", response_model=List[schemas.JobStatus])
+def list_jobs():
+    """Jobs d'ingestion en cours, en file et récents (plus récents d'abord)."""
+    return [job.to_dict() for job in jobs.list()]
+
+@router.get("/jobs/{job_id}", response_model=schemas.JobStatus)
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job inconnu : {job_id}")
+    return job.to_dict()
+
+@router.get("/versions")
+def list_dataset_versions():
+    """Versions du jeu de données conservées (DATASET_KEEP_VERSIONS), plus récentes d'abord."""
+    current = current_dir()
+    return [
+        {
+            "id": root.name,
+            "current": root.resolve() == current,
+            "dataset_version": dataset_version(root),
+            "appended_files": len(append_files(root)),
+        }
+        for root in reversed(list_versions())
+    ]
+
+@router.post("/versions/{version_id}/activate", response_model=schemas.JobStatus, status_code=202)
+def activate_version(version_id: str):
+    """Republie une version conservée (retour arrière), en arrière-plan comme une ingestion."""
+    root = next((r for r in list_versions() if r.name == version_id), None)
+    if root is None or not in_version(PARQUET_PATH, root).exists():
+        raise HTTPException(status_code=404, detail=f"Version inconnue : {version_id}")
+    job = jobs.submit("activate", version_id, lambda job: _run_activate(root, job))
+    return job.to_dict()
+
+# === SUBSET (pagination par curseur) ===
+SUBSET_MAX_LIMIT = 10_000
+# En dessous de cette taille, un COUNT exact reste assez rapide pour être toujours servi
+EXACT_COUNT_MAX_ROWS = 1_000_000
+# Estimation : comptage sur un échantillon de vecteurs DuckDB (sampling "system")
+ESTIMATE_SAMPLE_PERCENT = 5
+
+def _encode_cursor(row_id: int) -> str:
+    payload = json.dumps({"v": dataset_version(), "after": row_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        after = int(payload["after"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Curseur invalide.")
+    if payload.get("v") != dataset_version():
+        raise HTTPException(status_code=409, detail="Curseur périmé : le jeu de données a changé.")
+    return after
+
+def _count_rows(con, where_clause: str, params: list, mode: str):
+    """Retourne (nombre de lignes, "exact" | "estimate")."""
+    profile = read_profile()
+    if where_clause == "TRUE" and profile is not None:
+        return profile["total_rows"], "exact"
+
+    total = profile["total_rows"] if profile is not None else None
+    if mode == "exact" or total is None or total <= EXACT_COUNT_MAX_ROWS:
+        return con.execute(f"SELECT COUNT(*) FROM results WHERE {where_clause}", params).fetchone()[0], "exact"
+
+    sampled = con.execute(
+        f"SELECT COUNT(*) FROM results TABLESAMPLE {ESTIMATE_SAMPLE_PERCENT}% (system) WHERE {where_clause}", params
+    ).fetchone()[0]
+    return int(sampled * 100 / ESTIMATE_SAMPLE_PERCENT), "estimate"
 
-# Subset (minimaliste pour ne pas casser le fichier)
 @router.post("/subset", response_model=schemas.SubsetResponse)
-def subset(filters: schemas.CohortFilter, limit: int = Query(1000), con=Depends(get_con)):
-    if PARQUET_PATH.exists():
-        try: con.execute("SELECT 1 FROM results LIMIT 1")
-        except: _load_parquet_to_duckdb(con)
-    
-    where_clause, params = build_where_clause(filters.conditions, filters.logic)
-    query = f"SELECT * FROM results WHERE {where_clause} LIMIT {limit}"
-    df = con.execute(query, params).fetchdf()
-    count = con.execute(f"SELECT COUNT(*) FROM results WHERE {where_clause}", params).fetchone()[0]
-    return {"rowcount": count, "records": df.to_dict(orient="records")}
\ No newline at end of file
+def subset(
+    filters: schemas.CohortFilter,
+    limit: int = Query(1000, ge=1, le=SUBSET_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="next_cursor de la page précédente"),
+    count: Literal["none", "estimate", "exact"] = Query("estimate"),
+    columns: Optional[str] = Query(None, description="Colonnes à renvoyer, séparées par des virgules (row_id toujours inclus)"),
+    con=Depends(get_con),
+):
+    """
+    Pagination keyset sur row_id (ordre numorden, Date) : chaque page est un parcours
+    borné `row_id > curseur`, sans OFFSET ni second scan pour le comptage.
+    """
+    if not has_table("results"):
+        raise HTTPException(status_code=400, detail="Données manquantes.")
+
+    available = [c[1] for c in con.execute("PRAGMA table_info(results)").fetchall()]
+    selected = available
+    if columns:
+        selected = [c.strip() for c in columns.split(",") if c.strip()]
+        unknown = [c for c in selected if c not in available]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Colonnes inconnues : {unknown}")
+        if ROW_ID_COL not in selected:
+            selected.append(ROW_ID_COL)
+
+    try:
+        compiled = compile_filter(filters, parquet_schema(PARQUET_PATH))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    where_clause, params = compiled.sql, compiled.params
+
+    page_clause, page_params = where_clause, list(params)
+    if cursor:
+        page_clause = f"({where_clause}) AND {ROW_ID_COL} > ?"
+        page_params.append(_decode_cursor(cursor))
+
+    # Une ligne de plus que demandé : indique s'il existe une page suivante
+    query = f"SELECT {', '.join(selected)} FROM results WHERE {page_clause} ORDER BY {ROW_ID_COL} LIMIT {limit + 1}"
+    # Arrow -> dicts : les DATE restent des dates (pas de Timestamp pandas)
+    records = con.execute(query, page_params).fetch_arrow_table().to_pylist()
+    has_more = len(records) > limit
+    records = records[:limit]
+
+    rowcount, count_mode = None, None
+    if count != "none":
+        if not cursor and not has_more:
+            rowcount, count_mode = len(records), "exact"  # tout tient dans la première page
+        else:
+            rowcount, count_mode = _count_rows(con, where_clause, params, count)
+
+    return {
+        "rowcount": rowcount,
+        "count_mode": count_mode,
+        "records": records,
+        "next_cursor": _encode_cursor(records[-1][ROW_ID_COL]) if has_more else None,
+        "has_more": has_more,
+    }
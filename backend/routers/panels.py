@@ -1,17 +1,23 @@
 import duckdb
-from fastapi import APIRouter, Depends
-from pathlib import Path
-from backend.database import get_con
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from backend.database import get_con, has_table
+from backend.services.cohorts import CohortNotFound, scoped_table
+from backend.utils.cache import cached
 from backend.schemas import PanelResponse
 import numpy as np # On importe numpy pour gérer les types si besoin, ou on utilise list()
 
 router = APIRouter(prefix="/panels", tags=["panels"])
-PANELS_PATH = Path("data/processed/panels.parquet")
 
-def get_source():
-    if not PANELS_PATH.exists():
+def get_source(cohort: Optional[str] = None):
+    if not has_table("panels"):
         return None
-    return f"'{PANELS_PATH.as_posix()}'"
+    try:
+        return scoped_table("panels", cohort)
+    except CohortNotFound:
+        raise HTTPException(status_code=404, detail=f"Cohorte inconnue : {cohort}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/patient/{numorden}", response_model=list[PanelResponse])
 def get_patient_panels(numorden: str, con: duckdb.DuckDBPyConnection = Depends(get_con)):
@@ -19,16 +25,17 @@ def get_patient_panels(numorden: str, con: duckdb.DuckDBPyConnection = Depends(g
     if not src: return []
     
     # 1. Requête SQL
-    # On ajoute CAST(numorden AS VARCHAR) pour éviter les conflits int/str
+    # numorden est stocké en texte (clé patient canonique) et les données sont triées par patient :
+    # comparaison directe, sans CAST, pour profiter des statistiques min/max par row group
     df = con.execute(f"""
         SELECT 
-            CAST(numorden AS VARCHAR) as numorden, 
-            Date, 
+            numorden, 
+            strftime(Date, '%Y-%m-%d') as Date, 
             n_tests, 
             tests_list
-        FROM read_parquet({src})
-        WHERE CAST(numorden AS VARCHAR) = ?
-        ORDER BY Date
+        FROM {src}
+        WHERE numorden = ?
+        ORDER BY {src}.Date
     """, [str(numorden)]).fetchdf()
     
     # 2. CORRECTION CRITIQUE : Conversion Numpy Array -> Python List
@@ -37,11 +44,13 @@ def get_patient_panels(numorden: str, con: duckdb.DuckDBPyConnection = Depends(g
         # On applique list() sur chaque élément pour le convertir en liste Python pure
         df['tests_list'] = df['tests_list'].apply(lambda x: x.tolist() if hasattr(x, 'tolist') else list(x) if x is not None else [])
 
-    return df.to_dict(orient="records")
+    # Panel sans date (Date manquante dans le CSV) : NaN pandas -> None pour la validation
+    return df.replace({np.nan: None}).to_dict(orient="records")
 
 @router.get("/summary")
-def get_panels_summary(con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
+@cached
+def get_panels_summary(cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    src = get_source(cohort)
     if not src: return {}
 
     result = con.execute(f"""
@@ -51,12 +60,12 @@ def get_panels_summary(con: duckdb.DuckDBPyConnection = Depends(get_con)):
             MIN(n_tests) as min_tests,
             MAX(n_tests) as max_tests,
             COUNT(*) as total_panels
-        FROM read_parquet({src})
+        FROM {src}
     """).fetchone()
     
     distribution = con.execute(f"""
         SELECT n_tests, COUNT(*) as count
-        FROM read_parquet({src})
+        FROM {src}
         GROUP BY n_tests
         ORDER BY n_tests
     """).fetchdf()
@@ -71,8 +80,9 @@ def get_panels_summary(con: duckdb.DuckDBPyConnection = Depends(get_con)):
     }
 
 @router.get("/top-patients")
-def get_top_patients(limit: int = 20, con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
+@cached
+def get_top_patients(limit: int = 20, cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    src = get_source(cohort)
     if not src: return []
 
     df = con.execute(f"""
@@ -81,7 +91,7 @@ def get_top_patients(limit: int = 20, con: duckdb.DuckDBPyConnection = Depends(g
             COUNT(*) as panel_count,
             SUM(n_tests) as total_tests,
             AVG(n_tests) as avg_tests_per_panel
-        FROM read_parquet({src})
+        FROM {src}
         GROUP BY numorden
         ORDER BY panel_count DESC
         LIMIT ?
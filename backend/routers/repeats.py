@@ -1,35 +1,41 @@
 import duckdb
 import pandas as pd
 import numpy as np
-from fastapi import APIRouter, Depends
-from pathlib import Path
-from backend.database import get_con
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from backend.database import get_con, has_table
+from backend.services.cohorts import CohortNotFound, scoped_table
+from backend.utils.cache import cached
 from backend.schemas import RepeatResponse
 
 router = APIRouter(prefix="/repeats", tags=["repeats"])
-REPEATS_PATH = Path("data/processed/repeats.parquet")
 
-def get_source():
-    if not REPEATS_PATH.exists():
+def get_source(cohort: Optional[str] = None):
+    if not has_table("repeats"):
         return None
-    return f"'{REPEATS_PATH.as_posix()}'"
+    try:
+        return scoped_table("repeats", cohort)
+    except CohortNotFound:
+        raise HTTPException(status_code=404, detail=f"Cohorte inconnue : {cohort}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/patient/{numorden}", response_model=list[RepeatResponse])
 def get_patient_repeats(numorden: str, con: duckdb.DuckDBPyConnection = Depends(get_con)):
     src = get_source()
     if not src: return []
 
-    # 1. Requête sécurisée avec CAST pour l'ID
+    # 1. Requête paramétrée sur la clé patient texte (sans CAST : pruning par row group)
     df = con.execute(f"""
         SELECT 
-            CAST(numorden AS VARCHAR) as numorden, 
+            numorden, 
             nombre, 
             repeat_count, 
             first_date, 
             last_date, 
             days_span
-        FROM read_parquet({src})
-        WHERE CAST(numorden AS VARCHAR) = ?
+        FROM {src}
+        WHERE numorden = ?
         ORDER BY repeat_count DESC
     """, [str(numorden)]).fetchdf()
 
@@ -41,8 +47,9 @@ def get_patient_repeats(numorden: str, con: duckdb.DuckDBPyConnection = Depends(
     return df.to_dict(orient="records")
 
 @router.get("/summary")
-def get_repeats_summary(con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
+@cached
+def get_repeats_summary(cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    src = get_source(cohort)
     if not src: 
         return {"patients_with_repeats": 0, "tests_repeated": 0, "avg_repeats": 0, "max_repeats": 0}
 
@@ -52,7 +59,7 @@ def get_repeats_summary(con: duckdb.DuckDBPyConnection = Depends(get_con)):
             COUNT(DISTINCT nombre) as tests_repeated,
             AVG(repeat_count) as avg_repeats,
             MAX(repeat_count) as max_repeats
-        FROM read_parquet({src})
+        FROM {src}
     """).fetchone()
     
     return {
@@ -63,8 +70,9 @@ def get_repeats_summary(con: duckdb.DuckDBPyConnection = Depends(get_con)):
     }
 
 @router.get("/top-tests")
-def get_top_repeated_tests(limit: int = 20, con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
+@cached
+def get_top_repeated_tests(limit: int = 20, cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    src = get_source(cohort)
     if not src: return []
 
     df = con.execute(f"""
@@ -73,7 +81,7 @@ def get_top_repeated_tests(limit: int = 20, con: duckdb.DuckDBPyConnection = Dep
             COUNT(DISTINCT numorden) as patient_count,
             AVG(repeat_count) as avg_repeats,
             MAX(repeat_count) as max_repeats
-        FROM read_parquet({src})
+        FROM {src}
         GROUP BY nombre
         ORDER BY patient_count DESC
         LIMIT ?
@@ -82,26 +90,27 @@ def get_top_repeated_tests(limit: int = 20, con: duckdb.DuckDBPyConnection = Dep
     return df.to_dict(orient="records")
 
 @router.get("/trend")
-def get_repeats_trend(con: duckdb.DuckDBPyConnection = Depends(get_con)):
+@cached
+def get_repeats_trend(cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
     """
     Renvoie l'évolution des répétitions dans le temps.
     Correction : Tri chronologique et filtre des valeurs nulles.
     """
-    src = get_source()
+    src = get_source(cohort)
     if not src: return []
 
     try:
         # CORRECTION GRAPHE :
-        # 1. WHERE first_date IS NOT NULL : Enlève le point "None" géant
-        # 2. ORDER BY try_strptime : Trie par vraie date, pas par ordre alphabétique ("01/02" avant "02/01")
+        # 1. WHERE first_date_obj IS NOT NULL : Enlève le point "None" géant
+        # 2. GROUP/ORDER BY first_date_obj : Trie par vraie date, pas par ordre alphabétique ("01/02" avant "02/01")
         df = con.execute(f"""
             SELECT 
-                first_date AS Date,
+                strftime(first_date_obj, '%d/%m/%Y') AS Date,
                 SUM(repeat_count) AS total_repeats
-            FROM read_parquet({src})
-            WHERE first_date IS NOT NULL
-            GROUP BY first_date
-            ORDER BY try_strptime(first_date, '%d/%m/%Y') ASC
+            FROM {src}
+            WHERE first_date_obj IS NOT NULL
+            GROUP BY first_date_obj
+            ORDER BY first_date_obj ASC
         """).fetchdf()
         
         # Conversion explicite pour éviter tout souci JSON
@@ -1,116 +1,173 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 import duckdb
-from pathlib import Path
-from backend.database import get_con
-from backend.schemas import StatsSummary, TestStatsResponse, TestNumericSummary
+from backend.database import RESULTS_PATH, get_con, has_table
+from backend.services.cohorts import CohortNotFound, scoped_table
+from backend.services.derived import TEST_KEY_SQL, TEST_QUANTILES
+from backend.services.typeahead import suggest
+from backend.services.profile import compute_profile, read_profile
+from backend.utils.cache import cached
+from backend.utils.filter_dsl import compile_filter, parquet_schema
+from backend.schemas import CohortFilter, StatsSummary, Suggestion, TestStatsResponse, TestNumericSummary
 
 router = APIRouter(prefix="/stats", tags=["stats"])
-RESULTS_PATH = Path("data/processed/results.parquet")
 
-def get_source():
-    if not RESULTS_PATH.exists():
+def get_source(cohort: Optional[str] = None):
+    if not has_table("results"):
         raise HTTPException(status_code=400, detail="Données manquantes.")
-    return f"'{RESULTS_PATH.as_posix()}'"
+    try:
+        return scoped_table("results", cohort)
+    except CohortNotFound:
+        raise HTTPException(status_code=404, detail=f"Cohorte inconnue : {cohort}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _summary_from_profile(profile: dict) -> StatsSummary:
+    def fmt(d):
+        return datetime.strptime(d, "%Y-%m-%d").strftime('%d/%m/%Y') if d else None
 
-# DATE PARSER ROBUSTE
-DATE_EXPR = "COALESCE(try_strptime(Date, '%d/%m/%Y'), try_strptime(Date, '%Y-%m-%d'), try_strptime(Date, '%d-%m-%Y'))"
+    age = profile["age"]
+    return StatsSummary(
+        total_rows=profile["total_rows"],
+        total_patients=profile["total_patients"],
+        total_tests=profile["total_tests"],
+        avg_age=round(age["avg"], 2) if age["avg"] else None,
+        min_age=age["min"],
+        max_age=age["max"],
+        std_age=round(age["std"], 2) if age["std"] else None,
+        missing_edad=profile["missing"].get("edad", 0),
+        missing=profile["missing"],
+        date_range=[fmt(profile["date_min"]), fmt(profile["date_max"])],
+        total_services=profile["total_services"],
+        approximate=profile["approximate"],
+    )
 
 @router.get("/summary", response_model=StatsSummary)
-def get_summary(con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
-    
-    query = f"""
-        SELECT
-            COUNT(*) AS total_rows,
-            COUNT(DISTINCT numorden) AS total_patients,
-            COUNT(DISTINCT nombre) AS total_tests,
-            MIN({DATE_EXPR}) AS min_date_obj,
-            MAX({DATE_EXPR}) AS max_date_obj,
-            AVG(edad) AS avg_age,
-            SUM(CASE WHEN edad IS NULL THEN 1 ELSE 0 END) AS missing_edad
-        FROM read_parquet({src})
+@cached
+def get_summary(approx: bool = False, cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    """
+    Résumé global servi depuis le profil écrit à l'ingestion (O(1)).
+    approx=true force un recalcul avec comptes distincts approximatifs ; ?cohort= le calcule sur la cohorte.
     """
-    result = con.execute(query).fetchone()
-    
-    min_d = result[3].strftime('%d/%m/%Y') if result[3] else None
-    max_d = result[4].strftime('%d/%m/%Y') if result[4] else None
+    src = get_source(cohort)
+    profile = None if approx or cohort else read_profile()
+    if profile is None:
+        profile = compute_profile(con, src, approx=approx)
+    return _summary_from_profile(profile)
 
+@router.post("/summary", response_model=StatsSummary)
+def get_subset_summary(filters: CohortFilter, approx: bool = True, cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    """Recalcul ad-hoc du résumé sur un sous-ensemble filtré (approximatif par défaut)."""
+    src = get_source(cohort)
     try:
-        total_services = con.execute(f"SELECT COUNT(DISTINCT nombre2) FROM read_parquet({src}) WHERE nombre2 IS NOT NULL").fetchone()[0]
-    except: total_services = 0
-
-    return StatsSummary(
-        total_rows=result[0],
-        total_patients=result[1],
-        total_tests=result[2],
-        avg_age=round(result[5], 2) if result[5] else None,
-        missing_edad=result[6],
-        date_range=[min_d, max_d],
-        total_services=total_services  
-    )
+        compiled = compile_filter(filters, parquet_schema(RESULTS_PATH))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _summary_from_profile(compute_profile(con, src, compiled.sql, compiled.params, approx=approx))
 
 @router.get("/activity-trend")
-def get_activity_trend(con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
+@cached
+def get_activity_trend(cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    src = get_source(cohort)
     try:
         df = con.execute(f"""
             SELECT 
-                STRFTIME({DATE_EXPR}, '%Y-%m') AS month,
+                year_month AS month,
                 COUNT(*) AS total_tests
-            FROM read_parquet({src})
-            WHERE {DATE_EXPR} IS NOT NULL
-            GROUP BY month
-            ORDER BY month
+            FROM {src}
+            WHERE year_month IS NOT NULL
+            GROUP BY year_month
+            ORDER BY year_month
         """).fetchdf()
         return df.to_dict(orient="records")
     except: return []
 
 @router.get("/by-sex")
-def get_stats_by_sex(con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
-    df = con.execute(f"SELECT sexo, COUNT(DISTINCT numorden) as patients FROM read_parquet({src}) GROUP BY sexo").fetchdf()
+@cached
+def get_stats_by_sex(cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    src = get_source(cohort)
+    df = con.execute(f"SELECT sexo, COUNT(DISTINCT numorden) as patients FROM {src} GROUP BY sexo").fetchdf()
     return df.to_dict(orient="records")
 
 @router.get("/by-service")
-def get_stats_by_service(con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
-    df = con.execute(f"SELECT nombre2 as service, COUNT(*) as test_count FROM read_parquet({src}) WHERE nombre2 IS NOT NULL GROUP BY nombre2 ORDER BY test_count DESC LIMIT 20").fetchdf()
+@cached
+def get_stats_by_service(cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    src = get_source(cohort)
+    df = con.execute(f"SELECT nombre2 as service, COUNT(*) as test_count FROM {src} WHERE nombre2 IS NOT NULL GROUP BY nombre2 ORDER BY test_count DESC LIMIT 20").fetchdf()
     return df.to_dict(orient="records")
 
+@router.get("/autocomplete", response_model=List[Suggestion])
+def autocomplete(
+    q: str = "",
+    field: Literal["test", "service"] = "test",
+    limit: int = Query(10, ge=1, le=100),
+    con: duckdb.DuckDBPyConnection = Depends(get_con),
+):
+    """
+    Suggestions de noms de tests (nombre) ou de services (nombre2) pour la saisie `q` :
+    index en mémoire (casse et accents ignorés), classé par fréquence. Pas de cache de réponse :
+    l'index répond directement, sans requête DuckDB.
+    """
+    get_source()
+    return [Suggestion(value=e.value, count=e.count) for e in suggest(con, q, field, limit)]
+
 @router.get("/test/{test_name}", response_model=TestStatsResponse)
-def get_test_details(test_name: str, con: duckdb.DuckDBPyConnection = Depends(get_con)):
-    src = get_source()
+@cached
+def get_test_details(test_name: str, cohort: Optional[str] = None, con: duckdb.DuckDBPyConnection = Depends(get_con)):
+    """
+    Distribution d'un test, lue dans test_stats (résumé précalculé à l'ingestion, recherche par clé
+    normalisée : casse et accents ignorés). Avec ?cohort=, calcul ad-hoc sur la cohorte.
+    """
+    src = get_source(cohort)
     clean_name = test_name.strip()
-    
-    exists = con.execute(f"SELECT COUNT(*) FROM read_parquet({src}) WHERE nombre ILIKE ?", [clean_name]).fetchone()[0]
-    if exists == 0: return TestStatsResponse(test=clean_name, values=[], error="Test introuvable")
+    if cohort or not has_table("test_stats"):
+        return _test_details_adhoc(con, src, clean_name)
+
+    key = con.execute(f"SELECT {TEST_KEY_SQL.format('?')}", [clean_name]).fetchone()[0]
+    row = con.execute(
+        "SELECT n_numeric, mean, std, quantiles, top_values FROM test_stats WHERE test_key = ?", [key]
+    ).fetchone()
+    if row is None: return TestStatsResponse(test=clean_name, values=[], error="Test introuvable")
+
+    n_numeric, mean, std, quantiles, top_values = row
+    num_sum = None
+    if n_numeric > 0:
+        p25, p50, p75 = (quantiles[TEST_QUANTILES.index(q)] for q in (0.25, 0.50, 0.75))
+        num_sum = TestNumericSummary(mean=mean or 0, std=std or 0, p25=p25 or 0, p50=p50 or 0, p75=p75 or 0)
+    return TestStatsResponse(test=clean_name, numeric_summary=num_sum, values=top_values or [])
 
+def _test_details_adhoc(con: duckdb.DuckDBPyConnection, src: str, clean_name: str) -> TestStatsResponse:
+    """Même résumé que test_stats, calculé sur `src` (ex: cohorte) : même clé normalisée, deux scans."""
+    match = f"{TEST_KEY_SQL.format('nombre')} = {TEST_KEY_SQL.format('?')}"
     try:
+        # textores_num est typé à l'ingestion : agrégats colonnaires, un seul tri pour les trois quantiles
+        stats = con.execute(f"""
+            SELECT
+                AVG(textores_num) as mean,
+                STDDEV(textores_num) as std,
+                QUANTILE_CONT(textores_num, [0.25, 0.50, 0.75]) as quartiles,
+                COUNT(textores_num) as count,
+                COUNT(*) as n_rows
+            FROM {src}
+            WHERE {match}
+        """, [clean_name]).fetchone()
+        if stats[4] == 0: return TestStatsResponse(test=clean_name, values=[], error="Test introuvable")
+
         values_df = con.execute(f"""
             SELECT CAST(textores AS VARCHAR) as textores, COUNT(*) as count
-            FROM read_parquet({src})
-            WHERE nombre ILIKE ? AND textores IS NOT NULL
+            FROM {src}
+            WHERE {match} AND textores IS NOT NULL
             GROUP BY textores
-            ORDER BY count DESC LIMIT 50
+            ORDER BY count DESC, textores LIMIT 50
         """, [clean_name]).fetchdf()
         
-        stats = con.execute(f"""
-            SELECT
-                AVG(TRY_CAST(textores AS DOUBLE)) as mean,
-                STDDEV(TRY_CAST(textores AS DOUBLE)) as std,
-                QUANTILE_CONT(TRY_CAST(textores AS DOUBLE), 0.25) as p25,
-                QUANTILE_CONT(TRY_CAST(textores AS DOUBLE), 0.50) as p50,
-                QUANTILE_CONT(TRY_CAST(textores AS DOUBLE), 0.75) as p75,
-                COUNT(TRY_CAST(textores AS DOUBLE)) as count
-            FROM read_parquet({src})
-            WHERE nombre ILIKE ?
-        """, [clean_name]).fetchone()
-        
         num_sum = None
-        if stats and stats[5] > 0: 
-            num_sum = TestNumericSummary(mean=stats[0] or 0, std=stats[1] or 0, p25=stats[2] or 0, p50=stats[3] or 0, p75=stats[4] or 0)
+        if stats[3] > 0: 
+            p25, p50, p75 = stats[2]
+            num_sum = TestNumericSummary(mean=stats[0] or 0, std=stats[1] or 0, p25=p25 or 0, p50=p50 or 0, p75=p75 or 0)
 
         return TestStatsResponse(test=clean_name, numeric_summary=num_sum, values=values_df.to_dict(orient="records"))
 
     except Exception as e:
-        return TestStatsResponse(test=clean_name, values=[], error=str(e))
\ No newline at end of file
+        return TestStatsResponse(test=clean_name, values=[], error=str(e))
@@ -1,26 +1,40 @@
+from datetime import datetime
 from pydantic import BaseModel
-from typing import List, Optional, Any, Union
+from typing import Dict, List, Literal, Optional, Any, Union
 
 # === SCHEMAS LOADER (Upload & Filtres) ===
 
-class UploadResponse(BaseModel):
-    rows: int
-    message: str
+class JobStatus(BaseModel):
+    id: str
+    kind: str  # upload | append | activate
     filename: str
-    clean_csv_path: str
+    status: str  # queued | running | done | failed
+    stage: str  # queued, cleaning, clustering, partitioning, rebasing, loading, derived, done
+    rows_processed: int  # lignes brutes lues jusqu'ici
+    rows_written: Optional[int] = None
+    quality: Optional[Dict[str, Any]] = None  # rapport de qualité du CSV (lignes écartées, dates invalides, edad = 0...)
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
 class FilterCondition(BaseModel):
     column: str
-    operator: str  # eq, ne, gt, lt, in, contains
-    value: Any
+    operator: str  # eq, ne, gt, lt, gte, lte, contains, in, not_in, between, is_null, not_null
+    value: Any = None  # liste pour in / not_in, [début, fin] pour between (bornes nullables)
 
 class CohortFilter(BaseModel):
-    conditions: List[FilterCondition]
+    conditions: List[Union["CohortFilter", FilterCondition]]  # conditions ou groupes imbriqués
     logic: str = "AND"
 
+CohortFilter.model_rebuild()
+
 class SubsetResponse(BaseModel):
-    rowcount: int
+    rowcount: Optional[int]  # None si count=none
+    count_mode: Optional[str] = None  # exact | estimate
     records: List[dict]
+    next_cursor: Optional[str] = None  # à repasser en ?cursor= pour la page suivante
+    has_more: bool = False
 
 # === SCHEMAS STATS (Globales & Test Spécifique) ===
 
@@ -33,6 +47,12 @@ class StatsSummary(BaseModel):
     avg_age: Optional[float] = None
     missing_edad: int 
     total_services: Optional[int] = 0
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+    std_age: Optional[float] = None
+    missing: Dict[str, int] = {}
+    # True si les comptes distincts sont des estimations HyperLogLog
+    approximate: bool = False
 
 # Nouveaux schémas pour l'analyse d'un test (Search bar)
 class TestNumericSummary(BaseModel):
@@ -52,6 +72,10 @@ class TestStatsResponse(BaseModel):
     values: List[TestValueDistribution]
     error: Optional[str] = None
 
+class Suggestion(BaseModel):
+    value: str
+    count: int  # nombre de résultats portant ce nom (graphies fusionnées)
+
 # === SCHEMAS PANELS ===
 
 class PanelResponse(BaseModel):
@@ -76,6 +100,7 @@ class RepeatResponse(BaseModel):
 
 class LLMQueryRequest(BaseModel):
     prompt: str
+    mode: Literal["pandas", "sql"] = "pandas"  # sql : requête SELECT exécutée par DuckDB
 
 class LLMQueryResponse(BaseModel):
     result: Any
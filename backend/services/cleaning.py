@@ -0,0 +1,275 @@
+"""
+Nettoyage du CSV brut et rapport de qualité des données, en un module importable.
+
+Reprend les règles de `scripts/02_clean_data.py` et les contrôles de `scripts/01_inspect_data.py`
+(les deux scripts ne sont plus que des CLI sur ce module) :
+- le CSV est découpé en blocs d'octets coupés en fin de ligne (hors champ entre guillemets) ;
+- chaque bloc est parsé, contrôlé et nettoyé avec des opérations vectorisées pandas/numpy, puis
+  converti en table Arrow au schéma de `results` ;
+- les blocs sont traités par un pool de processus (CLEAN_WORKERS, tous les cœurs par défaut) et
+  rendus dans l'ordre du fichier. Coût linéaire, mémoire bornée par workers x taille de bloc.
+
+Le module n'importe rien de `backend` : les processus du pool (démarrés en "spawn", sûr depuis
+un serveur multi-thread) le chargent sans initialiser l'application.
+"""
+
+import io
+import multiprocessing
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+EXPECTED_COLS = ["numorden", "sexo", "edad", "nombre", "textores", "nombre2", "Date"]
+
+# Schéma Parquet de la table `results`
+RESULTS_SCHEMA = pa.schema([
+    ("numorden", pa.string()),
+    ("sexo", pa.string()),
+    ("edad", pa.int16()),
+    ("nombre", pa.string()),
+    ("textores", pa.string()),
+    # textores séparé à l'ingestion : valeur numérique (NULL si qualitatif) / texte qualitatif (NULL si numérique)
+    ("textores_num", pa.float64()),
+    ("textores_text", pa.string()),
+    ("nombre2", pa.string()),
+    ("Date", pa.date32()),
+    ("year_month", pa.string()),
+    ("day", pa.int32()),
+])
+
+# Colonnes construites par clean_chunk, avant ajout des clés de date
+CLEAN_SCHEMA = pa.schema([f for f in RESULTS_SCHEMA if f.name not in ("year_month", "day")])
+
+RAW_ENCODING = "latin1"
+DATE_FORMAT = "%d/%m/%Y"
+# ~250 000 lignes par bloc pour un export type
+CHUNK_BYTES = 16 * 1024 * 1024
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", "0")) or os.cpu_count() or 1
+# Tests les plus fréquents listés pour les lignes à edad = 0
+ZERO_AGE_TOP_TESTS = 10
+
+
+@dataclass
+class QualityReport:
+    """Contrôles de 01_inspect_data.py, cumulés bloc par bloc."""
+    rows_read: int = 0
+    rows_kept: int = 0
+    extra_columns: List[str] = field(default_factory=list)
+    missing_values: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(EXPECTED_COLS, 0))
+    # Valeurs renseignées mais illisibles (les valeurs vides sont dans missing_values)
+    invalid_dates: int = 0
+    invalid_ages: int = 0
+    zero_age_rows: int = 0
+    zero_age_patients: Set[str] = field(default_factory=set)
+    zero_age_tests: Counter = field(default_factory=Counter)
+    numeric_results: int = 0
+    qualitative_results: int = 0
+
+    def merge(self, other: "QualityReport"):
+        self.rows_read += other.rows_read
+        self.rows_kept += other.rows_kept
+        for col, n in other.missing_values.items():
+            self.missing_values[col] += n
+        self.invalid_dates += other.invalid_dates
+        self.invalid_ages += other.invalid_ages
+        self.zero_age_rows += other.zero_age_rows
+        self.zero_age_patients |= other.zero_age_patients
+        self.zero_age_tests.update(other.zero_age_tests)
+        self.numeric_results += other.numeric_results
+        self.qualitative_results += other.qualitative_results
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rows_read": self.rows_read,
+            "rows_kept": self.rows_kept,
+            # Lignes écartées : âge manquant, illisible ou nul
+            "rows_dropped": self.rows_read - self.rows_kept,
+            "extra_columns": self.extra_columns,
+            "missing_values": self.missing_values,
+            "invalid_dates": self.invalid_dates,
+            "invalid_ages": self.invalid_ages,
+            "zero_age": {
+                "rows": self.zero_age_rows,
+                "percent": round(self.zero_age_rows / self.rows_read * 100, 2) if self.rows_read else 0.0,
+                "patients": len(self.zero_age_patients),
+                "top_tests": [{"test": t, "count": n} for t, n in self.zero_age_tests.most_common(ZERO_AGE_TOP_TESTS)],
+            },
+            "textores": {"numeric": self.numeric_results, "qualitative": self.qualitative_results},
+        }
+
+
+def read_header(csv_path: Path, encoding: str = RAW_ENCODING) -> List[str]:
+    return list(pd.read_csv(csv_path, encoding=encoding, nrows=0).columns)
+
+
+def check_columns(csv_path: Path, encoding: str = RAW_ENCODING):
+    """Vérifie l'en-tête du CSV sans lire les données."""
+    header = read_header(csv_path, encoding)
+    missing = [c for c in EXPECTED_COLS if c not in header]
+    if missing:
+        raise ValueError(f"Colonnes manquantes : {missing}")
+
+
+def inspect_chunk(df: pd.DataFrame) -> QualityReport:
+    """Contrôles de qualité d'un bloc brut (tout en texte, avant nettoyage)."""
+    df = df[EXPECTED_COLS]
+    report = QualityReport(rows_read=len(df))
+    report.missing_values = {col: int(n) for col, n in df.isna().sum().items()}
+
+    dates = pd.to_datetime(df["Date"], format=DATE_FORMAT, errors="coerce")
+    report.invalid_dates = int((dates.isna() & df["Date"].notna()).sum())
+
+    # 'inf' / 'nan' : illisibles, comme une valeur non numérique
+    edad = pd.to_numeric(df["edad"], errors="coerce")
+    edad = edad.where(np.isfinite(edad))
+    report.invalid_ages = int((edad.isna() & df["edad"].notna()).sum())
+    zero_age = (edad == 0).to_numpy()
+    report.zero_age_rows = int(zero_age.sum())
+    if report.zero_age_rows:
+        report.zero_age_patients = set(df["numorden"][zero_age].dropna().str.strip())
+        report.zero_age_tests = Counter(df["nombre"][zero_age].dropna().value_counts().to_dict())
+
+    # Numérique = valeur finie, comme dans clean_chunk
+    is_num = np.isfinite(pd.to_numeric(df["textores"], errors="coerce").to_numpy(dtype=np.float64))
+    report.numeric_results = int(is_num.sum())
+    report.qualitative_results = int((~is_num & df["textores"].notna().to_numpy()).sum())
+    return report
+
+
+def clean_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Applique les règles de nettoyage à un bloc :
+    - colonnes attendues uniquement
+    - Date au format jour/mois/année, convertie en date
+    - edad numérique, lignes avec âge manquant ou nul supprimées
+    - nombre2 manquant -> "Unknown"
+    - textores numérique formaté avec 2 décimales, texte qualitatif conservé
+    - textores_num (DOUBLE) et textores_text (qualitatif) : textores déjà typé pour les agrégats
+    """
+    df = df[EXPECTED_COLS]
+
+    # Valeur non finie ('inf') : traitée comme un âge manquant (le cast en int16 échouerait)
+    edad = pd.to_numeric(df["edad"], errors="coerce")
+    edad = edad.where(np.isfinite(edad))
+    keep = edad.notna() & (edad != 0)
+    df = df.loc[keep].copy()
+    df["edad"] = edad[keep].astype("int16")
+
+    df["Date"] = pd.to_datetime(df["Date"], format=DATE_FORMAT, errors="coerce")
+    df["nombre2"] = df["nombre2"].fillna("Unknown")
+    df["numorden"] = df["numorden"].str.strip()
+
+    num = pd.to_numeric(df["textores"], errors="coerce").to_numpy(dtype=np.float64)
+    # 'nan' / 'inf' sont acceptés par to_numeric mais ne sont pas des résultats numériques : texte conservé
+    is_num = np.isfinite(num)
+    textores = df["textores"].to_numpy(dtype=object)
+    formatted = np.char.mod("%.2f", num[is_num])
+    textores[is_num] = formatted
+    df["textores"] = textores
+    # Valeur du texte formaté (2 décimales) : identique à TEXTORES_NUM_SQL (ingestion), comme après migration
+    textores_num = np.full(len(df), np.nan)
+    textores_num[is_num] = formatted.astype(np.float64)
+    df["textores_num"] = textores_num
+    df["textores_text"] = df["textores"].where(~is_num)
+
+    return df
+
+
+def to_results_table(cleaned: pd.DataFrame) -> pa.Table:
+    """Convertit un bloc nettoyé en table Arrow et ajoute les clés year_month (YYYY-MM) et day (YYYYMMDD)."""
+    table = pa.Table.from_pandas(cleaned, schema=CLEAN_SCHEMA, preserve_index=False)
+    dates = table["Date"]
+    year_month = pc.strftime(dates, format="%Y-%m")
+    day = pc.add(
+        pc.multiply(pc.year(dates), 10000),
+        pc.add(pc.multiply(pc.month(dates), 100), pc.day(dates)),
+    ).cast(pa.int32())
+    return table.append_column("year_month", year_month).append_column("day", day)
+
+
+def clean_block(header: bytes, block: bytes, encoding: str = RAW_ENCODING) -> Tuple[Optional[pa.Table], QualityReport]:
+    """Parse, contrôle et nettoie un bloc de lignes CSV (exécuté dans un processus du pool)."""
+    df = pd.read_csv(io.BytesIO(header + block), encoding=encoding, usecols=EXPECTED_COLS, dtype=str)
+    report = inspect_chunk(df)
+    cleaned = clean_chunk(df)
+    report.rows_kept = len(cleaned)
+    return (to_results_table(cleaned) if len(cleaned) else None), report
+
+
+def _record_end(buf: bytes) -> int:
+    """Position après la dernière fin de ligne hors guillemets (`buf` commence en début de ligne), 0 si aucune."""
+    cut = buf.rfind(b"\n")
+    # Nombre impair de guillemets avant la fin de ligne : elle est dans un champ entre guillemets
+    while cut != -1 and buf.count(b'"', 0, cut) % 2:
+        cut = buf.rfind(b"\n", 0, cut)
+    return cut + 1
+
+
+def iter_blocks(csv_path: Path, chunk_bytes: int = CHUNK_BYTES) -> Tuple[bytes, Iterator[bytes]]:
+    """Retourne (ligne d'en-tête, itérateur de blocs d'environ chunk_bytes octets coupés en fin de ligne)."""
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+
+    def blocks() -> Iterator[bytes]:
+        with open(csv_path, "rb") as f:
+            f.seek(len(header))
+            rest = b""
+            while True:
+                data = f.read(chunk_bytes)
+                buf = rest + data
+                if not data:
+                    if buf.strip():
+                        yield buf
+                    return
+                cut = _record_end(buf)
+                if cut:
+                    yield buf[:cut]
+                rest = buf[cut:]
+
+    return header, blocks()
+
+
+def iter_clean_tables(
+    csv_path: Path,
+    chunk_bytes: int = CHUNK_BYTES,
+    encoding: str = RAW_ENCODING,
+    workers: int = CLEAN_WORKERS,
+) -> Iterator[Tuple[Optional[pa.Table], QualityReport]]:
+    """
+    Nettoie le CSV bloc par bloc : (table Arrow au schéma RESULTS_SCHEMA ou None si tout est écarté,
+    rapport du bloc), dans l'ordre du fichier. Au plus 2 blocs par worker en vol.
+    """
+    header, blocks = iter_blocks(csv_path, chunk_bytes)
+    # Petit fichier : pas de pool (démarrer les processus coûterait plus que le nettoyage)
+    if workers <= 1 or os.path.getsize(csv_path) <= chunk_bytes:
+        for block in blocks:
+            yield clean_block(header, block, encoding)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.submit(clean_block, header, block, encoding))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def quality_report(csv_path: Path, encoding: str = RAW_ENCODING, workers: int = CLEAN_WORKERS) -> QualityReport:
+    """Rapport de qualité complet d'un CSV brut (un passage, sans rien écrire)."""
+    report = QualityReport(extra_columns=[c for c in read_header(csv_path, encoding) if c not in EXPECTED_COLS])
+    for _, chunk_report in iter_clean_tables(csv_path, encoding=encoding, workers=workers):
+        report.merge(chunk_report)
+    return report
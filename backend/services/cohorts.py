@@ -0,0 +1,176 @@
+"""
+Cohortes nommées et persistées.
+
+Une cohorte enregistre son filtre et, pour une version donnée du jeu de données,
+la liste triée des row_id de `results` qui y répondent ainsi que la liste triée de
+ses patients (numorden). Les endpoints d'analyse acceptent ?cohort=<nom> et lisent
+alors une vue restreinte à ces identifiants au lieu de réévaluer le filtre.
+
+Si le jeu de données a changé depuis l'enregistrement, la cohorte est recalculée
+à partir de son filtre au premier accès, hors du verrou d'écriture ; pendant une
+ingestion ou un ajout, la dernière matérialisation reste servie.
+"""
+
+import json
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+import pyarrow as pa
+
+from backend.database import RESULTS_PATH, _get_db, _write_lock, dataset_version, try_write_connection
+from backend.schemas import CohortFilter
+from backend.utils.filter_dsl import compile_filter, parquet_schema
+from backend.utils.metrics import InstrumentedConnection
+
+# Le nom est interpolé dans le SQL des vues restreintes : liste de caractères fermée
+COHORT_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Tables restreintes par ligne (row_id) ou par patient (numorden)
+ROW_SCOPED_TABLES = {"results"}
+PATIENT_SCOPED_TABLES = {"panels", "repeats"}
+
+
+class CohortNotFound(LookupError):
+    pass
+
+
+def validate_name(name: str) -> str:
+    if not COHORT_NAME_RE.match(name or ""):
+        raise ValueError("Nom de cohorte invalide (lettres, chiffres, '_' ou '-', 64 caractères max).")
+    return name
+
+
+def _ensure_tables(con: duckdb.DuckDBPyConnection):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS cohorts (
+            name VARCHAR PRIMARY KEY, filter VARCHAR, dataset_version VARCHAR,
+            n_rows BIGINT, n_patients BIGINT, created_at TIMESTAMP
+        )
+    """)
+    con.execute("CREATE TABLE IF NOT EXISTS cohort_rows (cohort VARCHAR, row_id BIGINT)")
+    con.execute("CREATE TABLE IF NOT EXISTS cohort_patients (cohort VARCHAR, numorden VARCHAR)")
+
+
+def _meta(row) -> Dict[str, Any]:
+    return {
+        "name": row[0],
+        "filter": json.loads(row[1]),
+        "dataset_version": row[2],
+        "rows": row[3],
+        "patients": row[4],
+        "created_at": row[5].isoformat() if row[5] else None,
+    }
+
+
+def evaluate_cohort(con: duckdb.DuckDBPyConnection, filters: CohortFilter) -> Tuple[pa.Table, pa.Table]:
+    """row_id et numorden (triés) répondant au filtre ; lecture seule, aucun verrou nécessaire."""
+    compiled = compile_filter(filters, parquet_schema(RESULTS_PATH))
+    rows = con.execute(f"SELECT row_id FROM results WHERE {compiled.sql} ORDER BY row_id", compiled.params).fetch_arrow_table()
+    patients = con.execute(
+        f"SELECT DISTINCT numorden FROM results WHERE {compiled.sql} ORDER BY numorden", compiled.params
+    ).fetch_arrow_table()
+    return rows, patients
+
+
+def _store_cohort(
+    con: duckdb.DuckDBPyConnection, name: str, filters: CohortFilter, version: str, rows: pa.Table, patients: pa.Table
+) -> Dict[str, Any]:
+    """Remplace la matérialisation de la cohorte en une transaction (curseur d'écriture)."""
+    _ensure_tables(con)
+    con.register("cohort_rows_new", rows)
+    con.register("cohort_patients_new", patients)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute("DELETE FROM cohort_rows WHERE cohort = ?", [name])
+        con.execute("DELETE FROM cohort_patients WHERE cohort = ?", [name])
+        con.execute("INSERT INTO cohort_rows SELECT ?, row_id FROM cohort_rows_new", [name])
+        con.execute("INSERT INTO cohort_patients SELECT ?, numorden FROM cohort_patients_new", [name])
+        con.execute(
+            "INSERT OR REPLACE INTO cohorts VALUES (?, ?, ?, ?, ?, ?)",
+            [name, filters.model_dump_json(), version, rows.num_rows, patients.num_rows, datetime.now()],
+        )
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.unregister("cohort_rows_new")
+        con.unregister("cohort_patients_new")
+    return get_cohort(con, name)
+
+
+def save_cohort(con: duckdb.DuckDBPyConnection, name: str, filters: CohortFilter) -> Dict[str, Any]:
+    """
+    Évalue le filtre une fois et stocke les row_id / numorden triés (curseur d'écriture).
+    Remplace une cohorte existante du même nom.
+    """
+    validate_name(name)
+    rows, patients = evaluate_cohort(con, filters)
+    return _store_cohort(con, name, filters, dataset_version(), rows, patients)
+
+
+def get_cohort(con: duckdb.DuckDBPyConnection, name: str) -> Dict[str, Any]:
+    _ensure_tables(con)
+    row = con.execute("SELECT * FROM cohorts WHERE name = ?", [name]).fetchone()
+    if row is None:
+        raise CohortNotFound(name)
+    return _meta(row)
+
+
+def list_cohorts(con: duckdb.DuckDBPyConnection) -> List[Dict[str, Any]]:
+    _ensure_tables(con)
+    return [_meta(r) for r in con.execute("SELECT * FROM cohorts ORDER BY name").fetchall()]
+
+
+def delete_cohort(con: duckdb.DuckDBPyConnection, name: str):
+    get_cohort(con, name)
+    con.execute("DELETE FROM cohort_rows WHERE cohort = ?", [name])
+    con.execute("DELETE FROM cohort_patients WHERE cohort = ?", [name])
+    con.execute("DELETE FROM cohorts WHERE name = ?", [name])
+
+
+def ensure_current(name: str) -> Dict[str, Any]:
+    """
+    Métadonnées de la cohorte, recalculée d'abord si elle date d'une autre version du jeu de données.
+    Le filtre est évalué hors du verrou d'écriture, qui n'est pris que pour remplacer la matérialisation :
+    si une ingestion ou un ajout est en cours, la dernière matérialisation est servie sans attendre.
+    """
+    validate_name(name)
+    cur = InstrumentedConnection(_get_db().cursor())
+    try:
+        meta = get_cohort(cur, name)
+        version = dataset_version()
+        if meta["dataset_version"] == version or _write_lock.locked():
+            return meta
+        filters = CohortFilter.model_validate(meta["filter"])
+        rows, patients = evaluate_cohort(cur, filters)
+    finally:
+        cur.close()
+
+    with try_write_connection() as con:
+        # Écriture démarrée ou nouvelle version publiée pendant l'évaluation : recalcul au prochain accès
+        if con is None or dataset_version() != version:
+            return meta
+        current = get_cohort(con, name)
+        if current["dataset_version"] == version or current["filter"] != meta["filter"]:
+            return current
+        meta = _store_cohort(con, name, filters, version, rows, patients)
+        print(f"✅ Cohorte {name} recalculée pour la version {version}.")
+    return meta
+
+
+def scoped_table(table: str, cohort: Optional[str]) -> str:
+    """
+    Expression FROM pour `table`, restreinte à la cohorte si elle est donnée :
+    results par row_id, panels / repeats par patient. Garde le nom de la table comme alias.
+    """
+    if not cohort:
+        return table
+    ensure_current(cohort)
+    if table in ROW_SCOPED_TABLES:
+        return f"(SELECT * FROM {table} WHERE row_id IN (SELECT row_id FROM cohort_rows WHERE cohort = '{cohort}')) AS {table}"
+    if table in PATIENT_SCOPED_TABLES:
+        return f"(SELECT * FROM {table} WHERE numorden IN (SELECT numorden FROM cohort_patients WHERE cohort = '{cohort}')) AS {table}"
+    raise ValueError(f"Table non filtrable par cohorte : {table}")
@@ -0,0 +1,586 @@
+"""
+Tables dérivées de `results` (Panels, Repeats, Pairs, Service pairs, Test stats), construites dans la base
+persistante puis exportées en Parquet.
+"""
+
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import duckdb
+
+from backend.database import (
+    APPEND_DIRS, TABLE_SOURCES, append_files, clear_appends, in_version, register_table, write_append_manifest,
+)
+from backend.services.ingestion import PATIENT_ROW_GROUP_ROWS
+from backend.services.profile import append_profile, read_profile, write_profile
+
+# Clé de recherche d'un test : casse, accents et espaces ignorés ('Protéines totales ' -> 'proteines totales')
+TEST_KEY_SQL = "lower(strip_accents(trim({})))"
+# Esquisse de quantiles : percentiles 0 à 100 de textores_num (p25 = quantiles[25])
+TEST_QUANTILES = [i / 100 for i in range(101)]
+# Valeurs les plus fréquentes conservées par test
+TEST_TOP_VALUES = 50
+# État fusionnable de test_stats (voir test_stats_merge_select) : valeurs de textores comptées par test,
+# et taille de l'histogramme des valeurs numériques
+TEST_TOP_STATE = 10 * TEST_TOP_VALUES
+TEST_SKETCH_BINS = 512
+
+# Export Parquet des tables dérivées : ordre des lignes, options COPY
+# (panels / repeats triés par patient, comme results)
+DERIVED_EXPORTS = {
+    "panels": ("numorden, Date", f", ROW_GROUP_SIZE {PATIENT_ROW_GROUP_ROWS}"),
+    "repeats": ("numorden, nombre", f", ROW_GROUP_SIZE {PATIENT_ROW_GROUP_ROWS}"),
+    "pairs": ("service NULLS FIRST, year_month", ""),
+    "service_pairs": ("service1, service2", ""),
+    "test_stats": ("test_key", ""),
+}
+# Au-delà de ce nombre de deltas, un ajout réécrit le Parquet complet de la table (compaction) :
+# borne le nombre de fichiers à fusionner au chargement
+DERIVED_MAX_DELTAS = int(os.getenv("DERIVED_MAX_DELTAS", "16"))
+
+
+def _copy_parquet(con: duckdb.DuckDBPyConnection, query: str, path: Path, options: str = ""):
+    # Fichier temporaire puis rename : `path` peut être lié en dur à une version antérieure (voir fork_version)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    con.execute(f"COPY ({query}) TO '{tmp_path.as_posix()}' (FORMAT 'parquet'{options})")
+    os.replace(tmp_path, path)
+
+
+def export_derived_table(con: duckdb.DuckDBPyConnection, name: str, root: Optional[Path] = None, query: Optional[str] = None):
+    """Écrit le Parquet complet de la table dans la version `root` (ses deltas sont abandonnés) et l'enregistre."""
+    order, options = DERIVED_EXPORTS[name]
+    _copy_parquet(con, query or f"SELECT * FROM {name} ORDER BY {order}", in_version(TABLE_SOURCES[name], root), options)
+    clear_appends(name, root)
+    register_table(con, name, root)
+
+
+def append_derived_delta(con: duckdb.DuckDBPyConnection, name: str, delta: str, batch: str, root: Path):
+    """
+    Ajoute le delta d'un lot (table temporaire `delta`, voir DELTA_REPLACE_KEYS / DELTA_SUM_KEYS) aux
+    fichiers de la table dans la version `root`, sans réécrire son Parquet principal.
+    Compaction (export complet) une fois DERIVED_MAX_DELTAS deltas accumulés.
+    """
+    files = append_files(root, name)
+    if len(files) >= DERIVED_MAX_DELTAS:
+        export_derived_table(con, name, root)
+        return
+    order, options = DERIVED_EXPORTS[name]
+    path = in_version(APPEND_DIRS[name], root) / f"{batch}.parquet"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _copy_parquet(con, f"SELECT * FROM {delta} ORDER BY {order}", path, options)
+    write_append_manifest(files + [path], root, name)
+    register_table(con, name, root)
+
+
+def generate_derived_tables(con: duckdb.DuckDBPyConnection, root: Optional[Path] = None):
+    """
+    Génère les tables dérivées (Panels, Repeats, Pairs, Service pairs, Test stats) dans la base persistante
+    puis les exporte en Parquet dans la version `root` (par défaut la version publiée).
+    La date est déjà typée à l'ingestion (colonnes Date, year_month, day).
+    Panels et Repeats sont triés par patient, comme results.
+    """
+    print("🔄 Génération des tables dérivées...")
+
+    try:
+        # 1. PANELS
+        con.execute(f"""
+            CREATE OR REPLACE TABLE panels AS
+            {panels_select()}
+            ORDER BY numorden, Date
+        """)
+        export_derived_table(con, "panels", root, "SELECT * FROM panels")
+        print("✅ Panels générés.")
+
+        # 2. REPEATS
+        con.execute(f"""
+            CREATE OR REPLACE TABLE repeats AS
+            {repeats_select()}
+            ORDER BY numorden, nombre
+        """)
+        export_derived_table(con, "repeats", root, "SELECT * FROM repeats")
+        print("✅ Répétitions générées.")
+
+        # 3. PAIRS (co-ordering)
+        generate_pairs_table(con, root)
+        print("✅ Paires co-prescrites générées.")
+
+        # 4. SERVICE PAIRS (matrice service x service)
+        generate_service_pairs_table(con, root)
+        print("✅ Matrice des services générée.")
+
+        # 5. TEST STATS (résumé de distribution par test pour /stats/test)
+        generate_test_stats_table(con, root)
+        print("✅ Statistiques par test générées.")
+
+        # 6. PROFIL du jeu de données (sidecar JSON pour /stats/summary)
+        write_profile(con, root)
+        print("✅ Profil du jeu de données écrit.")
+        
+    except Exception as e:
+        print(f"⚠️ Erreur dérivation : {e}")
+        raise e
+
+
+def panels_select(results: str = "results") -> str:
+    """Requête des panels : un enregistrement par patient-jour avec la liste des tests."""
+    return f"""
+        SELECT 
+            numorden, 
+            Date, 
+            ANY_VALUE(year_month) as year_month,
+            ANY_VALUE(day) as day,
+            COUNT(*) as n_tests, 
+            list(nombre) as tests_list
+        FROM {results}
+        GROUP BY numorden, Date
+    """
+
+
+def repeats_select(results: str = "results") -> str:
+    """
+    Requête des tests répétés par patient.
+    Dates typées : min/max directs, reformatées uniformément en DD/MM/YYYY pour l'affichage.
+    """
+    return f"""
+        SELECT 
+            numorden, 
+            nombre, 
+            COUNT(*) as repeat_count,
+            MIN(Date) as first_date_obj,
+            MAX(Date) as last_date_obj,
+            date_diff('day', MIN(Date), MAX(Date)) as days_span,
+            strftime(MIN(Date), '%d/%m/%Y') as first_date,
+            strftime(MAX(Date), '%d/%m/%Y') as last_date
+        FROM {results}
+        GROUP BY numorden, nombre
+        HAVING count(*) > 1
+    """
+
+
+# Tests distincts par patient-jour : depuis les panels (table complète) ou depuis results (sous-ensemble)
+PANEL_TESTS_FROM_PANELS = """
+    SELECT numorden, Date, year_month, unnest(list_distinct(tests_list)) AS test
+    FROM panels
+    WHERE Date IS NOT NULL
+"""
+PANEL_TESTS_FROM_RESULTS = """
+    SELECT DISTINCT numorden, Date, year_month, nombre AS test
+    FROM {results}
+    WHERE Date IS NOT NULL AND nombre IS NOT NULL
+"""
+
+
+def pairs_select(results: str = "results", panel_tests: str = PANEL_TESTS_FROM_PANELS) -> str:
+    """
+    Requête des paires de tests co-prescrites (même patient, même jour), par mois.
+    - service NULL : paires comptées sur tous les tests du patient-jour (tous services)
+    - service = X  : paires dont les deux tests ont été prescrits par le service X ce jour-là
+    co_occurrences = nombre de patient-jours où la paire (test1 < test2) apparaît.
+    `results` peut être une sous-requête aliasée (ex: cohorte).
+    CTE matérialisées : chacune est lue deux fois (auto-jointure) et, inlinée, la requête exécutée
+    telle quelle fait échouer DuckDB 1.1.0 ("Attempted to access index 1 within vector of size 1").
+    """
+    return f"""
+        WITH panel_tests AS MATERIALIZED ({panel_tests.format(results=results)}),
+        service_tests AS MATERIALIZED (
+            SELECT DISTINCT numorden, Date, year_month, nombre2 AS service, nombre AS test
+            FROM {results}
+            WHERE Date IS NOT NULL AND nombre IS NOT NULL AND nombre2 IS NOT NULL
+        )
+        SELECT NULL::VARCHAR AS service, a.year_month, a.test AS test1, b.test AS test2, COUNT(*) AS co_occurrences
+        FROM panel_tests a
+        JOIN panel_tests b ON a.numorden = b.numorden AND a.Date = b.Date AND a.test < b.test
+        GROUP BY a.year_month, a.test, b.test
+        UNION ALL
+        SELECT a.service, a.year_month, a.test AS test1, b.test AS test2, COUNT(*) AS co_occurrences
+        FROM service_tests a
+        JOIN service_tests b ON a.numorden = b.numorden AND a.Date = b.Date AND a.service = b.service AND a.test < b.test
+        GROUP BY a.service, a.year_month, a.test, b.test
+    """
+
+
+def service_pairs_select(results: str = "results") -> str:
+    """
+    Requête de la matrice creuse de co-occurrence service x service (triangle supérieur, service1 <= service2).
+    freq = nombre de patient-jours où les deux services apparaissent ;
+    la diagonale (service1 = service2) donne le nombre de patient-jours du service.
+    """
+    return f"""
+        WITH panel_services AS (
+            SELECT DISTINCT numorden, Date, nombre2 AS service
+            FROM {results}
+            WHERE Date IS NOT NULL AND nombre2 IS NOT NULL
+        )
+        SELECT a.service AS service1, b.service AS service2, COUNT(*) AS freq
+        FROM panel_services a
+        JOIN panel_services b ON a.numorden = b.numorden AND a.Date = b.Date AND a.service <= b.service
+        GROUP BY a.service, b.service
+    """
+
+
+def test_stats_select(results: str = "results") -> str:
+    """
+    Résumé de distribution par test (clé normalisée, voir TEST_KEY_SQL) :
+    n_rows, n_numeric, mean, std, quantiles (esquisse, voir TEST_QUANTILES), top_values
+    (les TEST_TOP_VALUES valeurs de textores les plus fréquentes) et names (graphies de nombre).
+    Plus l'état fusionnable utilisé par les ajouts (voir test_stats_merge_select) : m2 (somme des carrés
+    des écarts à la moyenne), value_counts (histogramme des valeurs, voir _value_sketch_select),
+    name_counts et textores_counts (comptes par graphie et par valeur, TEST_TOP_STATE plus fréquentes).
+    """
+    quantiles = ", ".join(str(q) for q in TEST_QUANTILES)
+    counts = _test_counts_ctes(
+        "SELECT test_key, nombre, COUNT(*) AS count FROM tests GROUP BY test_key, nombre",
+        "SELECT test_key, textores, COUNT(*) AS count FROM tests WHERE textores IS NOT NULL GROUP BY test_key, textores",
+        "SELECT test_key, textores_num AS value, COUNT(*) AS count FROM tests WHERE textores_num IS NOT NULL GROUP BY test_key, textores_num",
+    )
+    return f"""
+        WITH tests AS (
+            SELECT {TEST_KEY_SQL.format("nombre")} AS test_key, nombre, textores, textores_num
+            FROM {results}
+            WHERE nombre IS NOT NULL
+        ),
+        summary AS (
+            SELECT
+                test_key,
+                COUNT(*) AS n_rows,
+                COUNT(textores_num) AS n_numeric,
+                AVG(textores_num) AS mean,
+                STDDEV(textores_num) AS std,
+                QUANTILE_CONT(textores_num, [{quantiles}]) AS quantiles,
+                COALESCE(VAR_POP(textores_num) * COUNT(textores_num), 0) AS m2
+            FROM tests
+            GROUP BY test_key
+        ),
+        {counts}
+        SELECT
+            s.test_key, n.test, n.names, s.n_rows, s.n_numeric, s.mean, s.std, s.quantiles,
+            list_slice(t.textores_counts, 1, {TEST_TOP_VALUES}) AS top_values,
+            s.m2, v.value_counts, n.name_counts, t.textores_counts
+        FROM summary s
+        JOIN name_counts n USING (test_key)
+        LEFT JOIN textores_counts t USING (test_key)
+        LEFT JOIN value_counts v USING (test_key)
+    """
+
+
+def test_stats_merge_select(parts: str) -> str:
+    """
+    Fusion de résumés par test (lignes de même test_key dans `parts`, ex: test_stats + résumé d'un lot)
+    à partir de leur état, sans relire results :
+    - n_rows / n_numeric additionnés, mean et m2 combinés (formule de Chan), std = sqrt(m2 / (n - 1))
+    - name_counts, textores_counts, value_counts : comptes additionnés par graphie / valeur
+    - quantiles interpolés dans l'histogramme fusionné, comme QUANTILE_CONT
+    Exact tant que chaque test compte au plus TEST_SKETCH_BINS valeurs numériques et TEST_TOP_STATE
+    valeurs de textores distinctes ; au-delà, quantiles et top_values sont approchés.
+    """
+    positions = ", ".join(f"({i}, {q})" for i, q in enumerate(TEST_QUANTILES))
+    counts = _test_counts_ctes(
+        """
+        SELECT test_key, u.nombre AS nombre, CAST(SUM(u.count) AS BIGINT) AS count
+        FROM (SELECT test_key, unnest(name_counts) AS u FROM parts)
+        GROUP BY test_key, u.nombre
+        """,
+        """
+        SELECT test_key, u.textores AS textores, CAST(SUM(u.count) AS BIGINT) AS count
+        FROM (SELECT test_key, unnest(textores_counts) AS u FROM parts)
+        GROUP BY test_key, u.textores
+        """,
+        """
+        SELECT test_key, u.value AS value, CAST(SUM(u.count) AS BIGINT) AS count
+        FROM (SELECT test_key, unnest(value_counts) AS u FROM parts)
+        GROUP BY test_key, u.value
+        """,
+    )
+    return f"""
+        WITH parts AS ({parts}),
+        moments AS (
+            SELECT
+                test_key,
+                CAST(SUM(n_rows) AS BIGINT) AS n_rows,
+                CAST(SUM(n_numeric) AS BIGINT) AS n_numeric,
+                SUM(n_numeric * mean) / NULLIF(SUM(n_numeric), 0) AS mean
+            FROM parts
+            GROUP BY test_key
+        ),
+        summary AS (
+            SELECT
+                m.test_key, m.n_rows, m.n_numeric, m.mean,
+                GREATEST(COALESCE(SUM(p.m2 + p.n_numeric * (p.mean - m.mean) ^ 2), 0), 0) AS m2
+            FROM moments m
+            JOIN parts p USING (test_key)
+            GROUP BY m.test_key, m.n_rows, m.n_numeric, m.mean
+        ),
+        {counts},
+        -- Rang de la première occurrence de chaque valeur de l'histogramme (0-based)
+        bins AS (
+            SELECT test_key, u.value AS value,
+                SUM(u.count) OVER (PARTITION BY test_key ORDER BY u.value ROWS UNBOUNDED PRECEDING) - u.count AS start
+            FROM (SELECT test_key, unnest(value_counts) AS u FROM value_counts)
+        ),
+        -- Même interpolation que QUANTILE_CONT : rang h = (n - 1) * q, entre les valeurs de rang floor(h) et ceil(h)
+        positions AS (
+            SELECT s.test_key, q.i, (s.n_numeric - 1) * q.q AS h, floor((s.n_numeric - 1) * q.q) AS lo, ceil((s.n_numeric - 1) * q.q) AS hi
+            FROM summary s, (VALUES {positions}) AS q(i, q)
+            WHERE s.n_numeric > 0
+        ),
+        quantiles AS (
+            SELECT p.test_key, list(lo.value + (p.h - p.lo) * (hi.value - lo.value) ORDER BY p.i) AS quantiles
+            FROM positions p
+            ASOF JOIN bins lo ON p.test_key = lo.test_key AND p.lo >= lo.start
+            ASOF JOIN bins hi ON p.test_key = hi.test_key AND p.hi >= hi.start
+            GROUP BY p.test_key
+        )
+        SELECT
+            s.test_key, n.test, n.names, s.n_rows, s.n_numeric, s.mean,
+            CASE WHEN s.n_numeric > 1 THEN sqrt(s.m2 / (s.n_numeric - 1)) END AS std,
+            q.quantiles,
+            list_slice(t.textores_counts, 1, {TEST_TOP_VALUES}) AS top_values,
+            s.m2, v.value_counts, n.name_counts, t.textores_counts
+        FROM summary s
+        JOIN name_counts n USING (test_key)
+        LEFT JOIN textores_counts t USING (test_key)
+        LEFT JOIN value_counts v USING (test_key)
+        LEFT JOIN quantiles q USING (test_key)
+    """
+
+
+def _test_counts_ctes(name_counts: str, textores_counts: str, value_counts: str) -> str:
+    """
+    CTE name_counts, textores_counts et value_counts de test_stats, à partir de comptes
+    (test_key, nombre, count), (test_key, textores, count) et (test_key, value, count).
+    """
+    return f"""
+        name_counts AS (
+            SELECT
+                test_key,
+                first(nombre ORDER BY count DESC, nombre) AS test,
+                list(nombre ORDER BY nombre) AS names,
+                list({{'nombre': nombre, 'count': count}} ORDER BY count DESC, nombre) AS name_counts
+            FROM ({name_counts})
+            GROUP BY test_key
+        ),
+        textores_counts AS (
+            SELECT test_key, list({{'textores': textores, 'count': count}} ORDER BY rank) AS textores_counts
+            FROM (
+                SELECT *, row_number() OVER (PARTITION BY test_key ORDER BY count DESC, textores) AS rank
+                FROM ({textores_counts})
+            )
+            WHERE rank <= {TEST_TOP_STATE}
+            GROUP BY test_key
+        ),
+        value_counts AS ({_value_sketch_select(value_counts)})
+    """
+
+
+def _value_sketch_select(value_counts: str) -> str:
+    """
+    Histogramme des valeurs numériques d'un test, trié par valeur : (value, count) exacts jusqu'à
+    TEST_SKETCH_BINS valeurs distinctes. Au-delà, valeurs voisines regroupées en TEST_SKETCH_BINS - 2
+    intervalles d'effectifs égaux (value = moyenne de l'intervalle), minimum et maximum gardés à part.
+    """
+    return f"""
+        SELECT test_key, list({{'value': value, 'count': count}} ORDER BY value) AS value_counts
+        FROM (
+            SELECT
+                test_key,
+                CASE WHEN COUNT(*) = 1 THEN MIN(value) ELSE SUM(value * count) / SUM(count) END AS value,
+                CAST(SUM(count) AS BIGINT) AS count
+            FROM (
+                SELECT *,
+                    CASE WHEN n_values <= {TEST_SKETCH_BINS} OR pos = 1 OR pos = n_values THEN -pos
+                         ELSE floor(start * {TEST_SKETCH_BINS - 2} / total) END AS bin
+                FROM (
+                    SELECT test_key, value, count,
+                        COUNT(*) OVER (PARTITION BY test_key) AS n_values,
+                        row_number() OVER (PARTITION BY test_key ORDER BY value) AS pos,
+                        SUM(count) OVER (PARTITION BY test_key ORDER BY value ROWS UNBOUNDED PRECEDING) - count AS start,
+                        SUM(count) OVER (PARTITION BY test_key) AS total
+                    FROM ({value_counts})
+                )
+            )
+            GROUP BY test_key, bin
+        )
+        GROUP BY test_key
+    """
+
+
+def generate_test_stats_table(con: duckdb.DuckDBPyConnection, root: Optional[Path] = None):
+    """Matérialise les résumés par test (voir test_stats_select)."""
+    con.execute(f"""
+        CREATE OR REPLACE TABLE test_stats AS
+        SELECT * FROM ({test_stats_select()})
+        ORDER BY test_key
+    """)
+    export_derived_table(con, "test_stats", root, "SELECT * FROM test_stats")
+
+
+def generate_pairs_table(con: duckdb.DuckDBPyConnection, root: Optional[Path] = None):
+    """Matérialise les paires de tests co-prescrites (voir pairs_select)."""
+    con.execute(f"""
+        CREATE OR REPLACE TABLE pairs AS
+        SELECT * FROM ({pairs_select()})
+        ORDER BY service NULLS FIRST, year_month
+    """)
+    export_derived_table(con, "pairs", root, "SELECT * FROM pairs")
+
+
+def generate_service_pairs_table(con: duckdb.DuckDBPyConnection, root: Optional[Path] = None):
+    """Matérialise la matrice service x service (voir service_pairs_select)."""
+    con.execute(f"""
+        CREATE OR REPLACE TABLE service_pairs AS
+        SELECT * FROM ({service_pairs_select()})
+        ORDER BY service1, service2
+    """)
+    export_derived_table(con, "service_pairs", root, "SELECT * FROM service_pairs")
+
+
+# Patient-jours touchés par un lot : les paires n'y dépendent que des lignes du même patient-jour.
+# Lignes copiées une fois dans une table temporaire (affected_day_rows), complétée par le lot après
+# l'ajout : results n'est parcouru qu'une fois pour les comptes avant/après.
+AFFECTED_DAYS_ROWS = """
+    SELECT r.* FROM results r
+    SEMI JOIN affected_days d ON r.numorden = d.numorden AND r.Date = d.Date
+"""
+AFFECTED_PATIENTS_RESULTS = """
+    (SELECT r.* FROM results r
+     SEMI JOIN affected_patients p ON r.numorden = p.numorden) AS results
+"""
+# Résumés des tests touchés : existants (état fusionnable) + ceux du lot seul
+AFFECTED_TEST_STATS = """
+    SELECT * FROM test_stats WHERE test_key IN (SELECT test_key FROM batch_test_stats)
+    UNION ALL BY NAME
+    SELECT * FROM batch_test_stats
+"""
+
+
+def append_to_derived_tables(con: duckdb.DuckDBPyConnection, files: List[Path], root: Path):
+    """
+    Ajoute les fichiers d'un lot (voir ingestion.append_csv) à `results` et met à jour
+    les tables dérivées sans les recalculer entièrement :
+    - panels / repeats : seuls les patients du lot sont supprimés puis recalculés
+    - pairs / service_pairs : comptes = existants - contribution avant ajout des patient-jours
+      touchés + contribution après ajout
+    - test_stats : résumés des tests du lot fusionnés avec leur état (voir test_stats_merge_select),
+      sans relire leur historique dans results
+    Tout est appliqué dans une transaction. `root` est la nouvelle version (voir fork_version) :
+    chaque table y reçoit le delta du lot (voir append_derived_delta), le profil est fusionné avec
+    celui de la version publiée (voir append_profile) ; l'appelant la publie après le commit.
+    """
+    print(f"🔄 Ajout incrémental de {len(files)} fichier(s)...")
+    batch = ", ".join(f"'{f.as_posix()}'" for f in files)
+    previous_profile = read_profile()
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE delta AS SELECT * FROM read_parquet([{batch}])")
+        con.execute("CREATE OR REPLACE TEMP TABLE affected_patients AS SELECT DISTINCT numorden FROM delta")
+        con.execute("CREATE OR REPLACE TEMP TABLE affected_days AS SELECT DISTINCT numorden, Date FROM delta WHERE Date IS NOT NULL")
+        # Patients absents des panels (un panel par patient-jour, avec ou sans date) : nouveaux patients du profil
+        new_patients = con.execute("""
+            SELECT COUNT(*) FROM affected_patients a
+            ANTI JOIN panels p ON a.numorden = p.numorden
+            WHERE a.numorden IS NOT NULL
+        """).fetchone()[0]
+
+        con.execute(f"CREATE OR REPLACE TEMP TABLE affected_day_rows AS {AFFECTED_DAYS_ROWS}")
+        con.execute(f"CREATE OR REPLACE TEMP TABLE old_pairs AS {pairs_select('affected_day_rows', PANEL_TESTS_FROM_RESULTS)}")
+        con.execute(f"CREATE OR REPLACE TEMP TABLE old_service_pairs AS {service_pairs_select('affected_day_rows')}")
+
+        con.execute("INSERT INTO results BY NAME SELECT * FROM delta")
+        # Après ajout : mêmes patient-jours, lignes du lot comprises (celles sans date n'entrent pas dans les paires)
+        con.execute("INSERT INTO affected_day_rows BY NAME SELECT * FROM delta WHERE Date IS NOT NULL")
+
+        con.execute(f"CREATE OR REPLACE TEMP TABLE new_pairs AS {pairs_select('affected_day_rows', PANEL_TESTS_FROM_RESULTS)}")
+        con.execute(f"CREATE OR REPLACE TEMP TABLE new_service_pairs AS {service_pairs_select('affected_day_rows')}")
+
+        # Panels / Repeats : recalcul limité aux patients du lot (lignes de remplacement = delta de la table)
+        con.execute(f"CREATE OR REPLACE TEMP TABLE panels_delta AS {panels_select(AFFECTED_PATIENTS_RESULTS)}")
+        con.execute("DELETE FROM panels WHERE numorden IN (SELECT numorden FROM affected_patients)")
+        con.execute("INSERT INTO panels BY NAME SELECT * FROM panels_delta")
+        con.execute(f"CREATE OR REPLACE TEMP TABLE repeats_delta AS {repeats_select(AFFECTED_PATIENTS_RESULTS)}")
+        con.execute("DELETE FROM repeats WHERE numorden IN (SELECT numorden FROM affected_patients)")
+        con.execute("INSERT INTO repeats BY NAME SELECT * FROM repeats_delta")
+
+        # Statistiques par test : résumé du lot fusionné avec l'état des tests touchés
+        rebuilt = []
+        if _has_test_stats_state(con):
+            con.execute(f"CREATE OR REPLACE TEMP TABLE batch_test_stats AS {test_stats_select('delta')}")
+            con.execute(f"CREATE OR REPLACE TEMP TABLE test_stats_delta AS {test_stats_merge_select(AFFECTED_TEST_STATS)}")
+            con.execute("DELETE FROM test_stats WHERE test_key IN (SELECT test_key FROM test_stats_delta)")
+            con.execute("INSERT INTO test_stats BY NAME SELECT * FROM test_stats_delta")
+        else:
+            # test_stats d'une version antérieure, sans état : recalcul complet, une seule fois
+            con.execute(f"CREATE OR REPLACE TABLE test_stats AS SELECT * FROM ({test_stats_select()}) ORDER BY test_key")
+            rebuilt.append("test_stats")
+
+        # Paires : comptes signés (après - avant) appliqués sur place ; les paires tombées à zéro disparaissent
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE pairs_delta AS
+            SELECT service, year_month, test1, test2, CAST(SUM(co_occurrences) AS BIGINT) AS co_occurrences
+            FROM (
+                SELECT * FROM new_pairs
+                UNION ALL SELECT service, year_month, test1, test2, -co_occurrences FROM old_pairs
+            )
+            GROUP BY service, year_month, test1, test2
+            HAVING SUM(co_occurrences) <> 0
+        """)
+        _merge_counts(con, "pairs", "pairs_delta", ["service", "year_month", "test1", "test2"], "co_occurrences")
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE service_pairs_delta AS
+            SELECT service1, service2, CAST(SUM(freq) AS BIGINT) AS freq
+            FROM (
+                SELECT * FROM new_service_pairs
+                UNION ALL SELECT service1, service2, -freq FROM old_service_pairs
+            )
+            GROUP BY service1, service2
+            HAVING SUM(freq) <> 0
+        """)
+        _merge_counts(con, "service_pairs", "service_pairs_delta", ["service1", "service2"], "freq")
+
+        # Nouvelle version : manifeste de results complété, un delta par table dérivée, profil fusionné
+        write_append_manifest(append_files(root) + files, root)
+        register_table(con, "results", root)
+        batch_name = files[0].stem
+        for name in DERIVED_EXPORTS:
+            if name in rebuilt:
+                export_derived_table(con, name, root)
+            else:
+                append_derived_delta(con, name, f"{name}_delta", batch_name, root)
+        if previous_profile is not None and "state" in previous_profile:
+            append_profile(con, previous_profile, new_patients, root)
+        else:
+            write_profile(con, root)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        for temp in (
+            "delta", "affected_patients", "affected_days", "affected_day_rows", "batch_test_stats",
+            "old_pairs", "old_service_pairs", "new_pairs", "new_service_pairs",
+            *(f"{name}_delta" for name in DERIVED_EXPORTS),
+        ):
+            con.execute(f"DROP TABLE IF EXISTS temp.{temp}")
+    print("✅ Lot ajouté, tables dérivées mises à jour.")
+
+
+def _has_test_stats_state(con: duckdb.DuckDBPyConnection) -> bool:
+    return "value_counts" in [c[1] for c in con.execute("PRAGMA table_info(test_stats)").fetchall()]
+
+
+def _merge_counts(con: duckdb.DuckDBPyConnection, table: str, delta: str, keys: List[str], value: str):
+    """Ajoute des comptes signés à `table` sur place : clés existantes mises à jour, nouvelles insérées, zéros supprimés."""
+    match = " AND ".join(f"t.{k} IS NOT DISTINCT FROM d.{k}" for k in keys)
+    con.execute(f"""
+        UPDATE {table} AS t SET {value} = t.{value} + d.{value}
+        FROM {delta} AS d
+        WHERE {match}
+    """)
+    con.execute(f"""
+        INSERT INTO {table} BY NAME
+        SELECT d.* FROM {delta} AS d
+        ANTI JOIN {table} AS t ON {match}
+        WHERE d.{value} > 0
+    """)
+    con.execute(f"DELETE FROM {table} WHERE {value} <= 0")
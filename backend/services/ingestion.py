@@ -0,0 +1,339 @@
+"""
+Ingestion en flux d'un CSV brut de bilans sanguins vers le Parquet typé de `results`.
+
+Le CSV est nettoyé bloc par bloc par `backend.services.cleaning` (vectorisé, sur un pool de
+processus) et chaque bloc est ajouté à un writer Parquet : la mémoire maximale dépend de la
+taille de bloc et du nombre de workers, pas de la taille du fichier.
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from backend.services.cleaning import CHUNK_BYTES, EXPECTED_COLS, RAW_ENCODING, RESULTS_SCHEMA, QualityReport, check_columns, iter_clean_tables, read_header
+from backend.utils.metrics import InstrumentedConnection
+
+# Clé de ligne stable ajoutée au tri par patient : position dans l'ordre (numorden, Date).
+# Sert de clé de pagination (keyset) ; elle change à chaque ingestion.
+ROW_ID_COL = "row_id"
+
+# Mêmes colonnes que clean_chunk, pour les fichiers écrits avant leur introduction.
+# Valeurs non finies -> NULL : les anciens fichiers stockent un textores manquant en 'nan'
+TEXTORES_CAST_SQL = "TRY_CAST(textores AS DOUBLE)"
+TEXTORES_NUM_SQL = f"CASE WHEN isfinite({TEXTORES_CAST_SQL}) THEN {TEXTORES_CAST_SQL} END"
+TEXTORES_TEXT_SQL = f"CASE WHEN {TEXTORES_NUM_SQL} IS NULL THEN textores END"
+
+# Ancien format : Date stockée en texte, format variable selon la source
+LEGACY_DATE_EXPR = "COALESCE(try_strptime(Date, '%d/%m/%Y'), try_strptime(Date, '%Y-%m-%d'), try_strptime(Date, '%d-%m-%Y'))"
+
+# Taille des row groups des fichiers triés par patient : assez petite pour qu'une
+# recherche par numorden ne lise qu'un ou deux row groups grâce aux statistiques min/max
+PATIENT_ROW_GROUP_ROWS = 65_536
+
+
+def _is_text(dtype: pa.DataType) -> bool:
+    # large_string : écrit par pandas >= 3 / pyarrow récents pour les colonnes texte
+    return pa.types.is_string(dtype) or pa.types.is_large_string(dtype)
+
+
+# Suivi d'avancement : appelé avec (étape, lignes brutes lues jusqu'ici)
+Progress = Callable[[str, int], None]
+
+
+def _no_progress(stage: str, rows: int):
+    pass
+
+
+@dataclass
+class IngestResult:
+    rows_read: int
+    rows_written: int
+    path: Path
+    quality: Optional[QualityReport] = None
+
+
+def migrate_legacy_dates(parquet_path: Path) -> bool:
+    """
+    Migration one-shot d'un Parquet (results, panels) produit avant le typage des dates :
+    Date texte -> DATE, ajout de year_month et day. Retourne True si le fichier a été réécrit.
+    """
+    if not parquet_path.exists():
+        return False
+    if not _is_text(pq.read_schema(parquet_path).field("Date").type):
+        return False
+
+    tmp_path = parquet_path.with_suffix(".parquet.tmp")
+    con = InstrumentedConnection(duckdb.connect(":memory:"))
+    try:
+        con.execute(f"""
+            COPY (
+                SELECT * REPLACE (CAST({LEGACY_DATE_EXPR} AS DATE) AS Date),
+                    strftime({LEGACY_DATE_EXPR}, '%Y-%m') AS year_month,
+                    CAST(strftime({LEGACY_DATE_EXPR}, '%Y%m%d') AS INTEGER) AS day
+                FROM read_parquet('{parquet_path.as_posix()}')
+            ) TO '{tmp_path.as_posix()}' (FORMAT 'parquet')
+        """)
+    finally:
+        con.close()
+    os.replace(tmp_path, parquet_path)
+    return True
+
+
+def migrate_typed_results(parquet_path: Path) -> bool:
+    """
+    Migration one-shot d'un Parquet results écrit avant textores_num / textores_text : ajoute les deux
+    colonnes après textores, sans changer l'ordre des lignes ni la taille des row groups.
+    Recalcule aussi ces colonnes si textores_num contient des valeurs non finies (NaN / inf,
+    écrites avant que 'nan' et 'inf' ne soient écartés). Retourne True si le fichier a été réécrit.
+    """
+    if not parquet_path.exists():
+        return False
+    names = pq.read_schema(parquet_path).names
+    if "textores" not in names:
+        return False
+
+    con = InstrumentedConnection(duckdb.connect(":memory:"))
+    try:
+        if "textores_num" in names:
+            non_finite = con.execute(f"""
+                SELECT COUNT(*) FROM read_parquet('{parquet_path.as_posix()}') WHERE NOT isfinite(textores_num)
+            """).fetchone()[0]
+            if not non_finite:
+                return False
+
+        select = []
+        for name in names:
+            if name in ("textores_num", "textores_text"):
+                continue
+            select.append(f'"{name}"')
+            if name == "textores":
+                select += [f"{TEXTORES_NUM_SQL} AS textores_num", f"{TEXTORES_TEXT_SQL} AS textores_text"]
+        tmp_path = parquet_path.with_suffix(".parquet.tmp")
+        con.execute(f"""
+            COPY (SELECT {", ".join(select)} FROM read_parquet('{parquet_path.as_posix()}'))
+            TO '{tmp_path.as_posix()}' (FORMAT 'parquet', ROW_GROUP_SIZE {PATIENT_ROW_GROUP_ROWS})
+        """)
+    finally:
+        con.close()
+    os.replace(tmp_path, parquet_path)
+    return True
+
+
+def cluster_by_patient(src: Path, dst: Path, order_by: Sequence[str] = ("numorden", "Date"), row_id: bool = False):
+    """
+    Réécrit un Parquet trié par clé patient canonique (numorden en texte), en row groups
+    de PATIENT_ROW_GROUP_ROWS lignes. Le tri DuckDB déborde sur disque si besoin.
+    row_id=True numérote les lignes (ROW_ID_COL) dans l'ordre du tri.
+    """
+    order = ", ".join(order_by)
+    select = "* REPLACE (CAST(numorden AS VARCHAR) AS numorden)"
+    if row_id:
+        if ROW_ID_COL in pq.read_schema(src).names:
+            select = f"* EXCLUDE ({ROW_ID_COL}) REPLACE (CAST(numorden AS VARCHAR) AS numorden)"
+        select += f", CAST(row_number() OVER (ORDER BY {order}) - 1 AS BIGINT) AS {ROW_ID_COL}"
+        order = ROW_ID_COL
+
+    con = InstrumentedConnection(duckdb.connect(":memory:"))
+    try:
+        con.execute(f"""
+            COPY (
+                SELECT {select}
+                FROM read_parquet('{src.as_posix()}')
+                ORDER BY {order}
+            ) TO '{dst.as_posix()}' (FORMAT 'parquet', ROW_GROUP_SIZE {PATIENT_ROW_GROUP_ROWS})
+        """)
+    finally:
+        con.close()
+
+
+def is_patient_clustered(parquet_path: Path) -> bool:
+    """Vérifie sur le footer seul que numorden est texte et que ses row groups ne se chevauchent pas."""
+    pf = pq.ParquetFile(parquet_path)
+    if not _is_text(pf.schema_arrow.field("numorden").type):
+        return False
+
+    previous_max = None
+    metadata = pf.metadata
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        column = next(row_group.column(j) for j in range(row_group.num_columns) if row_group.column(j).path_in_schema == "numorden")
+        stats = column.statistics
+        if stats is None or not stats.has_min_max:
+            return False
+        if previous_max is not None and stats.min < previous_max:
+            return False
+        previous_max = stats.max
+    return True
+
+
+def migrate_patient_layout(parquet_path: Path, order_by: Sequence[str] = ("numorden", "Date"), row_id: bool = False) -> bool:
+    """Migration one-shot vers le layout trié par patient (et numéroté). Retourne True si le fichier a été réécrit."""
+    if not parquet_path.exists():
+        return False
+    if is_patient_clustered(parquet_path) and (not row_id or ROW_ID_COL in pq.read_schema(parquet_path).names):
+        return False
+
+    tmp_path = parquet_path.with_suffix(".parquet.tmp")
+    cluster_by_patient(parquet_path, tmp_path, order_by, row_id=row_id)
+    os.replace(tmp_path, parquet_path)
+    return True
+
+
+def _write_cleaned(csv_path: Path, dst: Path, chunk_bytes: int, encoding: str, progress: Progress) -> QualityReport:
+    """Nettoie le CSV bloc par bloc vers un Parquet typé non trié. Retourne le rapport de qualité."""
+    report = QualityReport(extra_columns=[c for c in read_header(csv_path, encoding) if c not in EXPECTED_COLS])
+    progress("cleaning", 0)
+    writer = pq.ParquetWriter(dst, RESULTS_SCHEMA, compression="snappy")
+    try:
+        for table, chunk_report in iter_clean_tables(csv_path, chunk_bytes, encoding):
+            report.merge(chunk_report)
+            if table is not None:
+                writer.write_table(table)
+            progress("cleaning", report.rows_read)
+    finally:
+        writer.close()
+    return report
+
+
+def ingest_csv(
+    csv_path: Path,
+    parquet_path: Path,
+    chunk_bytes: int = CHUNK_BYTES,
+    encoding: str = RAW_ENCODING,
+    progress: Progress = _no_progress,
+) -> IngestResult:
+    """
+    Nettoie le CSV bloc par bloc et écrit directement le Parquet typé, puis le trie par patient.
+    Le fichier est écrit à côté puis renommé : un Parquet existant n'est jamais vu à moitié écrit.
+    """
+    check_columns(csv_path, encoding)
+
+    unsorted_path = parquet_path.with_suffix(".unsorted.parquet")
+    tmp_path = parquet_path.with_suffix(".parquet.tmp")
+    try:
+        quality = _write_cleaned(csv_path, unsorted_path, chunk_bytes, encoding, progress)
+
+        # Layout groupé par patient : les lectures par numorden ne touchent qu'un ou deux row groups
+        progress("clustering", quality.rows_read)
+        cluster_by_patient(unsorted_path, tmp_path, row_id=True)
+        os.replace(tmp_path, parquet_path)
+    finally:
+        for path in (unsorted_path, tmp_path):
+            if path.exists():
+                path.unlink()
+
+    return IngestResult(rows_read=quality.rows_read, rows_written=quality.rows_kept, path=parquet_path, quality=quality)
+
+
+def append_csv(
+    csv_path: Path,
+    append_dir: Path,
+    first_row_id: int,
+    chunk_bytes: int = CHUNK_BYTES,
+    encoding: str = RAW_ENCODING,
+    progress: Progress = _no_progress,
+) -> Tuple[IngestResult, List[Path]]:
+    """
+    Ingestion d'un lot à ajouter : mêmes règles de nettoyage, puis un Parquet par mois
+    (append_dir/<YYYY-MM>/<lot>.parquet), trié par patient, avec des row_id à partir de first_row_id.
+    Seul le lot est lu et écrit : le coût ne dépend pas de l'historique.
+    Les fichiers ne sont visibles qu'une fois ajoutés au manifeste par l'appelant.
+    """
+    check_columns(csv_path, encoding)
+
+    batch = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    append_dir.mkdir(parents=True, exist_ok=True)
+    staging_path = append_dir / f"{batch}.staging.parquet"
+    written: List[Path] = []
+    try:
+        quality = _write_cleaned(csv_path, staging_path, chunk_bytes, encoding, progress)
+
+        progress("partitioning", quality.rows_read)
+        con = InstrumentedConnection(duckdb.connect(":memory:"))
+        try:
+            con.execute(f"""
+                CREATE TABLE batch AS
+                SELECT *, CAST(row_number() OVER (ORDER BY numorden, Date) - 1 + {int(first_row_id)} AS BIGINT) AS {ROW_ID_COL}
+                FROM read_parquet('{staging_path.as_posix()}')
+            """)
+            months = [r[0] for r in con.execute("SELECT DISTINCT year_month FROM batch ORDER BY 1").fetchall()]
+            for month in months:
+                month_dir = append_dir / (month or "no-date")
+                month_dir.mkdir(exist_ok=True)
+                path = month_dir / f"{batch}.parquet"
+                where = "year_month = ?" if month else "year_month IS NULL"
+                params = [month] if month else []
+                con.execute(f"""
+                    COPY (SELECT * FROM batch WHERE {where} ORDER BY {ROW_ID_COL})
+                    TO '{path.as_posix()}' (FORMAT 'parquet', ROW_GROUP_SIZE {PATIENT_ROW_GROUP_ROWS})
+                """, params)
+                written.append(path)
+        finally:
+            con.close()
+    except Exception:
+        for path in written:
+            path.unlink(missing_ok=True)
+        raise
+    finally:
+        staging_path.unlink(missing_ok=True)
+
+    return IngestResult(rows_read=quality.rows_read, rows_written=quality.rows_kept, path=append_dir, quality=quality), written
+
+
+def next_row_id(files: Sequence[Path]) -> int:
+    """
+    Premier row_id libre après les fichiers `files` (results et ses ajouts).
+    Lu dans les statistiques min/max des row groups : aucune donnée lue, sauf fichier sans statistiques.
+    """
+    last = -1
+    for path in files:
+        meta = pq.ParquetFile(path).metadata
+        names = meta.schema.to_arrow_schema().names
+        if ROW_ID_COL not in names:
+            continue
+        col = names.index(ROW_ID_COL)
+        stats = [meta.row_group(i).column(col).statistics for i in range(meta.num_row_groups)]
+        if all(s is not None and s.has_min_max for s in stats):
+            last = max([last, *(s.max for s in stats)])
+        else:
+            con = duckdb.connect(":memory:")
+            try:
+                found = con.execute(f"SELECT MAX({ROW_ID_COL}) FROM read_parquet('{path.as_posix()}')").fetchone()[0]
+            finally:
+                con.close()
+            if found is not None:
+                last = max(last, found)
+    return last + 1
+
+
+def rebase_append(files: Sequence[Path], src_dir: Path, dst_dir: Path, first_row_id: int) -> List[Path]:
+    """
+    Recopie un lot écrit par append_csv de `src_dir` vers `dst_dir` en décalant ses row_id pour
+    qu'ils commencent à first_row_id. Pour un lot nettoyé pendant qu'une autre ingestion publiait.
+    """
+    con = InstrumentedConnection(duckdb.connect(":memory:"))
+    written: List[Path] = []
+    try:
+        sources = ", ".join(f"'{f.as_posix()}'" for f in files)
+        shift = int(first_row_id) - con.execute(f"SELECT MIN({ROW_ID_COL}) FROM read_parquet([{sources}])").fetchone()[0]
+        for path in files:
+            dst = dst_dir / path.relative_to(src_dir)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            con.execute(f"""
+                COPY (SELECT * REPLACE ({ROW_ID_COL} + {shift} AS {ROW_ID_COL}) FROM read_parquet('{path.as_posix()}') ORDER BY {ROW_ID_COL})
+                TO '{dst.as_posix()}' (FORMAT 'parquet', ROW_GROUP_SIZE {PATIENT_ROW_GROUP_ROWS})
+            """)
+            written.append(dst)
+    except Exception:
+        for path in written:
+            path.unlink(missing_ok=True)
+        raise
+    finally:
+        con.close()
+    return written
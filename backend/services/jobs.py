@@ -0,0 +1,101 @@
+"""
+Jobs d'ingestion en arrière-plan.
+
+L'upload HTTP se contente d'écrire le CSV sur disque et de soumettre un job ;
+le nettoyage, le tri, le chargement et les tables dérivées tournent dans un pool
+de threads dédié. Les endpoints de lecture ne sont pas bloqués : ils utilisent les
+curseurs du pool DuckDB et voient l'ancienne version des tables jusqu'au commit.
+
+Avec INGEST_WORKERS=1 (défaut), les jobs s'exécutent dans l'ordre de soumission.
+Au-delà, les nettoyages tournent en parallèle et les publications (sous le verrou
+d'écriture) se font dans l'ordre où les jobs terminent.
+"""
+
+import os
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+# Jobs terminés conservés pour /loader/jobs
+JOB_HISTORY = 100
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str  # upload | append | activate
+    filename: str
+    status: str = QUEUED
+    stage: str = QUEUED
+    rows_processed: int = 0
+    rows_written: Optional[int] = None
+    # Rapport de qualité du CSV (cleaning.QualityReport.to_dict), une fois le nettoyage terminé
+    quality: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    def progress(self, stage: str, rows: int):
+        """Callback d'avancement passé à l'ingestion (voir ingestion.Progress)."""
+        self.stage = stage
+        self.rows_processed = rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class JobManager:
+    def __init__(self, workers: int = INGEST_WORKERS, history: int = JOB_HISTORY):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._history = history
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, filename: str, run: Callable[[Job], Optional[int]]) -> Job:
+        """
+        Met le job en file. `run(job)` fait le travail, met à jour job.stage / rows_processed
+        et retourne le nombre de lignes écrites.
+        """
+        job = Job(id=uuid.uuid4().hex[:12], kind=kind, filename=filename)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job: Job, run: Callable[[Job], Optional[int]]):
+        job.status, job.stage, job.started_at = RUNNING, "starting", datetime.now()
+        try:
+            job.rows_written = run(job)
+            job.status, job.stage = DONE, DONE
+        except Exception as e:
+            traceback.print_exc()
+            job.status, job.error = FAILED, str(e)
+            print(f"❌ Job {job.id} ({job.kind}) en échec à l'étape {job.stage} : {e}")
+        finally:
+            job.finished_at = datetime.now()
+
+    def _prune(self):
+        finished = [j.id for j in self._jobs.values() if j.status in (DONE, FAILED)]
+        for job_id in finished[: max(0, len(finished) - self._history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+
+jobs = JobManager()
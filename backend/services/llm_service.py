@@ -1,17 +1,69 @@
 import pandas as pd
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, List
+import asyncio
+import json
 import os
+import threading
+import time
+import duckdb
 import numpy as np
 import math
-from openai import OpenAI
+from openai import AsyncOpenAI
 import re 
 
-# Initialize OpenAI client with Groq endpoint
-client = OpenAI(
-    base_url="https://api.groq.com/openai/v1",
-    api_key=os.getenv("GROQ_API_KEY")
+from backend.database import dataset_version, sandbox_cursor
+from backend.utils.cache import prompt_cache
+from backend.utils.metrics import LLM_LATENCY
+
+# OpenAI-compatible endpoint: Groq by default, any compatible server (e.g. scripts/stub_llm_server.py) via LLM_BASE_URL
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+# Initialize async OpenAI client
+client = AsyncOpenAI(
+    base_url=LLM_BASE_URL,
+    api_key=os.getenv("LLM_API_KEY") or os.getenv("GROQ_API_KEY"),
+    timeout=LLM_TIMEOUT_SECONDS,
 )
 
+# Caps the number of in-flight calls to the LLM provider across all requests
+_llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+# Bump when the system prompts change: cached code generated by older prompts is then ignored
+PROMPT_VERSION = "2"
+
+_context_lock = threading.Lock()
+_context_cache: Dict[str, tuple] = {}
+
+def get_cached_context(kind: str, builder) -> str:
+    """
+    Returns the context string for `kind` ('pandas' or 'sql'), built once per dataset version.
+    """
+    version = dataset_version()
+    with _context_lock:
+        cached = _context_cache.get(kind)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    context = builder()
+    with _context_lock:
+        _context_cache[kind] = (version, context)
+    return context
+
+async def _complete(messages: List[dict], temperature: float) -> str:
+    start, outcome = time.perf_counter(), "error"
+    try:
+        async with _llm_slots:
+            response = await client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                temperature=temperature
+            )
+        outcome = "ok"
+    finally:
+        LLM_LATENCY.observe(time.perf_counter() - start, kind="completion", outcome=outcome)
+    return response.choices[0].message.content.strip()
+
 def get_dataframe_context(df: pd.DataFrame) -> str:
     """
     Extracts metadata to help the LLM understand the data content.
@@ -28,7 +80,7 @@ def get_dataframe_context(df: pd.DataFrame) -> str:
     except:
         return ""
 
-def get_llm_code(prompt: str, context: str = "") -> str:
+async def get_llm_code(prompt: str, context: str = "") -> str:
     """
     Asks the LLM to convert a natural language query into a pandas command.
     """
@@ -41,8 +93,11 @@ def get_llm_code(prompt: str, context: str = "") -> str:
     - `edad` (Age, numeric)
     - `nombre` (Test name, e.g., 'GLUCOSA')
     - `nombre2` (Service/Department)
-    - `textores` (Result value, mixed type: numeric or text, may contain non-numeric values like 'TRACE')
-    - `Date` (Date string dd/mm/yyyy)
+    - `textores_num` (Numeric result value, float; NaN when the result is qualitative)
+    - `textores_text` (Qualitative result value like 'TRACE' or 'NEGATIVO'; NaN when the result is numeric)
+    - `Date` (Sampling date, datetime64)
+    - `year_month` (Month key 'YYYY-MM', e.g. '2024-03')
+    - `day` (Integer date key YYYYMMDD)
 
     {context}
 
@@ -53,10 +108,8 @@ def get_llm_code(prompt: str, context: str = "") -> str:
     2. The code must be an expression that evaluates to the result (e.g., `df['edad'].mean()`).
     3. DO NOT assign variables or use print(). Just the expression.
     4. **IMPORTANT**: When filtering text columns (nombre, nombre2), ALWAYS use `.str.contains('term', case=False, na=False)` instead of `==` to be robust.
-    5. Handle `textores` carefully - it contains mixed types:
-       - ALWAYS use `pd.to_numeric(df['textores'], errors='coerce')` when doing math operations.
-       - This safely converts non-numeric values to NaN instead of crashing.
-       - Example: `pd.to_numeric(df['textores'], errors='coerce').mean()` to calculate average.
+    5. Results are already typed: use `textores_num` for math operations (e.g. `df['textores_num'].mean()`),
+       `textores_text` for qualitative results. No conversion is needed.
     6. If asking for a list of patients, return `df[...]`.
     7. If the user sends a question that cannot be answered with the data, tell the user "Sorry, I can't answer that with the available data.".
     8. LANGUAGE MATCHING IS MANDATORY:
@@ -71,16 +124,10 @@ def get_llm_code(prompt: str, context: str = "") -> str:
     11. CRITICAL: Always ensure the code is safe and will not crash due to type errors. Use errors='coerce' for conversions.
     """
 
-    response = client.chat.completions.create(
-        model="llama-3.3-70b-versatile", 
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0
-    )
-    
-    code = response.choices[0].message.content.strip()
+    code = await _complete([
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ], temperature=0)
     
     # Cleanup if LLM returns markdown code blocks despite instructions
     if code.startswith("```"):
@@ -88,10 +135,214 @@ def get_llm_code(prompt: str, context: str = "") -> str:
         
     return code
 
-def get_llm_explanation(prompt: str, code: str, result: Any) -> str:
+# === SQL MODE ===
+
+# Tables the generated SQL may read, and limits applied to every execution
+SQL_TABLES = ["results", "panels", "repeats"]
+SQL_ROW_LIMIT = 1000
+SQL_TIMEOUT_SECONDS = 10.0
+
+# Scalar functions exposing the engine configuration or environment
+SQL_FORBIDDEN_FUNCTIONS = {"current_setting", "getenv"}
+
+def get_sql_context(con: duckdb.DuckDBPyConnection) -> str:
     """
-    Asks the LLM to explain the result in natural language.
+    Describes the queryable tables and a few frequent values, read from DuckDB.
+    """
+    lines = []
+    try:
+        for table in SQL_TABLES:
+            columns = con.execute(f"DESCRIBE {table}").fetchall()
+            lines.append(f"- `{table}`(" + ", ".join(f"{c[0]} {c[1]}" for c in columns) + ")")
+        services = [r[0] for r in con.execute("SELECT nombre2 FROM results GROUP BY nombre2 ORDER BY COUNT(*) DESC LIMIT 50").fetchall()]
+        tests = [r[0] for r in con.execute("SELECT nombre FROM results GROUP BY nombre ORDER BY COUNT(*) DESC LIMIT 50").fetchall()]
+    except duckdb.Error:
+        return ""
+
+    return "\n".join([
+        "    Tables:",
+        *[f"    {line}" for line in lines],
+        "",
+        "    Context Info:",
+        f"    - Unique Services (nombre2) examples: {services}",
+        f"    - Unique Tests (nombre) examples: {tests}",
+    ])
+
+async def get_llm_sql(prompt: str, context: str = "") -> str:
+    """
+    Asks the LLM to convert a natural language query into a single DuckDB SELECT.
+    """
+    system_prompt = f"""
+    You are an expert Data Analyst. You query a DuckDB database of blood test results.
+
+    {context}
+
+    Column meanings:
+    - `results`: one row per test. `numorden` (request ID), `sexo` ('M', 'F'), `edad` (age), `nombre` (test name),
+      `nombre2` (service/department), `textores` (result value as text), `textores_num` (numeric result, DOUBLE,
+      NULL when qualitative), `textores_text` (qualitative result like 'TRACE', NULL when numeric),
+      `Date` (DATE), `year_month` ('YYYY-MM'), `day` (integer YYYYMMDD).
+    - `panels`: one row per patient-day with `n_tests` and `tests_list` (list of test names).
+    - `repeats`: one row per patient and test taken more than once, with `repeat_count`, `days_span`, `first_date_obj`, `last_date_obj`.
+
+    Your task: Convert the user's question into a SINGLE DuckDB SQL SELECT statement that returns the answer.
+
+    Rules:
+    1. RETURN ONLY THE SQL. No markdown, no backticks, no explanations.
+    2. Only one statement, starting with SELECT or WITH. Never modify data.
+    3. Only read from the tables `results`, `panels` and `repeats`. No table functions (read_parquet, read_csv, ...).
+    4. **IMPORTANT**: When filtering text columns (nombre, nombre2), ALWAYS use `ILIKE '%term%'` instead of `=` to be robust.
+    5. Use `textores_num` for math operations on results (no cast needed) and `textores_text` for qualitative values.
+    6. Filter on `Date`, `year_month` or `day` directly, e.g. `Date BETWEEN DATE '2024-01-01' AND DATE '2024-03-31'`.
+    7. If the user sends a question that cannot be answered with the data, tell the user "Sorry, I can't answer that with the available data.".
+    8. LANGUAGE MATCHING IS MANDATORY:
+       - If the user asks in English, you MUST respond in English.
+       - If the user asks in French, you MUST respond in French.
+    9. Greetings, questions about your role and thanks must be answered with text, NOT SQL, in the user's language.
+    """
+
+    sql = await _complete([
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ], temperature=0)
+
+    # Cleanup if LLM returns markdown code blocks despite instructions
+    if sql.startswith("```"):
+        sql = re.sub(r"^```(sql)?|```$", "", sql).strip()
+
+    return sql.rstrip(";").strip()
+
+def _collect_nodes(node: Any, kind: str, out: List[dict]):
+    """Collects every AST dict whose `type` is `kind`."""
+    if isinstance(node, dict):
+        if node.get("type") == kind:
+            out.append(node)
+        for value in node.values():
+            _collect_nodes(value, kind, out)
+    elif isinstance(node, list):
+        for value in node:
+            _collect_nodes(value, kind, out)
+
+def _check_tables(node: Any, ctes: frozenset = frozenset()):
+    """
+    Checks every table reference against SQL_TABLES and the CTEs visible at that point:
+    a CTE is only visible inside the query that defines it, never in an enclosing one.
+    """
+    if isinstance(node, dict):
+        cte_map = node.get("cte_map")
+        if isinstance(cte_map, dict) and cte_map.get("map"):
+            ctes = ctes | {entry["key"].lower() for entry in cte_map["map"]}
+        if node.get("type") == "BASE_TABLE":
+            name = node["table_name"].lower()
+            if node.get("catalog_name") or node.get("schema_name") not in ("", "main"):
+                raise ValueError(f"Table not allowed: {node['schema_name']}.{name}")
+            if name not in SQL_TABLES and name not in ctes:
+                raise ValueError(f"Table not allowed: {name}")
+        for value in node.values():
+            _check_tables(value, ctes)
+    elif isinstance(node, list):
+        for value in node:
+            _check_tables(value, ctes)
+
+def validate_sql(sql: str, con: duckdb.DuckDBPyConnection):
+    """
+    Checks the generated SQL against the DuckDB parser rather than with string matching:
+    exactly one SELECT statement, only allowlisted tables (or CTEs in scope),
+    no table functions and no configuration/environment functions.
+    """
+    try:
+        statements = con.extract_statements(sql)
+    except duckdb.Error as e:
+        raise ValueError(f"Invalid SQL: {e}")
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        raise ValueError("Only a single SELECT statement is allowed.")
+
+    tree = json.loads(con.execute("SELECT json_serialize_sql(CAST(? AS VARCHAR))", [sql]).fetchone()[0])
+    if tree.get("error"):
+        raise ValueError(f"Invalid SQL: {tree.get('error_message')}")
+
+    _check_tables(tree)
+
+    table_functions: List[dict] = []
+    _collect_nodes(tree, "TABLE_FUNCTION", table_functions)
+    if table_functions:
+        raise ValueError("Table functions are not allowed.")
+
+    functions: List[dict] = []
+    _collect_nodes(tree, "FUNCTION", functions)
+    for function in functions:
+        if function["function_name"].lower() in SQL_FORBIDDEN_FUNCTIONS:
+            raise ValueError(f"Function not allowed: {function['function_name']}")
+
+def safe_execute_sql(sql: str) -> List[dict]:
     """
+    Validates then runs the SQL with a row limit; the query is interrupted after SQL_TIMEOUT_SECONDS.
+    It runs on a separate in-memory database holding only views over SQL_TABLES (see sandbox_cursor),
+    never on the main database.
+    """
+    con = sandbox_cursor(SQL_TABLES)
+    timer = threading.Timer(SQL_TIMEOUT_SECONDS, con.interrupt)
+    try:
+        validate_sql(sql, con)
+        timer.start()
+        table = con.execute(f"SELECT * FROM ({sql}) AS llm_query LIMIT {SQL_ROW_LIMIT}").fetch_arrow_table()
+    except duckdb.InterruptException:
+        raise ValueError(f"Query timed out after {SQL_TIMEOUT_SECONDS:g}s.")
+    except duckdb.Error as e:
+        raise ValueError(f"Execution error: {str(e)}")
+    finally:
+        timer.cancel()
+        con.close()
+
+    return table.to_pylist()
+
+async def answer_sql_query(prompt: str, con: duckdb.DuckDBPyConnection) -> Dict[str, Any]:
+    """
+    SQL mode: generates and runs the query on DuckDB. `explanation` is None when the result
+    still has to be explained (see get_llm_explanation / stream_llm_explanation).
+    """
+    try:
+        cache_version = f"{LLM_MODEL}:{PROMPT_VERSION}"
+        sql = prompt_cache.get("sql", cache_version, prompt)
+        from_cache = sql is not None
+        if not from_cache:
+            context = await asyncio.to_thread(get_cached_context, "sql", lambda: get_sql_context(con))
+            sql = await get_llm_sql(prompt, context)
+
+        # Conversational response: the model answered with text instead of SQL
+        if not re.match(r"^(select|with)\b", sql, re.IGNORECASE):
+            if not from_cache:
+                prompt_cache.set("sql", cache_version, prompt, sql)
+            return {
+                "result": None,
+                "query_executed": None,
+                "explanation": sql
+            }
+
+        rows = await asyncio.to_thread(safe_execute_sql, sql)
+        # Only SQL that validated and ran is cached
+        if not from_cache:
+            prompt_cache.set("sql", cache_version, prompt, sql)
+
+        # A single value is returned as a scalar
+        result: Any = rows
+        if len(rows) == 1 and len(rows[0]) == 1:
+            result = next(iter(rows[0].values()))
+
+        return {
+            "result": result,
+            "query_executed": sql,
+            "explanation": None
+        }
+
+    except Exception as e:
+        return {
+            "result": None,
+            "query_executed": "Error",
+            "explanation": f"I couldn't process that query. Error: {str(e)}"
+        }
+
+def _explanation_messages(prompt: str, code: str, result: Any) -> List[dict]:
     # Truncate result for prompt if it's too long to avoid token limits
     result_preview = str(result)
     if len(result_preview) > 1000:
@@ -111,19 +362,42 @@ def get_llm_explanation(prompt: str, code: str, result: Any) -> str:
     - Do NOT use English if the user asked in French.
     """
     
-    response = client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[{"role": "user", "content": explanation_prompt}],
-        temperature=0.7
-    )
-    return response.choices[0].message.content.strip()
+    return [{"role": "user", "content": explanation_prompt}]
+
+async def get_llm_explanation(prompt: str, code: str, result: Any) -> str:
+    """
+    Asks the LLM to explain the result in natural language.
+    """
+    return await _complete(_explanation_messages(prompt, code, result), temperature=0.7)
+
+async def stream_llm_explanation(prompt: str, code: str, result: Any) -> AsyncIterator[str]:
+    """
+    Same as get_llm_explanation, yielding the explanation token by token as the LLM produces it.
+    """
+    start, outcome = time.perf_counter(), "error"
+    try:
+        async with _llm_slots:
+            stream = await client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=_explanation_messages(prompt, code, result),
+                temperature=0.7,
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        outcome = "ok"
+    finally:
+        # Time until the last token (or until the client disconnects)
+        LLM_LATENCY.observe(time.perf_counter() - start, kind="stream", outcome=outcome)
 
 def safe_execute_pandas(code: str, df: pd.DataFrame) -> Any:
     """
     Executes the code in a restricted local scope containing only `df` and `pd`.
     """
     # Safety check: prevent import or dangerous builtins
-    forbidden = ['import', 'exec', 'eval', 'open', '__import__']
+    # 'inplace' : le DataFrame est partagé entre les requêtes, il ne doit pas être modifié
+    forbidden = ['import', 'exec', 'eval', 'open', '__import__', 'inplace']
     if any(word in code for word in forbidden):
         raise ValueError("Unsafe code detected.")
 
@@ -166,16 +440,21 @@ def safe_execute_pandas(code: str, df: pd.DataFrame) -> Any:
     except Exception as e:
         raise ValueError(f"Execution error: {str(e)}")
 
-def process_natural_language_query(prompt: str, df: pd.DataFrame) -> Dict[str, Any]:
+async def answer_pandas_query(prompt: str, df: pd.DataFrame) -> Dict[str, Any]:
     """
-    Orchestrates the LLM query process.
+    Pandas mode: generates and evaluates the code. `explanation` is None when the result
+    still has to be explained (see get_llm_explanation / stream_llm_explanation).
     """
     try:
-        # 0. Build Context
-        context = get_dataframe_context(df)
+        # 0. Cached code for this question and dataset version, if any
+        cache_version = f"{LLM_MODEL}:{PROMPT_VERSION}"
+        code = prompt_cache.get("pandas", cache_version, prompt)
+        from_cache = code is not None
 
-        # 1. Get Code
-        code = get_llm_code(prompt, context)
+        if not from_cache:
+            # 1. Build Context (once per dataset version) and Get Code
+            context = await asyncio.to_thread(get_cached_context, "pandas", lambda: get_dataframe_context(df))
+            code = await get_llm_code(prompt, context)
         
         # --- HEURISTIC FOR CONVERSATIONAL RESPONSES ---
         # If the LLM returns a sentence instead of code (due to the new rules),
@@ -183,6 +462,8 @@ def process_natural_language_query(prompt: str, df: pd.DataFrame) -> Dict[str, A
         # Check if it's a conversational response (greeting, general question, etc.)
         if not ('df[' in code or 'pd.' in code or 'np.' in code):
             # Likely a conversational response
+            if not from_cache:
+                prompt_cache.set("pandas", cache_version, prompt, code)
             return {
                 "result": None,
                 "query_executed": None,
@@ -191,7 +472,10 @@ def process_natural_language_query(prompt: str, df: pd.DataFrame) -> Dict[str, A
         # ----------------------------------------------
 
         # 2. Execute Code
-        result = safe_execute_pandas(code, df)
+        result = await asyncio.to_thread(safe_execute_pandas, code, df)
+        # Only code that executed successfully is cached
+        if not from_cache:
+            prompt_cache.set("pandas", cache_version, prompt, code)
         
         # Handle non-serializable results (like numpy types or DataFrames)
         if isinstance(result, pd.DataFrame):
@@ -209,14 +493,11 @@ def process_natural_language_query(prompt: str, df: pd.DataFrame) -> Dict[str, A
                 result = result.item()
             except ValueError:
                 pass # Keep as is if it fails
-            
-        # 3. Get Explanation
-        explanation = get_llm_explanation(prompt, code, result)
-        
+
         return {
             "result": result,
             "query_executed": code,
-            "explanation": explanation
+            "explanation": None
         }
         
     except Exception as e:
@@ -235,4 +516,28 @@ def process_natural_language_query(prompt: str, df: pd.DataFrame) -> Dict[str, A
             "result": None,
             "query_executed": "Error",
             "explanation": friendly_msg
-        }
\ No newline at end of file
+        }
+
+async def explain_answer(prompt: str, answer: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Completes an answer from answer_pandas_query / answer_sql_query with its explanation.
+    """
+    if answer["explanation"] is not None:
+        return answer
+    try:
+        explanation = await get_llm_explanation(prompt, answer["query_executed"], answer["result"])
+    except Exception as e:
+        explanation = f"I couldn't explain that result. Error: {str(e)}"
+    return {**answer, "explanation": explanation}
+
+async def process_natural_language_query(prompt: str, df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Orchestrates the LLM query process.
+    """
+    return await explain_answer(prompt, await answer_pandas_query(prompt, df))
+
+async def process_natural_language_sql(prompt: str, con: duckdb.DuckDBPyConnection) -> Dict[str, Any]:
+    """
+    Orchestrates the LLM query process in SQL mode: the question is answered by DuckDB.
+    """
+    return await explain_answer(prompt, await answer_sql_query(prompt, con))
@@ -0,0 +1,48 @@
+"""
+Migrations one-shot des fichiers de données existants, exécutées au démarrage.
+Chaque migration est idempotente : elle ne réécrit un fichier que s'il est à l'ancien format.
+"""
+
+from pathlib import Path
+from typing import Optional
+
+from backend.database import RESULTS_PATH, PANELS_PATH, REPEATS_PATH, write_connection, load_tables, has_table, source_files
+from backend.services.derived import generate_derived_tables
+from backend.services.ingestion import migrate_legacy_dates, migrate_patient_layout, migrate_typed_results
+from backend.services.profile import read_profile, write_profile
+
+# Tables dérivées attendues : reconstruites si absentes (base créée avant leur introduction)
+DERIVED_TABLES = ["panels", "repeats", "pairs", "service_pairs", "test_stats"]
+
+
+def migrate_results_columns(root: Optional[Path] = None) -> bool:
+    """Ajoute textores_num / textores_text à results et à ses ajouts (version publiée ou `root`)."""
+    migrated = False
+    for path in source_files("results", root):
+        migrated |= migrate_typed_results(path)
+    return migrated
+
+
+def migrate_dataset():
+    # `|` et non `or` : chaque migration doit s'exécuter
+    results_migrated = migrate_legacy_dates(RESULTS_PATH) | migrate_patient_layout(RESULTS_PATH, ("numorden", "Date"), row_id=True)
+    panels_migrated = (
+        migrate_legacy_dates(PANELS_PATH)
+        | migrate_patient_layout(PANELS_PATH, ("numorden", "Date"))
+        | migrate_patient_layout(REPEATS_PATH, ("numorden", "nombre"))
+    )
+    typed_migrated = migrate_results_columns()
+    missing_derived = has_table("results") and not all(has_table(t) for t in DERIVED_TABLES)
+    if not (results_migrated or panels_migrated or typed_migrated or missing_derived):
+        if has_table("results") and read_profile() is None:
+            with write_connection() as con:
+                write_profile(con)
+        return
+
+    if results_migrated or panels_migrated or typed_migrated:
+        print("✅ Fichiers existants migrés (dates typées, tri par patient, row_id, textores typé).")
+    with write_connection() as con:
+        load_tables(con)
+        # textores_num (re)calculé : test_stats en dépend
+        if results_migrated or typed_migrated or missing_derived:
+            generate_derived_tables(con)
@@ -0,0 +1,156 @@
+"""
+Profil du jeu de données (sidecar JSON écrit à l'ingestion) : volumes, période,
+âges et valeurs manquantes. /stats/summary le sert sans rescanner `results`.
+"""
+
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+import duckdb
+
+from backend.database import PROFILE_PATH, dataset_version, in_version
+from backend.services.cleaning import EXPECTED_COLS
+
+_profile_cache: tuple = (None, None)
+
+# État fusionnable du profil : somme et somme des carrés des âges (moyenne et écart-type d'une union),
+# services distincts (peu nombreux, contrairement aux patients)
+STATE_SQL = """,
+    COUNT(edad),
+    SUM(CAST(edad AS DOUBLE)),
+    SUM(CAST(edad AS DOUBLE) * edad),
+    list(DISTINCT nombre2) FILTER (WHERE nombre2 IS NOT NULL)
+"""
+
+
+def compute_profile(
+    con: duckdb.DuckDBPyConnection,
+    source: str = "results",
+    where_clause: str = "",
+    params: Sequence[Any] = (),
+    approx: bool = False,
+    state: bool = False,
+) -> Dict[str, Any]:
+    """
+    Calcule le profil en un seul scan, éventuellement sur un sous-ensemble (where_clause).
+    approx=True utilise approx_count_distinct (HyperLogLog) pour les comptes distincts.
+    state=True ajoute l'état fusionnable du profil (sommes des âges, liste des services), voir append_profile.
+    """
+    distinct = "approx_count_distinct({})" if approx else "COUNT(DISTINCT {})"
+    # `source` peut être une sous-requête aliasée (ex: cohorte)
+    columns = [c[0] for c in con.execute(f"SELECT * FROM {source} LIMIT 0").description]
+    missing_cols = [c for c in EXPECTED_COLS if c in columns]
+    where = f"WHERE {where_clause}" if where_clause else ""
+
+    row = con.execute(f"""
+        SELECT
+            COUNT(*) AS total_rows,
+            {distinct.format("numorden")} AS total_patients,
+            {distinct.format("nombre")} AS total_tests,
+            {distinct.format("nombre2")} AS total_services,
+            MIN(Date) AS min_date,
+            MAX(Date) AS max_date,
+            AVG(edad) AS avg_age,
+            MIN(edad) AS min_age,
+            MAX(edad) AS max_age,
+            STDDEV(edad) AS std_age,
+            {", ".join(f'COUNT(*) - COUNT("{c}")' for c in missing_cols)}
+            {STATE_SQL if state else ""}
+        FROM {source}
+        {where}
+    """, list(params)).fetchone()
+
+    profile = {
+        "total_rows": row[0],
+        "total_patients": row[1],
+        "total_tests": row[2],
+        "total_services": row[3],
+        "date_min": row[4].isoformat() if row[4] else None,
+        "date_max": row[5].isoformat() if row[5] else None,
+        "age": {"avg": row[6], "min": row[7], "max": row[8], "std": row[9]},
+        "missing": dict(zip(missing_cols, row[10:])),
+        "approximate": approx,
+    }
+    if state:
+        age_n, age_sum, age_sumsq, services = row[10 + len(missing_cols):]
+        profile["state"] = {"age_n": age_n, "age_sum": age_sum or 0.0, "age_sumsq": age_sumsq or 0.0, "services": sorted(services or [])}
+    return profile
+
+
+def write_profile(con: duckdb.DuckDBPyConnection, root: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Calcule le profil exact de `results` et l'écrit à côté des Parquet de la version `root`
+    (par défaut la version publiée), de façon atomique.
+    """
+    return _save_profile(compute_profile(con, state=True), root)
+
+
+def append_profile(con: duckdb.DuckDBPyConnection, previous: Dict[str, Any], new_patients: int, root: Path) -> Dict[str, Any]:
+    """
+    Profil après ajout d'un lot (table temporaire `delta`), sans rescanner `results` : fusion du profil
+    `previous` (avec son état) et de celui du lot. Comptes, sommes et bornes s'additionnent ou se combinent ;
+    patients nouveaux comptés par l'appelant, tests distincts relus dans test_stats (déjà mise à jour).
+    """
+    delta = compute_profile(con, "delta", state=True)
+    old, new = previous["state"], delta["state"]
+    n = old["age_n"] + new["age_n"]
+    total = old["age_sum"] + new["age_sum"]
+    sumsq = old["age_sumsq"] + new["age_sumsq"]
+    services = sorted(set(old["services"]) | set(new["services"]))
+    total_tests = con.execute("SELECT COUNT(DISTINCT name) FROM (SELECT unnest(names) AS name FROM test_stats)").fetchone()[0]
+
+    def bound(fn, *values):
+        values = [v for v in values if v is not None]
+        return fn(values) if values else None
+
+    profile = {
+        "total_rows": previous["total_rows"] + delta["total_rows"],
+        "total_patients": previous["total_patients"] + new_patients,
+        "total_tests": total_tests,
+        "total_services": len(services),
+        # dates ISO : l'ordre des chaînes est celui des dates
+        "date_min": bound(min, previous["date_min"], delta["date_min"]),
+        "date_max": bound(max, previous["date_max"], delta["date_max"]),
+        "age": {
+            "avg": total / n if n else None,
+            "min": bound(min, previous["age"]["min"], delta["age"]["min"]),
+            "max": bound(max, previous["age"]["max"], delta["age"]["max"]),
+            "std": math.sqrt(max(0.0, (sumsq - total * total / n) / (n - 1))) if n > 1 else None,
+        },
+        "missing": {c: previous["missing"].get(c, 0) + count for c, count in delta["missing"].items()},
+        "approximate": False,
+        "state": {"age_n": n, "age_sum": total, "age_sumsq": sumsq, "services": services},
+    }
+    return _save_profile(profile, root)
+
+
+def _save_profile(profile: Dict[str, Any], root: Optional[Path] = None) -> Dict[str, Any]:
+    global _profile_cache
+    profile["dataset_version"] = dataset_version(root)
+
+    profile_path = in_version(PROFILE_PATH, root)
+    tmp_path = profile_path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(profile, indent=2), encoding="utf-8")
+    os.replace(tmp_path, profile_path)
+    _profile_cache = (None, None)
+    return profile
+
+
+def read_profile() -> Optional[Dict[str, Any]]:
+    """
+    Profil courant, gardé en mémoire tant que le fichier ne change pas.
+    None si absent ou périmé (dataset modifié depuis son écriture).
+    """
+    global _profile_cache
+    if not PROFILE_PATH.exists():
+        return None
+    mtime = PROFILE_PATH.stat().st_mtime_ns
+    if _profile_cache[0] != mtime:
+        _profile_cache = (mtime, json.loads(PROFILE_PATH.read_text(encoding="utf-8")))
+    profile = _profile_cache[1]
+    if profile.get("dataset_version") != dataset_version():
+        return None
+    return profile
@@ -0,0 +1,154 @@
+"""
+Index d'autocomplétion en mémoire sur les valeurs distinctes de `nombre` (tests) et `nombre2` (services).
+
+- Normalisation : casse, accents et espaces ignorés ('Protéines  totales' -> 'proteines totales') ;
+  les graphies de même forme normalisée sont fusionnées (affichage : la plus fréquente).
+- Recherche : préfixe du nom, puis préfixe d'un mot du nom (tableau trié des suffixes de mots,
+  bisect), puis trigrammes pour les sous-chaînes et fautes légères. Chaque niveau est classé par fréquence.
+- Construit depuis DuckDB en un scan, reconstruit quand l'empreinte du jeu de données change ;
+  une recherche ne touche ni DuckDB ni les Parquet.
+"""
+
+import heapq
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+import duckdb
+
+from backend.database import dataset_version
+
+# Champ exposé -> colonne de results
+FIELDS = {"test": "nombre", "service": "nombre2"}
+# Part minimale des trigrammes de la requête présents dans le nom pour une suggestion approchée
+TRIGRAM_MIN_SHARE = 0.5
+# Requêtes courtes (1-2 caractères) : plages très larges, réponse classée mémorisée par requête
+SHORT_QUERY = 2
+MAX_SUGGESTIONS = 100
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text.casefold()).strip()
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class Entry:
+    value: str
+    normalized: str
+    count: int
+
+
+class NameIndex:
+    """Index d'un champ : entrées, suffixes de mots triés et listes de trigrammes."""
+
+    def __init__(self, counts: Dict[str, int]):
+        merged: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for value, count in counts.items():
+            merged[normalize(value)][value] = count
+        # Triées par fréquence décroissante : l'id d'une entrée est son rang
+        self.entries = sorted(
+            (
+                Entry(value=max(spellings, key=spellings.get), normalized=norm, count=sum(spellings.values()))
+                for norm, spellings in merged.items()
+                if norm
+            ),
+            key=lambda e: (-e.count, e.normalized),
+        )
+        self._short: Dict[str, List[int]] = {}
+
+        # (suffixe commençant à un début de mot, id de l'entrée), trié pour la recherche par préfixe
+        suffixes = []
+        self.trigrams: Dict[str, List[int]] = defaultdict(list)
+        for i, entry in enumerate(self.entries):
+            for match in re.finditer(r"\S+", entry.normalized):
+                suffixes.append((entry.normalized[match.start():], i))
+            for gram in _trigrams(entry.normalized):
+                self.trigrams[gram].append(i)
+        suffixes.sort()
+        self._suffix_keys = [s for s, _ in suffixes]
+        self._suffix_ids = [i for _, i in suffixes]
+        # Requêtes d'un caractère précalculées (les plus larges) ; celles de deux le sont au premier appel
+        for first in {key[0] for key in self._suffix_keys}:
+            self._short[first] = self._rank(first, MAX_SUGGESTIONS)
+
+    def search(self, query: str, limit: int) -> List[Entry]:
+        q = normalize(query)
+        if not q:
+            return self.entries[:limit]
+        if len(q) <= SHORT_QUERY:
+            ranked = self._short.get(q)
+            if ranked is None:
+                ranked = self._short[q] = self._rank(q, MAX_SUGGESTIONS)
+        else:
+            ranked = self._rank(q, limit)
+        return [self.entries[i] for i in ranked[:limit]]
+
+    def _rank(self, q: str, limit: int) -> List[int]:
+        # Préfixe d'un mot : plage contiguë du tableau trié des suffixes
+        start = bisect_left(self._suffix_keys, q)
+        end = bisect_left(self._suffix_keys, q + "\uffff", lo=start)
+        word_ids = set(self._suffix_ids[start:end])
+        name_prefix = [i for i in word_ids if self.entries[i].normalized.startswith(q)]
+        word_prefix = [i for i in word_ids if not self.entries[i].normalized.startswith(q)]
+
+        ranked = heapq.nsmallest(limit, name_prefix) + heapq.nsmallest(limit, word_prefix)
+        if len(ranked) < limit and len(q) >= 3:
+            ranked += heapq.nsmallest(limit - len(ranked), self._trigram_matches(q, exclude=word_ids))
+        return ranked[:limit]
+
+    def _trigram_matches(self, q: str, exclude: Set[int]) -> List[int]:
+        grams = _trigrams(q)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for i in self.trigrams.get(gram, ()):
+                shared[i] += 1
+        needed = max(1, int(len(grams) * TRIGRAM_MIN_SHARE))
+        return [i for i, n in shared.items() if n >= needed and i not in exclude]
+
+
+_lock = threading.Lock()
+_index: Dict[str, object] = {"version": None, "fields": None}
+
+
+def _build(con: duckdb.DuckDBPyConnection) -> Dict[str, NameIndex]:
+    # Un seul scan : un ensemble de regroupement par colonne
+    test_col, service_col = FIELDS["test"], FIELDS["service"]
+    rows = con.execute(f"""
+        SELECT
+            CASE WHEN GROUPING({test_col}) = 0 THEN 'test' ELSE 'service' END AS field,
+            COALESCE({test_col}, {service_col}) AS value,
+            COUNT(*) AS n
+        FROM results
+        GROUP BY GROUPING SETS (({test_col}), ({service_col}))
+        HAVING value IS NOT NULL
+    """).fetchall()
+    counts: Dict[str, Dict[str, int]] = {field: {} for field in FIELDS}
+    for field, value, n in rows:
+        counts[field][value] = n
+    return {field: NameIndex(values) for field, values in counts.items()}
+
+
+def get_index(con: duckdb.DuckDBPyConnection, field: str) -> NameIndex:
+    """Index du champ, (re)construit une fois par version du jeu de données."""
+    version = dataset_version()
+    with _lock:
+        if _index["version"] != version:
+            _index["fields"] = _build(con)
+            _index["version"] = version
+            print(f"✅ Index d'autocomplétion construit ({', '.join(f'{k}: {len(v.entries)}' for k, v in _index['fields'].items())}).")
+        return _index["fields"][field]
+
+
+def suggest(con: duckdb.DuckDBPyConnection, query: str, field: str = "test", limit: int = 10) -> List[Entry]:
+    return get_index(con, field).search(query, limit)
@@ -0,0 +1,192 @@
+# backend/utils/cache.py
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+import duckdb
+
+from backend.database import DATA_DIR, dataset_version
+from backend.utils.metrics import InstrumentedConnection
+
+CACHE_MAX_ENTRIES = 512
+
+PROMPT_CACHE_PATH = DATA_DIR / "cache" / "llm_prompts.sqlite"
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+class ResponseCache:
+    """
+    Cache LRU borné des réponses des endpoints de lecture.
+    Les clés contiennent la version du jeu de données : un nouvel upload rend
+    automatiquement les anciennes entrées inaccessibles (et clear() les libère).
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "dataset_version": dataset_version(),
+            }
+
+
+response_cache = ResponseCache()
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    if hasattr(value, "model_dump"):
+        return _freeze(value.model_dump())
+    return value
+
+
+def cached(func: Callable) -> Callable:
+    """
+    Décorateur d'endpoint : clé = (endpoint, paramètres, version du dataset).
+    La connexion DuckDB injectée n'entre pas dans la clé. Les exceptions ne sont pas mises en cache.
+    """
+    endpoint = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        params = {k: v for k, v in kwargs.items() if not isinstance(v, (duckdb.DuckDBPyConnection, InstrumentedConnection))}
+        key = (endpoint, _freeze(params), dataset_version())
+        found, value = response_cache.get(key)
+        if found:
+            return value
+        value = func(*args, **kwargs)
+        response_cache.set(key, value)
+        return value
+
+    return wrapper
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Casse et espaces normalisés : « Moyenne d'âge ? » et « moyenne  d'âge? » partagent la même entrée."""
+    prompt = re.sub(r"\s+", " ", prompt.strip().lower())
+    return re.sub(r"\s+([?!.])", r"\1", prompt)
+
+
+class PromptCache:
+    """
+    Cache persistant (SQLite) question -> code/SQL généré par le LLM.
+    Clé : (mode, version du prompt système, version du dataset, question normalisée).
+    Éviction LRU au-delà de max_entries ; une entrée plus vieille que ttl est ignorée puis supprimée.
+    """
+
+    def __init__(self, path=PROMPT_CACHE_PATH, max_entries: int = PROMPT_CACHE_MAX_ENTRIES, ttl: int = PROMPT_CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path.as_posix(), check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS prompts (
+                    mode TEXT, prompt_version TEXT, dataset_version TEXT, prompt TEXT,
+                    code TEXT, created_at REAL, last_used REAL,
+                    PRIMARY KEY (mode, prompt_version, dataset_version, prompt)
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_prompts_last_used ON prompts (last_used)")
+        return self._db
+
+    def get(self, mode: str, prompt_version: str, prompt: str) -> Optional[str]:
+        key = (mode, prompt_version, dataset_version(), normalize_prompt(prompt))
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute(
+                "SELECT code, created_at FROM prompts WHERE mode = ? AND prompt_version = ? AND dataset_version = ? AND prompt = ?", key
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    db.execute("DELETE FROM prompts WHERE mode = ? AND prompt_version = ? AND dataset_version = ? AND prompt = ?", key)
+                    db.commit()
+                self.misses += 1
+                return None
+            db.execute(
+                "UPDATE prompts SET last_used = ? WHERE mode = ? AND prompt_version = ? AND dataset_version = ? AND prompt = ?", (now, *key)
+            )
+            db.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, mode: str, prompt_version: str, prompt: str, code: str):
+        key = (mode, prompt_version, dataset_version(), normalize_prompt(prompt))
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("INSERT OR REPLACE INTO prompts VALUES (?, ?, ?, ?, ?, ?, ?)", (*key, code, now, now))
+            db.execute("DELETE FROM prompts WHERE created_at < ?", (now - self.ttl,))
+            db.execute("""
+                DELETE FROM prompts WHERE rowid IN (
+                    SELECT rowid FROM prompts ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn().execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+prompt_cache = PromptCache()
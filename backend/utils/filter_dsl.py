@@ -1,4 +1,21 @@
 # backend/utils/filter_dsl.py
+"""
+Compilateur du DSL de filtres de cohorte.
+
+Un filtre est un groupe {conditions, logic} dont les conditions sont des comparaisons
+{column, operator, value} ou des groupes imbriqués. Il est compilé à partir du schéma
+Arrow de la table ciblée (liste blanche des colonnes, typage des valeurs) vers :
+- une clause WHERE DuckDB paramétrée
+- une expression pyarrow.dataset, utilisable comme filtre de lecture Parquet
+  (élagage des row groups par leurs statistiques min/max)
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 operator_map = {
     "eq": "=",
@@ -7,31 +24,177 @@ operator_map = {
     "lt": "<",
     "gte": ">=",
     "lte": "<=",
-    "contains": "LIKE"
 }
+# Opérateurs sans équivalent SQL binaire direct
+SPECIAL_OPERATORS = {"contains", "in", "not_in", "between", "is_null", "not_null"}
+RANGE_OPERATORS = {"gt", "lt", "gte", "lte", "between"}
+LOGICS = {"AND", "OR"}
+
+DATE_FORMATS = ["%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"]
+
+def parse_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date: {value}")
+
+def _is_number(value) -> bool:
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def _scalar(value):
+    # Liste / objet à la place d'une valeur simple : ValueError (400) plutôt qu'une TypeError (500)
+    if isinstance(value, (list, tuple, dict)):
+        raise ValueError(f"Expected a single value, got: {value!r}")
+    return value
+
+def _coerce(value, dtype: pa.DataType):
+    """Convertit une valeur du filtre vers le type de la colonne."""
+    if value is None:
+        raise ValueError("Missing filter value")
+    _scalar(value)
+    if pa.types.is_date(dtype) or pa.types.is_timestamp(dtype):
+        return parse_date(value)
+    if pa.types.is_integer(dtype):
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    if pa.types.is_floating(dtype):
+        return float(value)
+    if pa.types.is_boolean(dtype):
+        return str(value).lower() in ("1", "true", "yes")
+    return str(value)
+
+
+@dataclass
+class CompiledFilter:
+    sql: str = "TRUE"
+    params: List[Any] = field(default_factory=list)
+    # Expression exacte pour pyarrow.dataset ; None si une condition n'a pas d'équivalent Arrow
+    arrow: Optional[pc.Expression] = None
+
+
+def _compile_condition(cond, schema: pa.Schema) -> CompiledFilter:
+    column, operator, value = cond.column, cond.operator, cond.value
+    if column not in schema.names:
+        raise ValueError(f"Unknown column: {column}")
+    if operator not in operator_map and operator not in SPECIAL_OPERATORS:
+        raise ValueError(f"Unsupported operator: {operator}")
+
+    dtype = schema.field(column).type
+    col = f'"{column}"'
+    ref = pc.field(column)
 
-NUMERIC_COLS = {"edad", "textores"}  # colonnes numériques
+    if operator == "is_null":
+        return CompiledFilter(f"{col} IS NULL", [], ref.is_null())
+    if operator == "not_null":
+        return CompiledFilter(f"{col} IS NOT NULL", [], ref.is_valid())
 
-def build_where_clause(conditions, logic):
-    where_parts = []
-    params = []
+    is_text = pa.types.is_string(dtype) or pa.types.is_large_string(dtype)
+    if operator == "contains":
+        if value is None:
+            raise ValueError("Missing filter value")
+        text = str(_scalar(value))
+        if is_text:
+            return CompiledFilter(f"contains({col}, ?)", [text], pc.match_substring(ref, text))
+        # ex: Date contient "2024-03"
+        return CompiledFilter(f"contains(CAST({col} AS VARCHAR), ?)", [text], None)
 
-    for cond in conditions:
-        op = operator_map.get(cond.operator)
-        if not op:
-            raise ValueError(f"Unsupported operator: {cond.operator}")
+    # Comparaison numérique sur une colonne texte (ex: textores) : TRY_CAST, sans équivalent Arrow
+    numeric_text = (
+        is_text
+        and operator in RANGE_OPERATORS
+        and all(_is_number(v) for v in (value if isinstance(value, (list, tuple)) else [value]) if v is not None)
+    )
+    if numeric_text and f"{column}_num" in schema.names:
+        # Version typée à l'ingestion (textores_num) : comparaison directe, filtrable en Arrow
+        typed = f"{column}_num"
+        col, ref, dtype, numeric_text = f'"{typed}"', pc.field(typed), schema.field(typed).type, False
+    if numeric_text:
+        col = f"TRY_CAST({col} AS DOUBLE)"
+        coerce = lambda v: float(_scalar(v))
+    else:
+        coerce = lambda v: _coerce(v, dtype)
 
-        # detection colonne numérique
-        if cond.column in NUMERIC_COLS:
-            where_parts.append(f"{cond.column} {op} ?")
-            params.append(float(cond.value))  # cast numeric
+    if operator in ("in", "not_in"):
+        values = value if isinstance(value, (list, tuple)) else [value]
+        values = [coerce(v) for v in values]
+        negate = operator == "not_in"
+        if not values:
+            return CompiledFilter("TRUE" if negate else "FALSE", [], pc.scalar(negate))
+        placeholders = ", ".join("?" for _ in values)
+        expr = ref.isin(pa.array(values).cast(dtype))
+        # Sémantique SQL des deux côtés : une valeur NULL n'est ni IN ni NOT IN (ligne écartée)
+        if negate:
+            expr = ~expr & ref.is_valid()
+        return CompiledFilter(f"{col} {'NOT IN' if negate else 'IN'} ({placeholders})", values, expr)
+
+    if operator == "between":
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            raise ValueError("between expects [start, end]")
+        low, high = value
+        parts = []
+        if low is not None:
+            parts.append(_compile_binary(col, ref, ">=", coerce(low), numeric_text))
+        if high is not None:
+            parts.append(_compile_binary(col, ref, "<=", coerce(high), numeric_text))
+        return _combine(parts, "AND")
+
+    return _compile_binary(col, ref, operator_map[operator], coerce(value), numeric_text)
+
+
+def _compile_binary(col: str, ref: pc.Expression, op: str, value, sql_only: bool = False) -> CompiledFilter:
+    arrow = None
+    if not sql_only:
+        arrow = {
+            "=": ref == value,
+            "!=": ref != value,
+            ">": ref > value,
+            "<": ref < value,
+            ">=": ref >= value,
+            "<=": ref <= value,
+        }[op]
+    return CompiledFilter(f"{col} {op} ?", [value], arrow)
+
+
+def _combine(parts: List[CompiledFilter], logic: str) -> CompiledFilter:
+    if not parts:
+        return CompiledFilter("TRUE", [], pc.scalar(True))
+    if len(parts) == 1:
+        return parts[0]
+
+    sql = f" {logic} ".join(f"({p.sql})" for p in parts)
+    params = [v for p in parts for v in p.params]
+    arrow = None
+    if all(p.arrow is not None for p in parts):
+        arrow = parts[0].arrow
+        for p in parts[1:]:
+            arrow = (arrow & p.arrow) if logic == "AND" else (arrow | p.arrow)
+    return CompiledFilter(sql, params, arrow)
+
+
+def compile_filter(cohort, schema: pa.Schema) -> CompiledFilter:
+    """
+    Compile un groupe {conditions, logic} (récursif) pour le schéma donné.
+    Lève ValueError pour une colonne hors schéma, un opérateur inconnu ou une valeur invalide.
+    """
+    logic = (cohort.logic or "AND").upper()
+    if logic not in LOGICS:
+        raise ValueError(f"Unsupported logic: {cohort.logic}")
+
+    parts = []
+    for cond in cohort.conditions:
+        if hasattr(cond, "conditions"):
+            parts.append(compile_filter(cond, schema))
         else:
-            if op == "LIKE":
-                where_parts.append(f"{cond.column} {op} ?")
-                params.append(f"%{cond.value}%")
-            else:
-                where_parts.append(f"{cond.column} {op} ?")
-                params.append(cond.value)
-
-    clause = f" {logic} ".join(where_parts)
-    return clause, params
+            parts.append(_compile_condition(cond, schema))
+    return _combine(parts, logic)
+
+
+def parquet_schema(path) -> pa.Schema:
+    """Schéma servant de liste blanche des colonnes filtrables (lecture du footer seul)."""
+    return pq.read_schema(path)
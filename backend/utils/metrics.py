@@ -0,0 +1,308 @@
+# backend/utils/metrics.py
+"""
+Instrumentation : latence des endpoints, durée et lignes de chaque requête SQL, latence des
+appels LLM, exposées au format texte Prometheus sur GET /metrics.
+
+- MetricsMiddleware (ASGI) mesure chaque requête HTTP, étiquetée par route (gabarit, pas l'URL).
+- InstrumentedConnection enveloppe les curseurs DuckDB (get_con, write_connection, exports) :
+  chaque execute() est chronométré, les fetch*() ajoutent le nombre de lignes renvoyées.
+- En-tête opt-in `X-DuckDB-Profile: 1` : le profilage DuckDB (JSON) est activé sur les curseurs
+  utilisés par la requête ; la réponse porte `X-DuckDB-Profile-Id`, à lire sur
+  GET /metrics/profiles/{id} (les derniers PROFILE_HISTORY profils sont conservés).
+
+Pas de dépendance à prometheus_client : le format texte est produit ici.
+"""
+
+import contextvars
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Au-delà, les nouvelles requêtes SQL distinctes sont regroupées sous statement="other"
+MAX_STATEMENTS = 500
+STATEMENT_LABEL_LENGTH = 160
+PROFILE_HISTORY = 50
+PROFILE_HEADER = "x-duckdb-profile"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, buckets
+        # clé de labels -> [comptes par bucket (non cumulés, +Inf en dernier), somme, nombre]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total:.6f}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+HTTP_LATENCY = Histogram("lablens_http_request_duration_seconds", "Durée des requêtes HTTP (réponse complète, streaming compris).", ("method", "route", "status"))
+SQL_LATENCY = Histogram("lablens_sql_duration_seconds", "Durée d'exécution des requêtes DuckDB.", ("statement",))
+SQL_ROWS = Counter("lablens_sql_rows_total", "Lignes renvoyées par les requêtes DuckDB (fetch*).", ("statement",))
+SQL_ERRORS = Counter("lablens_sql_errors_total", "Requêtes DuckDB en erreur.", ("statement",))
+LLM_LATENCY = Histogram("lablens_llm_call_duration_seconds", "Durée des appels au fournisseur LLM (attente du slot comprise).", ("kind", "outcome"))
+
+REGISTRY = [HTTP_LATENCY, SQL_LATENCY, SQL_ROWS, SQL_ERRORS, LLM_LATENCY]
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+_statement_labels: Dict[str, str] = {}
+_statement_lock = threading.Lock()
+
+
+def statement_label(sql: str) -> str:
+    """Texte SQL normalisé (espaces compactés, tronqué) ; cardinalité bornée par MAX_STATEMENTS."""
+    label = _statement_labels.get(sql)
+    if label is not None:
+        return label
+    label = re.sub(r"\s+", " ", sql).strip()[:STATEMENT_LABEL_LENGTH]
+    with _statement_lock:
+        if len(_statement_labels) >= MAX_STATEMENTS:
+            return "other"
+        _statement_labels[sql] = label
+    return label
+
+
+# === PROFILAGE PAR REQUÊTE ===
+
+# Liste des profils de la requête HTTP en cours (None si l'en-tête n'est pas demandé)
+_request_profile: contextvars.ContextVar[Optional[List[dict]]] = contextvars.ContextVar("request_profile", default=None)
+_profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def _store_profile(method: str, path: str) -> Tuple[str, List[dict]]:
+    profile_id = uuid.uuid4().hex[:12]
+    statements: List[dict] = []
+    with _profiles_lock:
+        _profiles[profile_id] = {"id": profile_id, "method": method, "path": path, "statements": statements}
+        while len(_profiles) > PROFILE_HISTORY:
+            _profiles.popitem(last=False)
+    return profile_id, statements
+
+
+class InstrumentedConnection:
+    """
+    Enveloppe d'un curseur DuckDB : mêmes méthodes (délégation), execute() et fetch*() mesurés.
+    execute() renvoie l'enveloppe, donc `con.execute(...).fetchall()` reste instrumenté.
+    """
+
+    _FETCHES = ("fetchone", "fetchmany", "fetchall", "fetchdf", "df", "fetch_df", "fetchnumpy", "fetch_arrow_table", "arrow", "pl")
+
+    def __init__(self, con):
+        self._con = con
+        self._statement = "other"
+        self._profile_path: Optional[str] = None
+        # Entrée de profil de la dernière requête : DuckDB n'écrit le profil qu'une fois le résultat
+        # entièrement lu (un fetchone() sur plusieurs lignes n'en produit pas : profil null)
+        self._pending: Optional[dict] = None
+
+    def __getattr__(self, name):
+        attr = getattr(self._con, name)
+        if name in self._FETCHES:
+            return self._wrap_fetch(attr)
+        return attr
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def cursor(self) -> "InstrumentedConnection":
+        return InstrumentedConnection(self._con.cursor())
+
+    def execute(self, query, *args, **kwargs) -> "InstrumentedConnection":
+        profile = _request_profile.get()
+        if profile is not None and self._profile_path is None:
+            self._enable_profiling()
+        self._pending = None
+        self._statement = statement_label(query) if isinstance(query, str) else "other"
+        start = time.perf_counter()
+        try:
+            self._con.execute(query, *args, **kwargs)
+        except Exception:
+            SQL_ERRORS.inc(statement=self._statement)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            SQL_LATENCY.observe(elapsed, statement=self._statement)
+        if profile is not None:
+            self._pending = {"sql": query if isinstance(query, str) else str(query), "duration_ms": round(elapsed * 1000, 3), "profile": None}
+            profile.append(self._pending)
+        return self
+
+    def _wrap_fetch(self, fetch):
+        def wrapped(*args, **kwargs):
+            result = fetch(*args, **kwargs)
+            SQL_ROWS.inc(_row_count(result), statement=self._statement)
+            self._fill_profile()
+            return result
+        return wrapped
+
+    def _enable_profiling(self):
+        fd, self._profile_path = tempfile.mkstemp(prefix="lablens-profile-", suffix=".json")
+        os.close(fd)
+        self._con.execute("PRAGMA enable_profiling='json'")
+        self._con.execute(f"PRAGMA profiling_output='{self._profile_path}'")
+
+    def _fill_profile(self):
+        """Rattache le profil écrit par DuckDB à la dernière requête, puis vide le fichier."""
+        if self._pending is None or self._profile_path is None:
+            return
+        try:
+            with open(self._profile_path, "r+", encoding="utf-8") as f:
+                content = f.read()
+                f.truncate(0)
+            if content:
+                self._pending["profile"] = json.loads(content)
+                self._pending = None
+        except (OSError, ValueError):
+            pass
+
+    def disable_profiling(self):
+        """À appeler avant de rendre le curseur au pool : le profilage ne doit pas fuir sur la requête suivante."""
+        if self._profile_path is None:
+            return
+        self._fill_profile()
+        try:
+            self._con.execute("PRAGMA disable_profiling")
+        finally:
+            self._pending = None
+            if os.path.exists(self._profile_path):
+                os.remove(self._profile_path)
+            self._profile_path = None
+
+    def close(self):
+        self.disable_profiling()
+        self._con.close()
+
+
+def _row_count(result) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, tuple):  # fetchone
+        return 1
+    if isinstance(result, dict):  # fetchnumpy
+        return len(next(iter(result.values()), []))
+    try:
+        return len(result)
+    except TypeError:
+        return getattr(result, "num_rows", 0)
+
+
+# === MIDDLEWARE HTTP ===
+
+def _route_label(scope) -> str:
+    """Gabarit de la route (ex: /panels/patient/{numorden}) pour garder une cardinalité bornée."""
+    route = scope.get("route")
+    if route is not None and hasattr(route, "path"):
+        return route.path
+    from starlette.routing import Match
+    for candidate in getattr(scope.get("app"), "routes", []):
+        match, _ = candidate.matches(scope)
+        if match == Match.FULL:
+            return getattr(candidate, "path", "unmatched")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        wants_profile = headers.get(PROFILE_HEADER.encode(), b"").decode().lower() in ("1", "true", "yes")
+        token, profile_id = None, None
+        if wants_profile:
+            profile_id, statements = _store_profile(scope["method"], scope["path"])
+            token = _request_profile.set(statements)
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_id is not None:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-duckdb-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if token is not None:
+                _request_profile.reset(token)
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=scope["method"], route=_route_label(scope), status=str(status))
@@ -8,6 +8,7 @@ export default function StatsPage() {
   const [loading, setLoading] = useState(true)
   const [testName, setTestName] = useState("")
   const [testStats, setTestStats] = useState<any>(null)
+  const [suggestions, setSuggestions] = useState<{ value: string; count: number }[]>([])
   const [loadingTest, setLoadingTest] = useState(false)
   const [currentPage, setCurrentPage] = useState(1)
   const rowsPerPage = 20
@@ -19,6 +20,20 @@ export default function StatsPage() {
     })
   }, [])
 
+  // Suggestions de noms de tests (index en mémoire côté API)
+  useEffect(() => {
+    const q = testName.trim()
+    if (!q) {
+      setSuggestions([])
+      return
+    }
+    let cancelled = false
+    stats.autocomplete(q)
+      .then(res => { if (!cancelled) setSuggestions(res.data) })
+      .catch(() => { if (!cancelled) setSuggestions([]) })
+    return () => { cancelled = true }
+  }, [testName])
+
   const fetchTestStats = async () => {
     if (!testName) return
     setLoadingTest(true)
@@ -57,7 +72,13 @@ export default function StatsPage() {
             onChange={(e) => setTestName(e.target.value)}
             placeholder="Ex: GLUCOSE, CRP, UREE SANGUIN..."
             className="border px-3 py-2 rounded-md text-black flex-1"
+            list="test-suggestions"
           />
+          <datalist id="test-suggestions">
+            {suggestions.map((s) => (
+              <option key={s.value} value={s.value}>{s.count} résultats</option>
+            ))}
+          </datalist>
           <button
             onClick={fetchTestStats}
             disabled={loadingTest}
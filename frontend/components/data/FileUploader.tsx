@@ -4,12 +4,26 @@ import { useState } from 'react'
 import { Upload, CheckCircle, AlertCircle, Loader2, FileText } from 'lucide-react'
 import { loader } from '@/lib/api'
 import { useDataContext } from '@/context/DataContext'
+import type { JobStatus } from '@/types/loader.types'
+
+// Libellés des étapes du job d'ingestion
+const STAGE_LABELS: Record<string, string> = {
+  queued: 'En attente',
+  starting: 'Démarrage',
+  cleaning: 'Nettoyage',
+  clustering: 'Tri par patient',
+  partitioning: 'Partitionnement',
+  rebasing: 'Recopie sur la dernière version',
+  loading: 'Chargement',
+  derived: 'Tables dérivées',
+}
 
 export default function FileUploader({ onSuccess }: { onSuccess?: (data: any) => void }) {
   const { markDataAsLoaded } = useDataContext()
   const [file, setFile] = useState<File | null>(null)
   const [loading, setLoading] = useState(false)
   const [result, setResult] = useState<any>(null)
+  const [job, setJob] = useState<JobStatus | null>(null)
   const [error, setError] = useState<string | null>(null)
 
   const handleFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
@@ -32,17 +46,18 @@ export default function FileUploader({ onSuccess }: { onSuccess?: (data: any) =>
       
       console.log('📤 Uploading file:', file.name)
       
-      // Appel à l'API
+      // Appel à l'API : le fichier est déposé, l'ingestion tourne en arrière-plan
       const response = await loader.uploadFile(file)
+      const done = await loader.waitForJob(response.data.id, setJob)
       
-      console.log('✅ Upload success:', response.data)
-      setResult(response.data)
+      console.log('✅ Upload success:', done)
+      setResult(done)
       
       // Marquer les données comme chargées
       markDataAsLoaded()
       
       if (onSuccess) {
-        onSuccess(response.data)
+        onSuccess(done)
       }
     } catch (err: any) {
       console.error('❌ Upload error:', err)
@@ -51,6 +66,7 @@ export default function FileUploader({ onSuccess }: { onSuccess?: (data: any) =>
       setError(msg)
     } finally {
       setLoading(false)
+      setJob(null)
     }
   }
 
@@ -96,7 +112,9 @@ export default function FileUploader({ onSuccess }: { onSuccess?: (data: any) =>
         {loading ? (
           <>
             <Loader2 className="w-6 h-6 animate-spin" />
-            Traitement en cours (Nettoyage & Indexation)...
+            {job
+              ? `${STAGE_LABELS[job.stage] ?? job.stage}... ${job.rows_processed.toLocaleString()} lignes`
+              : 'Traitement en cours (Nettoyage & Indexation)...'}
           </>
         ) : (
           <>
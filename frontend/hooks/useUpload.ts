@@ -3,12 +3,12 @@
 
 import { useState } from 'react'
 import { loader } from '@/lib/api'
-import type { UploadResponse } from '@/types/loader.types'
+import type { JobStatus } from '@/types/loader.types'
 
 export function useUpload() {
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
-  const [data, setData] = useState<UploadResponse | null>(null)
+  const [data, setData] = useState<JobStatus | null>(null)
 
   // Charger fichier local (déjà sur le serveur)
   const uploadLocal = async () => {
@@ -33,8 +33,9 @@ export function useUpload() {
     setError(null)
     try {
       const res = await loader.uploadFile(file)
-      setData(res.data)
-      return res.data
+      // L'ingestion tourne en arrière-plan : on suit le job jusqu'à la fin
+      const job = await loader.waitForJob(res.data.id, setData)
+      return job
     } catch (err: any) {
       console.error('Erreur uploadFile:', err)
       setError(err.response?.data?.detail || err.message)
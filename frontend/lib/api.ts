@@ -1,4 +1,5 @@
 import axios from 'axios'
+import type { JobStatus } from '@/types/loader.types'
 
 // 1. URL : Utilise localhost:8000 (ce que voit ton navigateur)
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
@@ -42,6 +43,20 @@ export const loader = {
     })
   },
 
+  // Ingestion en arrière-plan : suivi du job retourné par uploadFile
+  job: (id: string) => apiClient.get<JobStatus>(`/loader/jobs/${id}`),
+
+  // Interroge le job jusqu'à la fin ; onProgress reçoit chaque état intermédiaire
+  waitForJob: async (id: string, onProgress?: (job: JobStatus) => void, intervalMs = 1000): Promise<JobStatus> => {
+    while (true) {
+      const { data } = await apiClient.get<JobStatus>(`/loader/jobs/${id}`)
+      onProgress?.(data)
+      if (data.status === 'done') return data
+      if (data.status === 'failed') throw new Error(data.error || "Echec de l'ingestion")
+      await new Promise((resolve) => setTimeout(resolve, intervalMs))
+    }
+  },
+
   // Filtrage / subset
   subset: (filters: any) =>
     apiClient.post('/loader/subset', filters),
@@ -91,5 +106,7 @@ export const stats = {
   byService: () => apiClient.get("/stats/by-service"),
   test: (testName: string) =>
     apiClient.get(`/stats/test/${encodeURIComponent(testName)}`),
+  autocomplete: (q: string, field: "test" | "service" = "test", limit = 10) =>
+    apiClient.get("/stats/autocomplete", { params: { q, field, limit } }),
   activityTrend: () => apiClient.get("/stats/activity-trend"),
 }
\ No newline at end of file
@@ -1,25 +1,36 @@
 // types/loader.types.ts
 
-export interface UploadResponse {
-  rows: number;
-  message: string;
-  clean_csv_path: string;
+export interface JobStatus {
+  id: string;
+  kind: 'upload' | 'append';
+  filename: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  stage: string;
+  rows_processed: number;
+  rows_written: number | null;
+  error: string | null;
+  created_at: string;
+  started_at: string | null;
+  finished_at: string | null;
 }
 
 export interface FilterCondition {
   field: string;
-  operator: 'eq' | 'ne' | 'gt' | 'lt' | 'gte' | 'lte' | 'contains';
-  value: string | number;
+  operator: 'eq' | 'ne' | 'gt' | 'lt' | 'gte' | 'lte' | 'contains' | 'in' | 'not_in' | 'between' | 'is_null' | 'not_null';
+  value?: string | number | (string | number | null)[] | null;
 }
 
 export interface CohortFilter {
-  conditions: FilterCondition[];
+  conditions: (FilterCondition | CohortFilter)[];
   logic: 'AND' | 'OR';
 }
 
 export interface SubsetResponse {
-  rowcount: number;
+  rowcount: number | null;
+  count_mode?: 'exact' | 'estimate' | null;
   records: BloodWorkRecord[];
+  next_cursor?: string | null;
+  has_more?: boolean;
 }
 
 export interface BloodWorkRecord {
@@ -30,4 +41,5 @@ export interface BloodWorkRecord {
   textores: string | number;
   nombre2: string;
   Date: string;
+  row_id?: number;
 }
@@ -1,63 +1,68 @@
-
 """
-This script is designed to **inspect and analyze a bloodwork dataset** before cleaning. 
-
-Its main goal is to identify potential data quality issues, understand the structure of 
-the dataset, and generate insights that will guide the cleaning process in a separate 
-script (`02_clean_data.py`). 
+This script is designed to **inspect and analyze a bloodwork dataset** before cleaning.
 
+Its main goal is to identify potential data quality issues, understand the structure of
+the dataset, and generate insights that will guide the cleaning process. The checks live in
+`backend/services/cleaning.py` (`quality_report`): the loader runs the same checks on every
+upload and returns the report with the ingestion job (GET /loader/jobs/{id}).
 
+Usage:
+    python scripts/01_inspect_data.py [data/raw/original_synthetic_bloodwork.csv] [--workers N] [--json]
 """
 
-import pandas as pd
+import argparse
+import json
+import sys
+from pathlib import Path
 
-#Loading the dataset 
-df = pd.read_csv("data/raw/original_synthetic_bloodwork.csv", encoding="latin1")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
-print("File loaded successfully.")
-print(f"Shape: {df.shape}")
-print("Columns:", list(df.columns))
+from backend.services.cleaning import CLEAN_WORKERS, EXPECTED_COLS, RAW_ENCODING, check_columns, quality_report  # noqa: E402
 
-#Expected schema check
-expected_cols = ["numorden", "sexo", "edad", "nombre", "textores", "nombre2", "Date"]
-missing_cols = [c for c in expected_cols if c not in df.columns]
-extra_cols = [c for c in df.columns if c not in expected_cols]
 
-if missing_cols:
-    print(f" Missing columns: {missing_cols}")
-else:
-    print(" All expected columns are present.")
-if extra_cols:
-    print(f" Extra columns found: {extra_cols}")
+def main():
+    parser = argparse.ArgumentParser(description="Data-quality report of a raw bloodwork CSV.")
+    parser.add_argument("csv", nargs="?", default="data/raw/original_synthetic_bloodwork.csv")
+    parser.add_argument("--encoding", default=RAW_ENCODING)
+    parser.add_argument("--workers", type=int, default=CLEAN_WORKERS)
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = parser.parse_args()
 
-#Data type inspection 
-print("\n--- Data Types ---")
-print(df.dtypes)
+    #Expected schema check
+    try:
+        check_columns(Path(args.csv), args.encoding)
+    except ValueError as e:
+        sys.exit(f" {e}")
+    report = quality_report(Path(args.csv), args.encoding, args.workers).to_dict()
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
 
-#Missing values summary 
-print("\n--- Missing Values per Column ---")
-print(df.isna().sum())
-
-#Date parsing check 
-try:
-    parsed_dates = pd.to_datetime(df["Date"], format="%d/%m/%Y", errors="coerce")
-    invalid_dates = parsed_dates.isna().sum()
-    print(f"\nInvalid date entries: {invalid_dates}")
-except Exception as e:
-    print(f" Date parsing failed: {e}")
+    print(f"Rows: {report['rows_read']}")
+    print(" All expected columns are present.")
+    if report["extra_columns"]:
+        print(f" Extra columns found: {report['extra_columns']}")
 
-#Edad (age) analysis 
-df["edad"] = pd.to_numeric(df["edad"], errors="coerce")
-zero_age_df = df[df["edad"] == 0]
-total_zero = len(zero_age_df)
-percent_zero = total_zero / len(df) * 100
+    #Missing values summary
+    print("\n--- Missing Values per Column ---")
+    for col in EXPECTED_COLS:
+        print(f"{col:<10} {report['missing_values'][col]}")
 
-print(f"\nRows with edad = 0: {total_zero} ({percent_zero:.2f}% of dataset)")
-print(f"Unique numorden with edad=0: {zero_age_df['numorden'].nunique()}")
+    print(f"\nInvalid date entries: {report['invalid_dates']}")
+    print(f"Non-numeric edad entries: {report['invalid_ages']}")
 
-print("\nMost common tests for edad = 0:")
-print(zero_age_df["nombre"].value_counts().head(10))
+    #Edad (age) analysis
+    zero_age = report["zero_age"]
+    print(f"\nRows with edad = 0: {zero_age['rows']} ({zero_age['percent']:.2f}% of dataset)")
+    print(f"Unique numorden with edad=0: {zero_age['patients']}")
+    print("\nMost common tests for edad = 0:")
+    for row in zero_age["top_tests"]:
+        print(f"  {row['test']:<30} {row['count']}")
 
+    print(f"\ntextores: {report['textores']['numeric']} numeric, {report['textores']['qualitative']} qualitative")
+    print(f"Rows kept after cleaning: {report['rows_kept']} (dropped: {report['rows_dropped']})")
+    print("\nInspection complete")
 
 
-print("\nInspection complete")
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,59 @@
 """
-This script is designed to **clean the bloodwork dataset** based on the results 
-from `inspect_data.py`. It ensures the dataset is ready for analysis or use in 
+This script is designed to **clean the bloodwork dataset** based on the results
+from `01_inspect_data.py`. It ensures the dataset is ready for analysis or use in
 the web app by fixing data types, handling missing values, and enforcing a consistent schema.
 
+The rules live in `backend/services/cleaning.py` (`clean_chunk`), the module the loader runs
+in-process on upload; this script only writes its output to a CSV, block by block and on all
+cores (`--workers`).
+
 Why this approach:
 - Dropping rows with missing or zero age ensures the dataset is consistent for age-based analysis.
 - Filling missing 'nombre2' with "Unknown" prevents loss of rows where other data is valid.
 - Keeping 'textores' flexible maintains compatibility with both numeric and qualitative lab results.
 
-
+Usage:
+    python scripts/02_clean_data.py [input.csv] [output.csv] [--workers N]
 """
 
+import argparse
+import sys
+from pathlib import Path
 
-import pandas as pd
-
-
-input_path = "data/raw/original_synthetic_bloodwork.csv"
-output_path = "data/cleaned/cleaned_bloodwork.csv"
-
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
-#Load dataset
-df = pd.read_csv(input_path, encoding="latin1")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
-print(" File loaded successfully.")
-print(f"Initial shape: {df.shape}")
+from backend.services.cleaning import (  # noqa: E402
+    CLEAN_WORKERS, EXPECTED_COLS, RAW_ENCODING, RESULTS_SCHEMA, QualityReport, check_columns, iter_clean_tables,
+)
 
-# Keep only expected columns 
-expected_cols = ["numorden", "sexo", "edad", "nombre", "textores", "nombre2", "Date"]
-df = df[expected_cols]
 
-#Parse Date (day-first)
-df["Date"] = pd.to_datetime(df["Date"], format="%d/%m/%Y", errors="coerce")
+def main():
+    parser = argparse.ArgumentParser(description="Clean a raw bloodwork CSV.")
+    parser.add_argument("input", nargs="?", default="data/raw/original_synthetic_bloodwork.csv")
+    parser.add_argument("output", nargs="?", default="data/cleaned/cleaned_bloodwork.csv")
+    parser.add_argument("--encoding", default=RAW_ENCODING)
+    parser.add_argument("--workers", type=int, default=CLEAN_WORKERS)
+    args = parser.parse_args()
 
-#Convert edad to integer and replace invalid with NaN
-df["edad"] = pd.to_numeric(df["edad"], errors="coerce")
-df["edad"] = df["edad"].astype("Int64")
-df.loc[df["edad"] == 0, "edad"] = pd.NA  # Mark 0 ages as missing
+    input_path, output_path = Path(args.input), Path(args.output)
+    check_columns(input_path, args.encoding)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
 
-# Handle missing values
-# Drop rows where edad is missing
-df = df.dropna(subset=["edad"])
+    # Keep only expected columns, written as UTF-8
+    schema = pa.schema([RESULTS_SCHEMA.field(c) for c in EXPECTED_COLS])
+    report = QualityReport()
+    with pacsv.CSVWriter(output_path, schema, write_options=pacsv.WriteOptions(quoting_style="needed")) as writer:
+        for table, chunk_report in iter_clean_tables(input_path, encoding=args.encoding, workers=args.workers):
+            report.merge(chunk_report)
+            if table is not None:
+                writer.write_table(table.select(EXPECTED_COLS))
 
-# Fill missing nombre2 with "Unknown"
-df["nombre2"] = df["nombre2"].fillna("Unknown")
+    print(f"Cleaned dataset saved to: {output_path}")
+    print(f"Initial rows: {report.rows_read}, final rows: {report.rows_kept}")
 
-#Ensure textores is flexible (string)
-df["textores"] = df["textores"].astype(str)
- 
-#  Format numeric textores values with 2 decimal places
-def format_textores(val):
-    try:
-        num = float(val)
-        return f"{num:.2f}"
-    except ValueError:
-        return val  # if not numeric, keep original string
 
-df["textores"] = df["textores"].apply(format_textores)
-#Save cleaned data
-df.to_csv(output_path, index=False, encoding="utf-8")
-print(f"Cleaned dataset saved to: {output_path}")
-print(f"Final shape: {df.shape}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+benchmark.py
+
+Mesure LabLens de bout en bout sur un jeu synthétique (voir generate_bloodwork.py) :
+    - ingestion complète (durée totale et par étape du job) puis ajout d'un delta (1 %)
+    - chaque endpoint des routers, appelé via un client in-process (TestClient),
+      cache de réponses vidé avant chaque appel : on mesure le calcul, pas le cache
+    - assistant LLM via le serveur factice (stub_llm_server.py) lancé dans un thread
+
+Les résultats sont comparés à une baseline JSON (benchmarks/baseline_<rows>.json) :
+un endpoint est en régression si sa médiane dépasse la baseline de plus de
+`max_ratio` ET de plus de `min_delta_ms` (seuils par défaut ou par endpoint, stockés
+dans la baseline). Code de sortie 1 en cas de régression.
+
+Lancement :
+    python scripts/benchmark.py --rows 1M                     # compare à la baseline
+    python scripts/benchmark.py --rows 1M --update-baseline   # (ré)écrit la baseline
+    python scripts/benchmark.py --csv data/raw/export.csv --baseline benchmarks/baseline_prod.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(REPO_DIR / "scripts"))
+
+from generate_bloodwork import generate, parse_rows  # noqa: E402
+
+DEFAULT_THRESHOLDS = {"max_ratio": 1.25, "min_delta_ms": 5.0}
+APPEND_SHARE = 0.01
+COHORT = "bench"
+COHORT_FILTER = {"conditions": [{"column": "edad", "operator": "gte", "value": 60}, {"column": "sexo", "operator": "eq", "value": "F"}], "logic": "AND"}
+
+# Endpoints non mesurés : effets de bord ou suivi d'ingestion (mesuré à part)
+SKIPPED = {
+    ("post", "/loader/upload_file"),
+    ("post", "/loader/append_file"),
+    ("get", "/loader/jobs/{job_id}"),
+    ("post", "/loader/versions/{version_id}/activate"),
+    ("delete", "/cohorts/{name}"),
+    ("get", "/metrics/profiles/{profile_id}"),
+}
+
+
+def cases(sample: dict) -> list:
+    """(nom, méthode, route OpenAPI, URL, corps JSON) ; `sample` fournit les paramètres de chemin."""
+    test, patient, service = sample["test"], sample["numorden"], sample["service"]
+    return [
+        ("GET /", "get", "/", "/", None),
+        ("GET /cache/stats", "get", "/cache/stats", "/cache/stats", None),
+        ("GET /metrics", "get", "/metrics", "/metrics", None),
+        ("GET /loader/jobs", "get", "/loader/jobs", "/loader/jobs", None),
+        ("GET /loader/versions", "get", "/loader/versions", "/loader/versions", None),
+        ("POST /loader/subset", "post", "/loader/subset", "/loader/subset?limit=100", COHORT_FILTER),
+        ("POST /loader/subset exact", "post", "/loader/subset", "/loader/subset?limit=100&count=exact", COHORT_FILTER),
+        ("GET /stats/summary", "get", "/stats/summary", "/stats/summary", None),
+        ("GET /stats/summary approx", "get", "/stats/summary", "/stats/summary?approx=true", None),
+        ("POST /stats/summary", "post", "/stats/summary", "/stats/summary", COHORT_FILTER),
+        ("GET /stats/activity-trend", "get", "/stats/activity-trend", "/stats/activity-trend", None),
+        ("GET /stats/by-sex", "get", "/stats/by-sex", "/stats/by-sex", None),
+        ("GET /stats/by-service", "get", "/stats/by-service", "/stats/by-service", None),
+        ("GET /stats/test/{test_name}", "get", "/stats/test/{test_name}", f"/stats/test/{test}", None),
+        ("GET /stats/autocomplete", "get", "/stats/autocomplete", f"/stats/autocomplete?q={test[:3]}", None),
+        ("GET /panels/patient/{numorden}", "get", "/panels/patient/{numorden}", f"/panels/patient/{patient}", None),
+        ("GET /panels/summary", "get", "/panels/summary", "/panels/summary", None),
+        ("GET /panels/top-patients", "get", "/panels/top-patients", "/panels/top-patients", None),
+        ("GET /repeats/patient/{numorden}", "get", "/repeats/patient/{numorden}", f"/repeats/patient/{patient}", None),
+        ("GET /repeats/summary", "get", "/repeats/summary", "/repeats/summary", None),
+        ("GET /repeats/top-tests", "get", "/repeats/top-tests", "/repeats/top-tests", None),
+        ("GET /repeats/trend", "get", "/repeats/trend", "/repeats/trend", None),
+        ("GET /coordering/top-pairs", "get", "/coordering/top-pairs", "/coordering/top-pairs", None),
+        ("GET /coordering/top-pairs service", "get", "/coordering/top-pairs", f"/coordering/top-pairs?service={service}", None),
+        ("GET /coordering/matrix-by-service", "get", "/coordering/matrix-by-service", "/coordering/matrix-by-service", None),
+        ("GET /export/results/csv", "get", "/export/{dataset}/{fmt}", "/export/results/csv", None),
+        ("GET /export/panels/parquet", "get", "/export/{dataset}/{fmt}", "/export/panels/parquet", None),
+        ("POST /export/results/arrow", "post", "/export/{dataset}/{fmt}", "/export/results/arrow", COHORT_FILTER),
+        ("POST /cohorts/{name}", "post", "/cohorts/{name}", f"/cohorts/{COHORT}", COHORT_FILTER),
+        ("GET /cohorts", "get", "/cohorts", "/cohorts", None),
+        ("GET /cohorts/{name}", "get", "/cohorts/{name}", f"/cohorts/{COHORT}", None),
+        ("GET /stats/summary cohort", "get", "/stats/summary", f"/stats/summary?cohort={COHORT}", None),
+        ("GET /stats/test cohort", "get", "/stats/test/{test_name}", f"/stats/test/{test}?cohort={COHORT}", None),
+        ("GET /coordering/top-pairs cohort", "get", "/coordering/top-pairs", f"/coordering/top-pairs?cohort={COHORT}", None),
+        ("GET /llm/frame", "get", "/llm/frame", "/llm/frame", None),
+        ("GET /llm/cache/stats", "get", "/llm/cache/stats", "/llm/cache/stats", None),
+        ("POST /llm/query sql", "post", "/llm/query", "/llm/query", {"prompt": "How many tests in total? #{i}", "mode": "sql"}),
+        ("POST /llm/query pandas", "post", "/llm/query", "/llm/query", {"prompt": "How many tests in total? #{i}", "mode": "pandas"}),
+        ("POST /llm/query/stream", "post", "/llm/query/stream", "/llm/query/stream", {"prompt": "How many tests? #{i}", "mode": "sql"}),
+    ]
+
+
+def start_stub_llm() -> str:
+    """Serveur LLM factice sur un port libre, dans un thread ; retourne son URL de base."""
+    import uvicorn
+    from stub_llm_server import app as stub_app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(stub_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def run_job(client, url: str, csv_path: Path) -> dict:
+    """Soumet un fichier et suit le job : durée totale et durée de chaque étape."""
+    t0 = time.perf_counter()
+    with open(csv_path, "rb") as f:
+        response = client.post(url, files={"file": (csv_path.name, f, "text/csv")})
+    response.raise_for_status()
+    job_id = response.json()["id"]
+
+    stages, stage, stage_start = {}, None, time.perf_counter()
+    while True:
+        job = client.get(f"/loader/jobs/{job_id}").json()
+        now = time.perf_counter()
+        if job["stage"] != stage:
+            if stage is not None:
+                stages[stage] = round(stages.get(stage, 0) + now - stage_start, 3)
+            stage, stage_start = job["stage"], now
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.02)
+    if job["status"] == "failed":
+        raise RuntimeError(f"Job {job_id} en échec : {job['error']}")
+    return {"seconds": round(time.perf_counter() - t0, 3), "rows_written": job["rows_written"], "stages": stages}
+
+
+def measure(client, response_cache, method: str, url: str, body, repeat: int) -> dict:
+    timings, status, size = [], None, 0
+    for i in range(repeat):
+        response_cache.clear()
+        payload = json.loads(json.dumps(body).replace("{i}", str(i))) if body is not None else None
+        t0 = time.perf_counter()
+        response = client.request(method.upper(), url, json=payload)
+        content = response.content
+        timings.append((time.perf_counter() - t0) * 1000)
+        status, size = response.status_code, len(content)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))], 2),
+        "min_ms": round(timings[0], 2),
+        "status": status,
+        "bytes": size,
+    }
+
+
+def sample_values(con) -> dict:
+    """Paramètres de chemin représentatifs : test et service les plus fréquents, patient le plus suivi."""
+    return {
+        "test": con.execute("SELECT nombre FROM results GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0],
+        "service": con.execute("SELECT nombre2 FROM results GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0],
+        "numorden": con.execute("SELECT numorden FROM panels GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0],
+    }
+
+
+def uncovered_routes(app, measured: set) -> list:
+    routes = [(m, p) for p, ops in app.openapi()["paths"].items() for m in ops]
+    return sorted(f"{m.upper()} {p}" for m, p in routes if (m, p) not in measured and (m, p) not in SKIPPED)
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """Régressions (médiane au-delà des seuils) ; les seuils par endpoint priment sur les défauts."""
+    thresholds = baseline.get("thresholds", {})
+    default = {**DEFAULT_THRESHOLDS, **thresholds.get("default", {})}
+    regressions = []
+
+    def check(name: str, current_ms: float, base_ms: float):
+        limit = {**default, **thresholds.get(name, {})}
+        if current_ms > base_ms * limit["max_ratio"] and current_ms - base_ms > limit["min_delta_ms"]:
+            regressions.append(f"{name}: {current_ms:.1f} ms (baseline {base_ms:.1f} ms, x{current_ms / base_ms:.2f})")
+
+    for name in ("ingestion", "append"):
+        if name in baseline and name in results:
+            check(name, results[name]["seconds"] * 1000, baseline[name]["seconds"] * 1000)
+    for name, current in results["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if base is not None:
+            check(name, current["p50_ms"], base["p50_ms"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LabLens (ingestion + endpoints)")
+    parser.add_argument("--rows", default="1M", help="taille du jeu synthétique (ex: 1M, 10M, 100M)")
+    parser.add_argument("--csv", default=None, help="CSV existant à la place du jeu synthétique")
+    parser.add_argument("--repeat", type=int, default=5, help="appels par endpoint")
+    parser.add_argument("--baseline", default=None, help="baseline JSON (défaut: benchmarks/baseline_<rows>.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="écrit les résultats comme nouvelle baseline")
+    parser.add_argument("--out", default=None, help="écrit aussi les résultats bruts dans ce fichier")
+    parser.add_argument("--workdir", default=None, help="dossier de travail (défaut: temporaire, supprimé à la fin)")
+    parser.add_argument("--no-llm", action="store_true", help="ne pas mesurer l'assistant LLM")
+    args = parser.parse_args()
+
+    label = Path(args.csv).stem if args.csv else args.rows
+    baseline_path = Path(args.baseline) if args.baseline else REPO_DIR / "benchmarks" / f"baseline_{label}.json"
+    csv_path = Path(args.csv).resolve() if args.csv else None
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="lablens-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    # Les chemins de données du backend sont relatifs : tout se passe dans le dossier de travail
+    os.chdir(workdir)
+    if csv_path is None:
+        rows = parse_rows(args.rows)
+        csv_path = workdir / "data" / "raw" / f"synthetic_{args.rows}.csv"
+        print(f"🔄 Génération de {rows:,} lignes...")
+        generate(str(csv_path), rows)
+    delta_path = workdir / "data" / "raw" / "delta.csv"
+    delta_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(csv_path, encoding="latin1") as f:
+        n_lines = sum(1 for _ in f) - 1
+    generate(str(delta_path), max(1, int(n_lines * APPEND_SHARE)), seed=7)
+
+    if not args.no_llm:
+        os.environ["LLM_BASE_URL"] = start_stub_llm()
+        os.environ["LLM_API_KEY"] = "stub"
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+
+    from fastapi.testclient import TestClient
+    from backend.database import _get_db
+    from backend.main import app
+    from backend.utils.cache import response_cache
+
+    results = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "csv": str(csv_path),
+            "csv_rows": n_lines,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": subprocess.run(["git", "-C", str(REPO_DIR), "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip(),
+        },
+        "endpoints": {},
+    }
+    try:
+        with TestClient(app) as client:
+            print("🔄 Ingestion complète...")
+            results["ingestion"] = run_job(client, "/loader/upload_file", csv_path)
+            print("🔄 Ajout incrémental...")
+            results["append"] = run_job(client, "/loader/append_file", delta_path)
+
+            cur = _get_db().cursor()
+            sample = sample_values(cur)
+            cur.close()
+            measured = set()
+            for name, method, route, url, body in cases(sample):
+                if args.no_llm and route.startswith("/llm/query"):
+                    continue
+                results["endpoints"][name] = measure(client, response_cache, method, url, body, args.repeat)
+                measured.add((method, route))
+                r = results["endpoints"][name]
+                print(f"  {name:<40} p50 {r['p50_ms']:>9.1f} ms  p95 {r['p95_ms']:>9.1f} ms  [{r['status']}]")
+            missing = uncovered_routes(app, measured)
+            if missing:
+                print(f"⚠️ Endpoints non mesurés : {missing}")
+    finally:
+        if not args.workdir:
+            os.chdir(REPO_DIR)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Ingestion : {results['ingestion']['seconds']:.1f}s {results['ingestion']['stages']}")
+    print(f"Ajout     : {results['append']['seconds']:.1f}s {results['append']['stages']}")
+    failed = [n for n, r in results["endpoints"].items() if r["status"] >= 400]
+    if failed:
+        print(f"⚠️ Endpoints en erreur : {failed}")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if args.update_baseline:
+        previous = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+        results["thresholds"] = previous.get("thresholds", {"default": DEFAULT_THRESHOLDS})
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"✅ Baseline écrite : {baseline_path}")
+        return 0
+
+    if not baseline_path.exists():
+        print(f"Pas de baseline ({baseline_path}) : relancer avec --update-baseline pour en créer une.")
+        return 0
+    regressions = compare(results, json.loads(baseline_path.read_text(encoding="utf-8")))
+    if regressions:
+        print("❌ Régressions :")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("✅ Aucune régression par rapport à la baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""
+generate_bloodwork.py
+
+Génère un CSV de résultats de biologie synthétique, au schéma du fichier source
+(`numorden, sexo, edad, nombre, textores, nombre2, Date`, cf. 01_inspect_data.py),
+à l'échelle voulue (1M, 10M, 100M lignes...) pour mesurer LabLens (voir benchmark.py).
+
+Modèle :
+    - patients : sexe, âge, service habituel ; 20 % de patients chroniques avec de
+      nombreuses visites espacées de quelques semaines, les autres 1 à 3 visites rapprochées
+    - visite (patient-jour) : un service, 1 à 3 bilans (NFS, ionogramme, bilan hépatique...)
+      tirés selon le service ; les chroniques refont surtout leurs bilans habituels (répétitions)
+    - résultat : valeur numérique par test (loi normale décalée par patient) ou qualitative
+      (NEG, TRACE, +...) pour les tests urinaires
+    - défauts du fichier réel : âge manquant ou nul, service vide, résultat vide, date invalide
+
+Le fichier est écrit par blocs de patients (mémoire bornée), encodé en latin1 comme la source.
+Même graine -> même fichier.
+
+Lancement :
+    python scripts/generate_bloodwork.py --rows 1M --out data/raw/synthetic_1M.csv
+"""
+
+import argparse
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Bilans : test -> (moyenne, écart-type, décimales) ou liste de (valeur qualitative, probabilité)
+PANELS = {
+    "NFS": {
+        "HEMOGLOBINE": (13.5, 1.6, 1),
+        "HEMATOCRITE": (41.0, 4.5, 1),
+        "LEUCOCYTES": (7.2, 2.1, 2),
+        "PLAQUETTES": (250, 60, 0),
+        "VGM": (90, 5, 1),
+    },
+    "IONOGRAMME": {
+        "SODIUM SANGUIN": (140, 3, 0),
+        "POTASSIUM": (4.2, 0.4, 1),
+        "CHLORE": (103, 3, 0),
+        "BICARBONATES": (25, 2.5, 0),
+    },
+    "RENAL": {
+        "CREATININE": (80, 25, 0),
+        "UREE": (5.5, 1.8, 1),
+    },
+    "HEPATIQUE": {
+        "ALAT": (28, 12, 0),
+        "ASAT": (26, 10, 0),
+        "GGT": (35, 25, 0),
+        "PHOSPHATASES ALCALINES": (80, 25, 0),
+        "BILIRUBINE TOTALE": (10, 5, 1),
+    },
+    "LIPIDES": {
+        "CHOLESTEROL TOTAL": (5.0, 1.0, 2),
+        "HDL CHOLESTEROL": (1.4, 0.35, 2),
+        "LDL CHOLESTEROL": (3.0, 0.9, 2),
+        "TRIGLYCÉRIDES": (1.4, 0.7, 2),
+    },
+    "GLYCEMIE": {
+        "GLUCOSE": (5.4, 1.2, 2),
+        "HBA1C": (5.8, 0.9, 1),
+    },
+    "INFLAMMATION": {
+        "CRP": (8, 15, 1),
+    },
+    "FER": {
+        "FERRITINE": (120, 90, 0),
+        "FER SERIQUE": (17, 6, 1),
+    },
+    "THYROIDE": {
+        "TSH": (2.0, 1.2, 2),
+        "T4 LIBRE": (15, 3, 1),
+    },
+    "CARDIAQUE": {
+        "TROPONINE": (10, 15, 1),
+        "NT-PROBNP": (300, 400, 0),
+    },
+    "COAGULATION": {
+        "TP": (90, 12, 0),
+        "INR": (1.1, 0.3, 2),
+    },
+    "PROTEINES": {
+        "Protéines totales": (70, 6, 0),
+        "ALBUMINE": (40, 5, 0),
+    },
+    "URINES": {
+        "URINE PROT": [("NEG", 0.70), ("TRACE", 0.15), ("+", 0.10), ("++", 0.05)],
+        "URINE GLUCOSE": [("NEG", 0.90), ("TRACE", 0.05), ("+", 0.05)],
+        "URINE SANG": [("NEG", 0.80), ("TRACE", 0.12), ("+", 0.08)],
+    },
+}
+
+# Service -> (poids dans l'activité, probabilité de chaque bilan par visite ; DEFAULT_PANEL_PROB sinon)
+SERVICES = {
+    "URGENCES": (0.25, {"NFS": 0.8, "IONOGRAMME": 0.7, "RENAL": 0.6, "INFLAMMATION": 0.6, "CARDIAQUE": 0.3, "HEPATIQUE": 0.3, "COAGULATION": 0.3}),
+    "MEDECINE INTERNE": (0.12, {"NFS": 0.7, "IONOGRAMME": 0.5, "INFLAMMATION": 0.5, "FER": 0.3, "PROTEINES": 0.3}),
+    "CARDIOLOGIE": (0.10, {"CARDIAQUE": 0.6, "LIPIDES": 0.5, "IONOGRAMME": 0.5, "RENAL": 0.4, "COAGULATION": 0.4}),
+    "NEPHROLOGIE": (0.07, {"RENAL": 0.9, "IONOGRAMME": 0.8, "NFS": 0.4, "URINES": 0.5, "PROTEINES": 0.3}),
+    "ENDOCRINOLOGIE": (0.07, {"GLYCEMIE": 0.9, "THYROIDE": 0.5, "LIPIDES": 0.5, "RENAL": 0.3}),
+    "GASTRO-ENTEROLOGIE": (0.07, {"HEPATIQUE": 0.9, "NFS": 0.5, "FER": 0.3, "PROTEINES": 0.3}),
+    "ONCOLOGIE": (0.08, {"NFS": 0.9, "HEPATIQUE": 0.5, "RENAL": 0.5, "INFLAMMATION": 0.3}),
+    "PEDIATRIE": (0.06, {"NFS": 0.7, "INFLAMMATION": 0.5, "URINES": 0.3}),
+    "GERIATRIE": (0.06, {"NFS": 0.6, "IONOGRAMME": 0.6, "RENAL": 0.6, "PROTEINES": 0.4}),
+    "REANIMATION": (0.04, {"NFS": 0.9, "IONOGRAMME": 0.9, "RENAL": 0.7, "COAGULATION": 0.6, "HEPATIQUE": 0.5}),
+    "CONSULTATION EXTERNE": (0.08, {"GLYCEMIE": 0.4, "LIPIDES": 0.4, "NFS": 0.3, "THYROIDE": 0.2}),
+}
+DEFAULT_PANEL_PROB = 0.03
+# Probabilité qu'un test d'un bilan prescrit soit effectivement rendu
+TEST_INCLUSION = 0.92
+
+CHRONIC_SHARE = 0.20
+CHRONIC_MEAN_VISITS, CHRONIC_MEAN_GAP_DAYS = 9, 35
+ACUTE_MEAN_VISITS, ACUTE_MEAN_GAP_DAYS = 1.4, 4
+# Probabilité qu'une visite d'un chronique reprenne ses bilans habituels
+CHRONIC_USUAL_PANEL_PROB = 0.85
+
+# Défauts du fichier réel
+MISSING_AGE_SHARE = 0.015
+ZERO_AGE_SHARE = 0.01
+MISSING_SERVICE_SHARE = 0.01
+MISSING_RESULT_SHARE = 0.015
+INVALID_DATE_SHARE = 0.001
+# Visites hors du service habituel du patient
+OTHER_SERVICE_SHARE = 0.2
+
+PATIENTS_PER_CHUNK = 50_000
+COLUMNS = ["numorden", "sexo", "edad", "nombre", "textores", "nombre2", "Date"]
+
+
+def parse_rows(value: str) -> int:
+    """'1M' -> 1_000_000, '500k' -> 500_000, '2500' -> 2500."""
+    value = value.strip().lower().replace("_", "")
+    factor = {"k": 1_000, "m": 1_000_000, "g": 1_000_000_000}.get(value[-1:], 1)
+    return int(float(value[:-1] if factor > 1 else value) * factor)
+
+
+class Catalogue:
+    """Tables numpy dérivées de PANELS / SERVICES, indexées par position."""
+
+    def __init__(self):
+        self.panels = list(PANELS)
+        self.tests = [t for p in self.panels for t in PANELS[p]]
+        self.test_panel = np.array([i for i, p in enumerate(self.panels) for _ in PANELS[p]])
+        specs = [PANELS[p][t] for p in self.panels for t in PANELS[p]]
+        self.qualitative = np.array([isinstance(s, list) for s in specs])
+        self.mean = np.array([0.0 if q else s[0] for s, q in zip(specs, self.qualitative)])
+        self.sd = np.array([0.0 if q else s[1] for s, q in zip(specs, self.qualitative)])
+        self.decimals = np.array([0 if q else s[2] for s, q in zip(specs, self.qualitative)])
+        self.levels = {i: s for i, s in enumerate(specs) if isinstance(s, list)}
+
+        self.services = list(SERVICES)
+        weights = np.array([SERVICES[s][0] for s in self.services])
+        self.service_weights = weights / weights.sum()
+        self.panel_prob = np.array([
+            [SERVICES[s][1].get(p, DEFAULT_PANEL_PROB) for p in self.panels] for s in self.services
+        ])
+
+
+def generate_chunk(rng: np.random.Generator, cat: Catalogue, first_patient: int, n_patients: int,
+                   start: date, n_days: int, date_labels: np.ndarray) -> pd.DataFrame:
+    """Un bloc de patients consécutifs, trié par patient puis date."""
+    # --- Patients
+    chronic = rng.random(n_patients) < CHRONIC_SHARE
+    sexo = np.where(rng.random(n_patients) < 0.52, "F", "M")
+    age = np.clip(rng.gamma(4.0, 13.0, n_patients), 1, 99).astype(int).astype(str).astype(object)
+    age_defect = rng.random(n_patients)
+    age[age_defect < MISSING_AGE_SHARE] = ""
+    age[(age_defect >= MISSING_AGE_SHARE) & (age_defect < MISSING_AGE_SHARE + ZERO_AGE_SHARE)] = "0"
+    home_service = rng.choice(len(cat.services), n_patients, p=cat.service_weights)
+    # Bilans habituels des chroniques : les plus probables de leur service, plus un au hasard
+    usual = np.zeros((n_patients, len(cat.panels)), dtype=bool)
+    top = np.argsort(-cat.panel_prob[home_service], axis=1)[:, :2]
+    np.put_along_axis(usual, top, True, axis=1)
+    usual[np.arange(n_patients), rng.integers(0, len(cat.panels), n_patients)] = True
+    # Décalage propre au patient : ses résultats restent cohérents d'une visite à l'autre
+    patient_z = rng.normal(0, 1, (n_patients, len(cat.tests)))
+
+    # --- Visites (patient-jours)
+    n_visits = np.where(
+        chronic,
+        1 + rng.poisson(CHRONIC_MEAN_VISITS - 1, n_patients),
+        1 + rng.poisson(ACUTE_MEAN_VISITS - 1, n_patients),
+    )
+    visit_patient = np.repeat(np.arange(n_patients), n_visits)
+    first_visit = np.repeat(np.cumsum(n_visits) - n_visits, n_visits)
+    gap_mean = np.where(chronic, CHRONIC_MEAN_GAP_DAYS, ACUTE_MEAN_GAP_DAYS)[visit_patient]
+    gaps = rng.geometric(1.0 / gap_mean)
+    gaps[np.arange(len(gaps)) == first_visit] = 0
+    offsets = np.cumsum(gaps)
+    offsets -= offsets[first_visit]
+    visit_day = rng.integers(0, n_days, n_patients)[visit_patient] + offsets
+    in_range = visit_day < n_days
+    visit_patient, visit_day = visit_patient[in_range], visit_day[in_range]
+    n = len(visit_patient)
+
+    visit_service = home_service[visit_patient]
+    elsewhere = rng.random(n) < OTHER_SERVICE_SHARE
+    visit_service[elsewhere] = rng.choice(len(cat.services), elsewhere.sum(), p=cat.service_weights)
+
+    # --- Bilans par visite, puis tests
+    prob = cat.panel_prob[visit_service]
+    repeat_usual = chronic[visit_patient] & (rng.random(n) < CHRONIC_USUAL_PANEL_PROB)
+    prob = np.where(repeat_usual[:, None] & usual[visit_patient], 0.95, prob)
+    panels = rng.random(prob.shape) < prob
+    # Au moins un bilan par visite : le plus probable du service
+    empty = ~panels.any(axis=1)
+    panels[empty, np.argmax(cat.panel_prob[visit_service[empty]], axis=1)] = True
+
+    tests = panels[:, cat.test_panel] & (rng.random((n, len(cat.tests))) < TEST_INCLUSION)
+    row_visit, row_test = np.nonzero(tests)
+    row_patient = visit_patient[row_visit]
+    m = len(row_visit)
+
+    # --- Résultats
+    z = 0.6 * patient_z[row_patient, row_test] + 0.8 * rng.normal(0, 1, m)
+    values = np.maximum(cat.mean[row_test] + cat.sd[row_test] * z, 0.05 * cat.mean[row_test])
+    textores = np.empty(m, dtype=object)
+    for decimals in np.unique(cat.decimals):
+        sel = (cat.decimals[row_test] == decimals) & ~cat.qualitative[row_test]
+        textores[sel] = np.char.mod(f"%.{decimals}f", values[sel])
+    for test, levels in cat.levels.items():
+        sel = row_test == test
+        labels, p = zip(*levels)
+        textores[sel] = rng.choice(np.array(labels, dtype=object), sel.sum(), p=p)
+    textores[rng.random(m) < MISSING_RESULT_SHARE] = ""
+
+    services = np.array(cat.services, dtype=object)[visit_service[row_visit]]
+    services[rng.random(m) < MISSING_SERVICE_SHARE] = ""
+
+    dates = date_labels[visit_day[row_visit]]
+    invalid = rng.random(m) < INVALID_DATE_SHARE
+    dates[invalid] = rng.choice(np.array(["", "31/02/2024", "2024-13-01"], dtype=object), invalid.sum())
+
+    ids = np.char.add("P", np.char.zfill((first_patient + np.arange(n_patients)).astype(str), 8))
+    return pd.DataFrame({
+        "numorden": ids[row_patient],
+        "sexo": sexo[row_patient],
+        "edad": age[row_patient],
+        "nombre": np.array(cat.tests, dtype=object)[row_test],
+        "textores": textores,
+        "nombre2": services,
+        "Date": dates,
+    }, columns=COLUMNS)
+
+
+def generate(out: str, rows: int, seed: int = 42, start: date = date(2023, 1, 1), end: date = date(2024, 12, 31),
+             patients_per_chunk: int = PATIENTS_PER_CHUNK) -> int:
+    """Écrit `rows` lignes dans `out` ; retourne le nombre de lignes écrites."""
+    rng = np.random.default_rng(seed)
+    cat = Catalogue()
+    n_days = (end - start).days + 1
+    date_labels = np.array([(start + timedelta(days=d)).strftime("%d/%m/%Y") for d in range(n_days)], dtype=object)
+
+    written, next_patient = 0, 1
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="latin1", newline="") as f:
+        f.write(",".join(COLUMNS) + "\n")
+        while written < rows:
+            chunk = generate_chunk(rng, cat, next_patient, patients_per_chunk, start, n_days, date_labels)
+            chunk = chunk.iloc[: rows - written]
+            chunk.to_csv(f, header=False, index=False)
+            written += len(chunk)
+            next_patient += patients_per_chunk
+            print(f"  {written:,} / {rows:,} lignes", end="\r", flush=True)
+    print()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Générateur de CSV de biologie synthétique")
+    parser.add_argument("--rows", default="1M", help="nombre de lignes (ex: 1M, 10M, 100M, 250k)")
+    parser.add_argument("--out", default=None, help="fichier de sortie (défaut: data/raw/synthetic_<rows>.csv)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start", default="2023-01-01", help="première date (YYYY-MM-DD)")
+    parser.add_argument("--end", default="2024-12-31", help="dernière date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    rows = parse_rows(args.rows)
+    out = args.out or f"data/raw/synthetic_{args.rows}.csv"
+    t0 = time.perf_counter()
+    written = generate(out, rows, args.seed, date.fromisoformat(args.start), date.fromisoformat(args.end))
+    print(f"✅ {written:,} lignes écrites dans {out} en {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+stub_llm_server.py
+
+Serveur local compatible OpenAI (POST /v1/chat/completions) pour tester l'assistant
+sans clé ni réseau. Les réponses sont déterministes :
+    - prompt système SQL    → requête SELECT sur `results`
+    - prompt système pandas → expression pandas sur `df`
+    - sinon (explication)   → phrase fixe, envoyée mot par mot si stream=true
+
+Lancement :
+    python scripts/stub_llm_server.py --port 8001
+    LLM_BASE_URL=http://127.0.0.1:8001/v1 LLM_API_KEY=stub uvicorn backend.main:app
+
+Option --delay : latence simulée (secondes) avant chaque réponse / entre deux tokens.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SQL_ANSWER = "SELECT COUNT(*) AS total_tests FROM results"
+PANDAS_ANSWER = "df['nombre'].count()"
+EXPLANATION = "The dataset contains this number of tests in total."
+
+app = FastAPI(title="LabLens stub LLM")
+app.state.delay = 0.0
+
+
+def _answer(messages: list) -> str:
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    if "DuckDB" in system:
+        return SQL_ANSWER
+    if "pandas" in system:
+        return PANDAS_ANSWER
+    return EXPLANATION
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub")
+    content = _answer(body.get("messages", []))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    delay = app.state.delay
+
+    if body.get("stream"):
+        async def events():
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for i, word in enumerate(content.split(" ")):
+                await asyncio.sleep(delay)
+                yield _chunk(completion_id, model, {"content": word if i == 0 else f" {word}"})
+            yield _chunk(completion_id, model, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(delay)
+    return JSONResponse({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(content.split()), "total_tokens": len(content.split())},
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur LLM factice compatible OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app.state.delay = args.delay
+    uvicorn.run(app, host=args.host, port=args.port)
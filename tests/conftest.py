@@ -0,0 +1,36 @@
+import queue
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend import database  # noqa: E402
+from backend.services import profile  # noqa: E402
+from backend.utils.cache import response_cache  # noqa: E402
+
+
+def _reset_state():
+    while True:
+        try:
+            database._pool.get_nowait().close()
+        except queue.Empty:
+            break
+    if database._db is not None:
+        database._db.close()
+    database._db = None
+    database._loaded_tables.clear()
+    database._version_cache = (None, "empty")
+    database._sandbox = (None, None)
+    profile._profile_cache = (None, None)
+    response_cache.clear()
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Dossier de travail vide : les chemins data/... (relatifs) et la base DuckDB y sont créés."""
+    monkeypatch.chdir(tmp_path)
+    _reset_state()
+    yield tmp_path / "data"
+    _reset_state()
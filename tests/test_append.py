@@ -0,0 +1,90 @@
+import csv
+
+import pytest
+
+from backend import database
+from backend.database import init_db, write_connection
+from backend.routers import loader
+from backend.services import profile
+from backend.services.cleaning import EXPECTED_COLS, RAW_ENCODING
+from backend.services.jobs import Job
+
+
+def write_csv(path, patients, day):
+    with open(path, "w", newline="", encoding=RAW_ENCODING) as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPECTED_COLS)
+        for numorden in patients:
+            writer.writerow([numorden, "F", 50, "GLUCOSE", "5.2", "URGENCES", day])
+            writer.writerow([numorden, "F", 50, "CREATININE", "80", "URGENCES", day])
+    return path
+
+
+@pytest.fixture
+def loaded(data_dir, tmp_path):
+    init_db()
+    loader._run_upload(write_csv(tmp_path / "base.csv", ["1001", "1002"], "05/01/2023"), Job("j0", "upload", "base.csv"))
+    return tmp_path
+
+
+def results_row_ids():
+    with write_connection() as con:
+        return [r[0] for r in con.execute("SELECT row_id FROM results ORDER BY row_id").fetchall()]
+
+
+def test_append_cleans_outside_write_lock(loaded, monkeypatch):
+    append_csv = loader.append_csv
+    held = []
+
+    def checked_append_csv(*args, **kwargs):
+        held.append(database._write_lock.locked())
+        return append_csv(*args, **kwargs)
+
+    monkeypatch.setattr(loader, "append_csv", checked_append_csv)
+    loader._run_append(write_csv(loaded / "a.csv", ["1003"], "06/01/2023"), Job("j1", "append", "a.csv"))
+
+    assert held == [False]
+    assert results_row_ids() == list(range(6))
+
+
+def test_append_rebased_when_another_version_is_published(loaded, monkeypatch):
+    append_csv = loader.append_csv
+    other = write_csv(loaded / "b.csv", ["1004"], "07/01/2023")
+
+    def append_csv_then_publish_other(*args, **kwargs):
+        result = append_csv(*args, **kwargs)
+        # Un autre ajout publie pendant que le premier lot attend le verrou
+        monkeypatch.setattr(loader, "append_csv", append_csv)
+        loader._run_append(other, Job("j2", "append", "b.csv"))
+        return result
+
+    monkeypatch.setattr(loader, "append_csv", append_csv_then_publish_other)
+    loader._run_append(write_csv(loaded / "a.csv", ["1003"], "06/01/2023"), Job("j1", "append", "a.csv"))
+
+    assert results_row_ids() == list(range(8))
+    with write_connection() as con:
+        panels = con.execute("SELECT numorden FROM panels ORDER BY numorden").fetchall()
+    assert [p[0] for p in panels] == ["1001", "1002", "1003", "1004"]
+    assert len(database.append_files()) == 2
+
+
+def test_append_writes_derived_deltas_and_merges_profile(loaded):
+    base = database.current_dir()
+    loader._run_append(write_csv(loaded / "a.csv", ["1002", "1003"], "06/01/2023"), Job("j1", "append", "a.csv"))
+    root = database.current_dir()
+
+    # Parquet principaux liés en dur depuis la version de départ, le lot n'ajoute qu'un delta par table
+    for name in ["panels", "repeats", "pairs", "service_pairs", "test_stats"]:
+        main = database.in_version(database.TABLE_SOURCES[name], root)
+        assert main.samefile(database.in_version(database.TABLE_SOURCES[name], base))
+        assert len(database.append_files(root, name)) == 1
+
+    with write_connection() as con:
+        tables = {t: con.execute(f"SELECT * FROM {t} ORDER BY ALL").fetchall() for t in ["repeats", "pairs", "service_pairs", "test_stats"]}
+        reloaded = {t: con.execute(f"SELECT * FROM ({database.source_select(t)}) ORDER BY ALL").fetchall() for t in tables}
+        full = profile.compute_profile(con)
+    assert reloaded == tables
+
+    merged = profile.read_profile()
+    assert {k: merged[k] for k in full if k != "age"} == {k: full[k] for k in full if k != "age"}
+    assert merged["age"] == pytest.approx(full["age"])
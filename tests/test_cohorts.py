@@ -0,0 +1,47 @@
+from backend import database
+from backend.database import dataset_version, write_connection
+from backend.routers import loader
+from backend.schemas import CohortFilter
+from backend.services import cohorts
+from backend.services.jobs import Job
+from tests.test_append import loaded, write_csv  # noqa: F401
+
+GLUCOSE = CohortFilter(conditions=[{"column": "nombre", "operator": "eq", "value": "GLUCOSE"}])
+
+
+def saved_then_stale(loaded):
+    with write_connection() as con:
+        meta = cohorts.save_cohort(con, "glucose", GLUCOSE)
+    loader._run_append(write_csv(loaded / "a.csv", ["1003"], "06/01/2023"), Job("j1", "append", "a.csv"))
+    assert meta["dataset_version"] != dataset_version()
+    return meta
+
+
+def test_stale_cohort_is_rebuilt_outside_write_lock(loaded, monkeypatch):
+    saved_then_stale(loaded)
+    evaluate_cohort = cohorts.evaluate_cohort
+    held = []
+
+    def checked_evaluate_cohort(*args, **kwargs):
+        held.append(database._write_lock.locked())
+        return evaluate_cohort(*args, **kwargs)
+
+    monkeypatch.setattr(cohorts, "evaluate_cohort", checked_evaluate_cohort)
+    meta = cohorts.ensure_current("glucose")
+
+    assert held == [False]
+    assert meta["dataset_version"] == dataset_version()
+    assert (meta["rows"], meta["patients"]) == (3, 3)
+
+
+def test_stale_cohort_served_while_a_write_is_running(loaded):
+    saved = saved_then_stale(loaded)
+
+    # Ingestion / ajout en cours : pas d'attente, la dernière matérialisation est servie
+    with database._write_lock:
+        meta = cohorts.ensure_current("glucose")
+    assert meta == saved
+
+    meta = cohorts.ensure_current("glucose")
+    assert meta["dataset_version"] == dataset_version()
+    assert meta["patients"] == 3
@@ -0,0 +1,29 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.test_append import loaded  # noqa: F401
+
+
+@pytest.fixture
+def client(loaded, monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    from backend.main import app
+
+    return TestClient(app)
+
+
+def test_top_pairs_by_month(client):
+    pairs = client.get("/coordering/top-pairs", params={"start": "2023-01", "end": "2023-01-31"}).json()
+    assert pairs == [{"test1": "CREATININE", "test2": "GLUCOSE", "co_occurrences": 2}]
+
+
+@pytest.mark.parametrize("start", ["2023-13", "2023-1x", "13/13/2023"])
+def test_invalid_month_is_rejected(client, start):
+    response = client.get("/coordering/top-pairs", params={"start": start})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_invalid_limit_is_rejected(client, limit):
+    assert client.get("/coordering/top-pairs", params={"limit": limit}).status_code == 422
+    assert client.get("/coordering/matrix-by-service", params={"limit": limit}).status_code == 422
@@ -0,0 +1,113 @@
+from datetime import date
+
+import duckdb
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+from backend.schemas import CohortFilter
+from backend.utils.filter_dsl import compile_filter
+
+# Une valeur NULL par colonne filtrée au moins : c'est là que SQL et Arrow peuvent diverger
+ROWS = {
+    "id": [1, 2, 3, 4, 5, 6],
+    "sexo": ["F", "M", None, "F", "M", "F"],
+    "edad": pa.array([40, 61, None, 33, 40, 75], type=pa.int16()),
+    "textores": ["5.10", "NEG", None, "6.40", "TRACE", "nan"],
+    "textores_num": [5.10, None, None, 6.40, None, None],
+    "textores_text": [None, "NEG", None, None, "TRACE", "nan"],
+    "Date": pa.array([date(2023, 1, 5), date(2023, 1, 5), None, date(2023, 2, 11), date(2023, 3, 20), date(2023, 1, 31)]),
+}
+
+CONDITIONS = [
+    ("edad", "eq", 40),
+    ("edad", "ne", 40),
+    ("edad", "gt", 40),
+    ("edad", "lt", 61),
+    ("edad", "gte", 61),
+    ("edad", "lte", 40),
+    ("edad", "between", [35, 70]),
+    ("edad", "between", [None, 40]),
+    ("edad", "in", [40, 75]),
+    ("edad", "not_in", [40]),
+    ("edad", "in", []),
+    ("edad", "not_in", []),
+    ("sexo", "eq", "F"),
+    ("sexo", "ne", "F"),
+    ("sexo", "in", ["F"]),
+    ("sexo", "not_in", ["F"]),
+    ("sexo", "contains", "M"),
+    ("sexo", "is_null", None),
+    ("sexo", "not_null", None),
+    ("textores", "gt", "5"),
+    ("textores", "between", ["4", "6"]),
+    ("textores_text", "in", ["NEG", "TRACE"]),
+    ("textores_text", "not_in", ["NEG"]),
+    ("Date", "gte", "2023-02-01"),
+    ("Date", "between", ["01/01/2023", "2023-01-31"]),
+    ("Date", "eq", "05/01/2023"),
+    ("Date", "not_in", ["2023-01-05"]),
+    ("Date", "is_null", None),
+]
+
+
+@pytest.fixture(scope="module")
+def results_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("filters") / "results.parquet"
+    pq.write_table(pa.table(ROWS), path)
+    return path
+
+
+def run_both(path, filters: dict):
+    compiled = compile_filter(CohortFilter(**filters), pq.read_schema(path))
+    assert compiled.arrow is not None, "condition sans équivalent Arrow"
+    sql_ids = duckdb.connect().execute(
+        f"SELECT id FROM read_parquet('{path.as_posix()}') WHERE {compiled.sql}", compiled.params
+    ).fetchall()
+    arrow_ids = ds.dataset(path, format="parquet").to_table(columns=["id"], filter=compiled.arrow)["id"].to_pylist()
+    return sorted(i for (i,) in sql_ids), sorted(arrow_ids)
+
+
+@pytest.mark.parametrize("column,operator,value", CONDITIONS, ids=[f"{c}-{o}-{v}" for c, o, v in CONDITIONS])
+def test_sql_and_arrow_select_the_same_rows(results_path, column, operator, value):
+    sql_ids, arrow_ids = run_both(results_path, {"conditions": [{"column": column, "operator": operator, "value": value}]})
+    assert sql_ids == arrow_ids
+
+
+def test_not_in_excludes_nulls(results_path):
+    sql_ids, arrow_ids = run_both(results_path, {"conditions": [{"column": "textores_text", "operator": "not_in", "value": ["NEG"]}]})
+    assert sql_ids == arrow_ids == [5, 6]
+
+
+def test_nested_groups_parity(results_path):
+    filters = {
+        "logic": "OR",
+        "conditions": [
+            {"column": "sexo", "operator": "not_in", "value": ["F"]},
+            {"logic": "AND", "conditions": [
+                {"column": "edad", "operator": "gte", "value": 40},
+                {"column": "textores_text", "operator": "is_null"},
+            ]},
+        ],
+    }
+    sql_ids, arrow_ids = run_both(results_path, filters)
+    assert sql_ids == arrow_ids == [1, 2, 5]
+
+
+@pytest.mark.parametrize("operator,value", [
+    ("eq", [1]),
+    ("gt", {"value": 1}),
+    ("between", [[1], 50]),
+    ("in", [[40]]),
+    ("contains", ["4"]),
+])
+def test_non_scalar_values_are_rejected(results_path, operator, value):
+    with pytest.raises(ValueError):
+        compile_filter(CohortFilter(conditions=[{"column": "edad", "operator": operator, "value": value}]), pq.read_schema(results_path))
+
+
+def test_non_scalar_numeric_text_value_is_rejected(results_path):
+    schema = pq.read_schema(results_path).remove(pq.read_schema(results_path).get_field_index("textores_num"))
+    with pytest.raises(ValueError):
+        compile_filter(CohortFilter(conditions=[{"column": "textores", "operator": "gt", "value": [5]}]), schema)
@@ -0,0 +1,43 @@
+import importlib
+
+import pytest
+
+from backend import database
+from backend.database import write_connection
+from tests.test_append import loaded, write_csv  # noqa: F401
+
+ESCAPES = [
+    # CTE interne du même nom que la table visée : la référence externe vise la vraie table
+    "SELECT * FROM cohorts, (WITH cohorts AS (SELECT 1 AS x) SELECT * FROM cohorts) t",
+    "SELECT * FROM lablens_meta WHERE EXISTS (WITH lablens_meta AS (SELECT 1) SELECT 1 FROM lablens_meta)",
+]
+
+
+@pytest.fixture
+def llm_service(monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    return importlib.import_module("backend.services.llm_service")
+
+
+@pytest.mark.parametrize("sql", ESCAPES)
+def test_inner_cte_does_not_allow_outer_table(loaded, llm_service, sql):
+    with pytest.raises(ValueError, match="Table not allowed"):
+        llm_service.safe_execute_sql(sql)
+
+
+def test_cte_in_scope_is_allowed(loaded, llm_service):
+    rows = llm_service.safe_execute_sql("WITH t AS (SELECT numorden FROM results) SELECT count(*) AS n FROM t")
+    assert rows == [{"n": 4}]
+
+
+def test_sandbox_only_sees_allowlisted_tables(loaded, llm_service):
+    with write_connection() as con:
+        assert con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = 'lablens_meta'").fetchone()[0] == 1
+
+    con = database.sandbox_cursor(llm_service.SQL_TABLES)
+    tables = con.execute("SELECT table_name FROM duckdb_tables() UNION ALL SELECT view_name FROM duckdb_views() WHERE NOT internal").fetchall()
+    assert sorted(t[0] for t in tables) == sorted(llm_service.SQL_TABLES)
+    # Vue sur le Parquet de la version publiée : rien n'est écrit dans la base persistante
+    con.execute("CREATE TABLE scratch AS SELECT 1")
+    with write_connection() as main:
+        assert main.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = 'scratch'").fetchone()[0] == 0
@@ -0,0 +1,92 @@
+import math
+import shutil
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.database import init_db, write_connection
+from backend.services.migrations import migrate_dataset
+
+# Format écrit par le loader d'origine : tout en texte sauf edad, textores manquant stocké en 'nan'
+BASELINE_ROWS = [
+    ("1001", "F", 54, "GLUCOSE", "5.10", "URGENCES", "2023-01-05"),
+    ("1001", "F", 54, "CREATININE", "nan", "URGENCES", "2023-01-05"),
+    ("1001", "F", 54, "GLUCOSE", "6.40", "URGENCES", "2023-02-11"),
+    ("1002", "M", 61, "GLUCOSE", "nan", "NEPHRO", "2023-01-05"),
+    ("1002", "M", 61, "URINE PROT", "NEG", "NEPHRO", "2023-01-05"),
+    ("1002", "M", 61, "CREATININE", "98.00", "NEPHRO", "2023-01-05"),
+    ("1003", "F", 33, "GLUCOSE", "4.90", "nan", "2023-03-20"),
+]
+COLUMNS = ["numorden", "sexo", "edad", "nombre", "textores", "nombre2", "Date"]
+
+
+def write_baseline_results(data_dir, string_type=pa.string()):
+    columns = list(zip(*BASELINE_ROWS))
+    table = pa.table({
+        name: pa.array(values, type=pa.int64() if name == "edad" else string_type)
+        for name, values in zip(COLUMNS, columns)
+    })
+    processed = data_dir / "processed"
+    processed.mkdir(parents=True)
+    pq.write_table(table, processed / "results.parquet")
+
+
+def start_app():
+    # Même séquence qu'au démarrage (main.on_startup)
+    init_db()
+    migrate_dataset()
+
+
+def test_baseline_results_with_nan_textores_migrate(data_dir):
+    write_baseline_results(data_dir)
+    start_app()
+
+    with write_connection() as con:
+        non_finite = con.execute("SELECT COUNT(*) FROM results WHERE NOT isfinite(textores_num)").fetchone()[0]
+        nan_rows = con.execute("SELECT textores_num, textores_text FROM results WHERE textores = 'nan'").fetchall()
+        glucose = con.execute("SELECT n_rows, n_numeric, mean, std FROM test_stats WHERE test_key = 'glucose'").fetchone()
+        date_type = con.execute("SELECT typeof(Date) FROM results LIMIT 1").fetchone()[0]
+
+    assert non_finite == 0
+    assert all(num is None for num, _ in nan_rows)
+    n_rows, n_numeric, mean, std = glucose
+    assert (n_rows, n_numeric) == (4, 3)
+    assert math.isclose(mean, (5.10 + 6.40 + 4.90) / 3)
+    assert math.isfinite(std)
+    assert date_type == "DATE"
+
+
+@pytest.mark.parametrize("string_type", [pa.string(), pa.large_string()], ids=["string", "large_string"])
+def test_baseline_text_dates_migrate(data_dir, string_type):
+    write_baseline_results(data_dir, string_type)
+    start_app()
+
+    with write_connection() as con:
+        row = con.execute("""
+            SELECT typeof(Date), year_month, day FROM results WHERE numorden = '1003'
+        """).fetchone()
+        panels = con.execute("SELECT COUNT(*) FROM panels").fetchone()[0]
+
+    assert row == ("DATE", "2023-03", 20230320)
+    assert panels == 4
+
+
+def test_shipped_layout_without_results_keeps_summaries(data_dir, monkeypatch):
+    # Données livrées dans le dépôt : panels / repeats dans data/processed, sans results.parquet
+    shipped = Path(__file__).resolve().parents[1] / "data" / "processed"
+    (data_dir / "processed").mkdir(parents=True)
+    for name in ["panels.parquet", "repeats.parquet"]:
+        shutil.copy(shipped / name, data_dir / "processed" / name)
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    from backend.main import app
+
+    with TestClient(app) as client:
+        panels = client.get("/panels/summary").json()
+        repeats = client.get("/repeats/summary").json()
+
+    assert panels["total_panels"] == 176280
+    assert repeats["patients_with_repeats"] > 0 and repeats["tests_repeated"] > 0
+    assert (data_dir / "processed" / "current" / "panels.parquet").exists()
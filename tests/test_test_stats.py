@@ -0,0 +1,70 @@
+import duckdb
+import pytest
+
+from backend.services import derived
+
+COLUMNS = ["test_key", "test", "names", "n_rows", "n_numeric", "mean", "std", "quantiles", "top_values"]
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    # Graphies et valeurs qualitatives mêlées, 'nan' non numérique, un test sans valeur numérique, un test à une seule valeur
+    con.execute("""
+        CREATE TABLE results AS
+        SELECT
+            i,
+            CASE i % 4 WHEN 0 THEN 'Glucose' WHEN 1 THEN 'GLUCOSE ' WHEN 2 THEN 'Urine prot' ELSE 'Créatinine' END AS nombre,
+            CASE WHEN i % 4 = 2 THEN (['NEG', 'TRACE', '+'])[i % 3 + 1] WHEN i % 13 = 0 THEN 'nan' ELSE CAST(round((i * 37 % 101) / 10, 1) AS VARCHAR) END AS textores
+        FROM range(2000) t(i)
+        UNION ALL SELECT 2000, 'Ferritine', '42.0'
+    """)
+    con.execute("ALTER TABLE results ADD COLUMN textores_num DOUBLE")
+    con.execute("UPDATE results SET textores_num = CASE WHEN isfinite(TRY_CAST(textores AS DOUBLE)) THEN TRY_CAST(textores AS DOUBLE) END")
+    yield con
+    con.close()
+
+
+def merged_in_batches(con, batches):
+    """Résumé construit lot par lot comme à l'ajout : fusion de l'état existant et du résumé du lot."""
+    con.execute(f"CREATE OR REPLACE TABLE test_stats AS {derived.test_stats_select(f'(SELECT * FROM results WHERE {batches[0]}) AS results')}")
+    for where in batches[1:]:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE batch AS {derived.test_stats_select(f'(SELECT * FROM results WHERE {where}) AS results')}")
+        con.execute(f"""
+            CREATE OR REPLACE TABLE test_stats AS
+            {derived.test_stats_merge_select("SELECT * FROM test_stats UNION ALL BY NAME SELECT * FROM batch")}
+        """)
+    return con.execute(f"SELECT {', '.join(COLUMNS)} FROM test_stats ORDER BY test_key").fetchall()
+
+
+def assert_same_stats(merged, full):
+    assert len(merged) == len(full)
+    for m, f in zip(merged, full):
+        m, f = dict(zip(COLUMNS, m)), dict(zip(COLUMNS, f))
+        for key in ["test_key", "test", "n_rows", "n_numeric", "top_values"]:
+            assert m[key] == f[key], key
+        assert sorted(m["names"]) == sorted(f["names"])
+        assert m["mean"] == pytest.approx(f["mean"])
+        assert m["std"] == pytest.approx(f["std"])
+        assert m["quantiles"] == pytest.approx(f["quantiles"])
+
+
+def test_merged_batches_match_full_computation(con):
+    full = con.execute(f"SELECT {', '.join(COLUMNS)} FROM ({derived.test_stats_select()}) ORDER BY test_key").fetchall()
+    merged = merged_in_batches(con, ["i < 700", "i >= 700 AND i < 1500", "i >= 1500"])
+    assert_same_stats(merged, full)
+
+
+def test_value_sketch_is_bounded(con):
+    # Une valeur distincte par ligne : l'histogramme est compressé, minimum et maximum restent exacts
+    con.execute("UPDATE results SET nombre = 'Créatinine', textores_num = i + 0.5, textores = CAST(i + 0.5 AS VARCHAR) WHERE i % 2 = 1")
+    merged = merged_in_batches(con, ["i < 1000", "i >= 1000"])
+    sketch = con.execute("SELECT len(value_counts), n_numeric, quantiles FROM test_stats WHERE test_key = 'creatinine'").fetchone()
+    full = con.execute(f"SELECT quantiles FROM ({derived.test_stats_select()}) WHERE test_key = 'creatinine'").fetchone()[0]
+
+    assert len(merged) == 4
+    assert sketch[0] <= derived.TEST_SKETCH_BINS
+    assert sketch[1] == 1000
+    assert sketch[2][0] == full[0] and sketch[2][-1] == full[-1]
+    # Erreur de l'ordre d'un intervalle de l'histogramme (1 / TEST_SKETCH_BINS des valeurs)
+    assert sketch[2] == pytest.approx(full, abs=2 * (full[-1] - full[0]) / derived.TEST_SKETCH_BINS)